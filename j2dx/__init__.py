@@ -1,32 +1,14 @@
-print("Starting J2DX...")
-
 import os
 import sys
 import logging
 import platform
-import socket
-import asyncio
 from argparse import ArgumentParser
-import qrcode
-# Import FastAPI and updated socketio imports
-import socketio
-from fastapi import FastAPI, Response
-from fastapi.middleware.cors import CORSMiddleware
-import uvicorn
 
-if platform.system() == 'Linux':
-    print("Linux system detected")
-    from j2dx.nix.device import X360Device, DS4Device
-    from j2dx.nix.setup import setup
-    print("Linux modules imported")
-elif platform.system() == 'Windows':
-    print("Windows system detected")
-    from j2dx.win.device import X360Device, DS4Device
-    from j2dx.win.setup import setup
-    print("Windows modules imported")
+from j2dx import realtime
+from j2dx.throttle import POLICIES
 
-# Import compatibility wrapper
-from j2dx.compatibility_wrapper import CompatibilityWrapper
+# Heavy modules (the web stack, device backends, QR codes) are imported
+# where they are used, so --help and --setup start instantly
 
 def get_logger(debug):
     logging.basicConfig(level=logging.DEBUG if debug else logging.INFO)
@@ -35,6 +17,7 @@ def get_logger(debug):
     return (logging.getLogger('J2DX.server'), wsgi_logger)
 
 def default_host():
+    import socket
     sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
     try:
         sock.connect(('1.255.255.255', 1))
@@ -45,8 +28,38 @@ def default_host():
         sock.close()
     return IP
 
+BACKENDS = ('auto', 'uinput', 'vigem', 'null', 'recording')
+
+def load_backend(name):
+    """
+    Returns the X360Device and DS4Device classes of a device backend.
+    'auto' picks uinput on Linux and ViGEm on Windows. 'null' discards
+    every write and 'recording' keeps the event stream in memory, both
+    run on any platform without device drivers. Raises RuntimeError when
+    the backend cannot be loaded on this system.
+    """
+    if name == 'auto':
+        name = 'vigem' if platform.system() == 'Windows' else 'uinput'
+    try:
+        if name == 'uinput':
+            from j2dx.nix.device import X360Device, DS4Device
+        elif name == 'vigem':
+            from j2dx.win.device import X360Device, DS4Device
+        elif name == 'null':
+            from j2dx.null.device import X360Device, DS4Device
+        elif name == 'recording':
+            from j2dx.null.recording import X360Device, DS4Device
+        else:
+            raise ValueError(f'Unknown backend: {name}')
+    except ImportError as e:
+        if name == 'uinput':
+            raise RuntimeError(f'The uinput backend needs Linux and the evdev package: {e}') from e
+        if name == 'vigem':
+            raise RuntimeError(f'The vigem backend needs Windows and ViGEmBus: {e}') from e
+        raise RuntimeError(f'Could not load the {name} backend: {e}') from e
+    return X360Device, DS4Device
+
 def parse_args():
-    print("Parsing arguments")
     parser = ArgumentParser()
     if platform.system() == 'Linux':
         parser.add_argument(
@@ -75,196 +88,151 @@ def parse_args():
         action='store_true',
         help='Print debug information.'
     )
-    args = parser.parse_args()
-    print(f"Arguments parsed: {args}")
-    return args
+    parser.add_argument(
+        '-b', '--backend',
+        choices=BACKENDS, default='auto',
+        help='Virtual device backend. Defaults to uinput on Linux '
+             'and ViGEm on Windows.'
+    )
+    parser.add_argument(
+        '-a', '--axis-config',
+        default=None,
+        help='JSON file with per-axis deadzones, curves and inversion '
+             'and radial stick deadzones.'
+    )
+    parser.add_argument(
+        '-u', '--udp-port',
+        type=int, default=None,
+        help='Also accept input frames over UDP on this port. Disabled by default.'
+    )
+    parser.add_argument(
+        '--http-timeout',
+        type=float, default=30.0,
+        help='Seconds without input after which an HTTP session and its '
+             'device are removed. Defaults to 30.'
+    )
+    parser.add_argument(
+        '--ping-interval',
+        type=float, default=5.0,
+        help='Seconds between Engine.IO pings. Defaults to 5.'
+    )
+    parser.add_argument(
+        '--ping-timeout',
+        type=float, default=5.0,
+        help='Seconds without a pong after which a Socket.IO client is '
+             'disconnected and its controllers removed. Defaults to 5.'
+    )
+    parser.add_argument(
+        '--heartbeat',
+        type=float, default=1.0,
+        help='Seconds between heartbeat events measuring the round trip '
+             'time of each Socket.IO client, 0 disables them. Defaults to 1.'
+    )
+    parser.add_argument(
+        '--heartbeat-timeout',
+        type=float, default=3.0,
+        help='Seconds a client may leave a heartbeat unanswered before its '
+             'controllers are returned to neutral. Defaults to 3.'
+    )
+    parser.add_argument(
+        '--slots',
+        type=int, default=4,
+        help='Controllers a single Socket.IO connection may create, '
+             'addressed by slot 0 to slots - 1. Defaults to 4.'
+    )
+    parser.add_argument(
+        '--resume-grace',
+        type=float, default=10.0,
+        help='Seconds a disconnected client\'s controller is kept, in '
+             'neutral state, so the client can resume it after reconnecting. '
+             '0 disables resuming. Defaults to 10.'
+    )
+    parser.add_argument(
+        '--pool-xbox',
+        type=int, default=0,
+        help='Number of idle Xbox 360 devices to keep ready. Defaults to 0.'
+    )
+    parser.add_argument(
+        '--pool-ds4',
+        type=int, default=0,
+        help='Number of idle DualShock 4 devices to keep ready. Defaults to 0.'
+    )
+    parser.add_argument(
+        '--writer-process',
+        action='store_true',
+        help='Run the virtual devices in a separate process fed through '
+             'shared memory, so device writes and networking use separate cores.'
+    )
+    parser.add_argument(
+        '--realtime',
+        action='store_true',
+        help='Use uvloop if installed, raise the priority of the event loop, '
+             'run device writes on a SCHED_FIFO thread and lock memory, '
+             'where permitted.'
+    )
+    parser.add_argument(
+        '--loop-cores',
+        type=realtime.parse_cores, default=None,
+        help='With --realtime, cores to pin the event loop to, e.g. "2" or "2-3".'
+    )
+    parser.add_argument(
+        '--writer-cores',
+        type=realtime.parse_cores, default=None,
+        help='With --realtime, cores to pin the device writer to.'
+    )
+    parser.add_argument(
+        '--dump-dir',
+        default=None,
+        help='Only used with --backend recording. Directory each device '
+             'dumps its recorded event stream to when closed.'
+    )
+    parser.add_argument(
+        '--input-rate',
+        type=float,
+        default=10000,
+        help='Input events per second each client may send before its analog '
+             'input is throttled. 0 disables the limit. Defaults to 10000.'
+    )
+    parser.add_argument(
+        '--input-burst',
+        type=int,
+        default=1000,
+        help='Input events a client may send at once above --input-rate. '
+             'Defaults to 1000.'
+    )
+    parser.add_argument(
+        '--throttle',
+        choices=POLICIES,
+        default='coalesce',
+        help='What happens to analog input over budget: coalesce holds it back '
+             'and sends the newest value per axis once the budget allows, drop '
+             'discards it. Defaults to coalesce.'
+    )
+    parser.add_argument(
+        '--record',
+        default=None,
+        metavar='PATH',
+        help='Append every input event to a binary log at PATH, to be '
+             'replayed with python -m j2dx.utils.replay.'
+    )
+    return parser.parse_args()
 
 def main():
-    print("Entering main function")
     args = parse_args()
     logger, wsgi_logger = get_logger(args.debug)
-    print(f"Args parsed: {args}")
+    logger.debug(f'Arguments: {args}')
 
     if args.setup:
-        print("Setup mode detected")
-        setup(args.user if platform.system() == 'Linux' else None)
+        if platform.system() == 'Linux':
+            from j2dx.nix.setup import setup
+            setup(args.user)
+        else:
+            from j2dx.win.setup import setup
+            setup(None)
         sys.exit(0)
-        return
-
-    print("Initializing server")
-    CLIENTS = {}
-    DEVICES = {}
-    
-    # Create FastAPI app
-    app = FastAPI(title="Joy2DroidX Server")
-    
-    # Add CORS middleware with broader settings
-    app.add_middleware(
-        CORSMiddleware,
-        allow_origins=["*"],  # Allow all origins
-        allow_credentials=True,
-        allow_methods=["*"],
-        allow_headers=["*"],
-    )
-    
-    # Setup Socket.IO with more permissive CORS settings
-    sio = socketio.AsyncServer(
-        async_mode='asgi',
-        cors_allowed_origins="*",  # Allow all origins with string instead of list
-        logger=args.debug,
-        engineio_logger=args.debug,
-        ping_interval=25000,
-        ping_timeout=60000,
-    )
-    
-    # Create Socket.IO application with FastAPI integration
-    socket_app = socketio.ASGIApp(sio, app)
-    
-    # Create compatibility wrapper
-    compat = CompatibilityWrapper(sio)
-    
-    # Define event handlers directly with the Socket.IO server
-    @sio.event
-    async def connect(sid, environ):
-        try:
-            client_addr = environ.get('REMOTE_ADDR', 'unknown')
-            headers = environ.get('asgi.scope', {}).get('headers', [])
-            
-            # Try to get forwarded IP if behind proxy
-            for name, value in headers:
-                if name == b'x-forwarded-for':
-                    client_addr = value.decode('utf-8').split(',')[0].strip()
-                    break
-                    
-            CLIENTS[sid] = client_addr
-        except Exception as e:
-            logger.error(f"Error handling connection: {e}")
-            CLIENTS[sid] = 'unknown'
-            
-        logger.info(f'Client connected from {CLIENTS[sid]}')
-        logger.debug(f'Client {CLIENTS[sid]} sessionId: {sid}')
-
-    @sio.event
-    async def disconnect(sid):
-        if sid in DEVICES:
-            DEVICES[sid].close()
-            del DEVICES[sid]
-        if sid in CLIENTS:
-            del CLIENTS[sid]
-        logger.info(f'Client disconnected: {sid}')
 
-    # Handler for Xbox controller request
-    @sio.event
-    async def xbox(sid, *args):
-        if sid not in DEVICES:
-            DEVICES[sid] = X360Device(sid, CLIENTS.get(sid, 'unknown'))
-        logger.info(f'Xbox 360 controller created for {CLIENTS.get(sid, "unknown")}')
-
-    # Handler for PS4/DS4 controller request
-    @sio.event
-    async def ds4(sid, *args):
-        if sid not in DEVICES:
-            DEVICES[sid] = DS4Device(sid, CLIENTS.get(sid, 'unknown'))
-        logger.info(f'DualShock 4 controller created for {CLIENTS.get(sid, "unknown")}')
-
-    # Handler for input events
-    @sio.event
-    async def input(sid, data):
-        if sid in DEVICES:
-            try:
-                # Handle both object and separate parameters formats
-                if isinstance(data, dict) and 'key' in data and 'value' in data:
-                    key = data['key']
-                    value = data['value']
-                    
-                    # Enhanced debug logging
-                    input_type = "Button" if isinstance(value, bool) else "Analog"
-                    logger.info(f"[INCOMING] {input_type} Input from {CLIENTS.get(sid, 'unknown')}: {key}={value}")
-                    print(f"[RECEIVED] Input: {key}={value} from {CLIENTS.get(sid, 'unknown')}")
-                    
-                    DEVICES[sid].send(key, value)
-                else:
-                    logger.warning(f"Received invalid input format: {data}")
-                    print(f"[ERROR] Invalid input format received: {data}")
-            except Exception as e:
-                logger.error(f"Error processing input: {e}")
-                print(f"[ERROR] Processing input: {e}")
-
-    # HTTP routes for fallback mechanism
-    @app.get("/status")
-    async def status():
-        return {"status": "ok", "clients": len(CLIENTS)}
-    
-    @app.post("/message")
-    async def message(data: dict):
-        try:
-            event = data.get("event")
-            payload = data.get("data", {})
-            
-            if event == "xbox":
-                # Create a temporary session ID for HTTP clients
-                sid = f"http-{len(CLIENTS) + 1}"
-                CLIENTS[sid] = "http-client"
-                DEVICES[sid] = X360Device(sid, "http-client")
-                return {"status": "ok", "controller": "xbox"}
-            
-            elif event == "ds4":
-                # Create a temporary session ID for HTTP clients
-                sid = f"http-{len(CLIENTS) + 1}"
-                CLIENTS[sid] = "http-client"
-                DEVICES[sid] = DS4Device(sid, "http-client")
-                return {"status": "ok", "controller": "ds4"}
-                
-            elif event == "input" and isinstance(payload, dict):
-                # Find an HTTP client to send input to
-                http_sids = [sid for sid in DEVICES if sid.startswith("http-")]
-                if http_sids:
-                    sid = http_sids[0]
-                    DEVICES[sid].send(payload.get("key"), payload.get("value"))
-                    return {"status": "ok"}
-                else:
-                    return {"status": "error", "message": "No HTTP client device found"}
-            
-            elif event == "ping":
-                return {"status": "ok", "pong": True}
-                
-            return {"status": "error", "message": "Unknown event"}
-        except Exception as e:
-            logger.error(f"Error handling HTTP message: {e}")
-            return {"status": "error", "message": str(e)}
-
-    try:
-        host = args.host or default_host()
-        print(f"Starting server on {host}:{args.port}")
-        logger.info(f'Listening on http://{host}:{args.port}/')
-        
-        qr = qrcode.QRCode()
-        qr.add_data(f'j2dx://{host}:{args.port}/')
-        if platform.system() == 'Windows':
-            import colorama
-            colorama.init()
-        qr.print_ascii(tty=True)
-        
-        # Run the Uvicorn server with the FastAPI app
-        config = uvicorn.Config(
-            app=socket_app, 
-            host=host, 
-            port=args.port,
-            log_level="debug" if args.debug else "info",
-        )
-        server = uvicorn.Server(config)
-        loop = asyncio.get_event_loop()
-        loop.run_until_complete(server.serve())
-        
-    except PermissionError:
-        sys.exit(
-            f'Port {args.port} is not available. '
-            f'Please specify a different port with -p option.'
-        )
-    except Exception as e:
-        print(f"Error starting server: {e}")
-        sys.exit(1)
+    from j2dx.server import serve
+    serve(args)
 
 if __name__ == '__main__':
-    print("Running main")
-    main()
\ No newline at end of file
+    main()
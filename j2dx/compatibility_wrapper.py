@@ -2,61 +2,64 @@
 Compatibility wrapper per supportare client Socket.IO di versioni diverse.
 """
 import logging
+from urllib.parse import parse_qs
+
 from socketio import AsyncServer
 
+from j2dx.protocol import CODECS, decode_dict
+
 logger = logging.getLogger('J2DX.compatibility')
 
 class CompatibilityWrapper:
     """
-    Wrapper che garantisce la compatibilità tra versioni diverse di Socket.IO
+    Wrapper che garantisce la compatibilità tra versioni diverse di Socket.IO.
+
+    Il formato degli eventi di input viene scelto una sola volta per
+    sessione, alla connessione, invece di essere riconosciuto a ogni
+    messaggio (vedi j2dx.protocol per i codec disponibili).
     """
-    
+
     def __init__(self, server: AsyncServer):
         """
         Inizializza il wrapper.
         """
         self.sio = server
-        self._register_middleware()
-        
-    def _register_middleware(self):
+        self.codecs = {}
+
+    def negotiate(self, sid, environ):
         """
-        Registra middleware per gestire diversi formati di messaggi.
+        Sceglie il codec della sessione: quello richiesto con ?codec=...,
+        altrimenti argomenti separati per i client Engine.IO v3 e
+        dizionario per tutti gli altri. Restituisce il nome del codec.
         """
-        @self.sio.on('connect')
-        async def on_connect(sid, environ):
-            logger.debug(f"Connection detected: {sid}")
-            try:
-                # Ottieni informazioni sulla versione del client
-                query_string = ""
-                if 'QUERY_STRING' in environ:
-                    query_string = environ['QUERY_STRING']
-                elif 'asgi.scope' in environ:
-                    query_string = environ['asgi.scope'].get('query_string', b'').decode()
-                
-                if 'EIO=3' in query_string:
-                    logger.info(f"Socket.IO v3 client detected: {sid}")
-                elif 'EIO=4' in query_string:
-                    logger.info(f"Socket.IO v4 client detected: {sid}")
-                else:
-                    logger.info(f"Unknown Socket.IO version, assuming v4: {sid}")
-            except Exception as e:
-                logger.error(f"Error detecting client version: {e}")
-        
-        # Intercept events before they're processed to standardize format
-        @self.sio.event
-        async def input(sid, *args, **kwargs):
-            try:
-                # Handle different input formats from different client versions
-                if len(args) == 1 and isinstance(args[0], dict):
-                    # Modern Socket.IO format (single object)
-                    return {'key': args[0].get('key'), 'value': args[0].get('value')}
-                elif len(args) >= 2:
-                    # Legacy Socket.IO v3 format (multiple arguments)
-                    return {'key': args[0], 'value': args[1]}
-            except Exception as e:
-                logger.error(f"Error normalizing input data: {e}")
-                return {'error': str(e)}
-    
+        query_string = ""
+        try:
+            # Ottieni informazioni sulla versione del client
+            if 'QUERY_STRING' in environ:
+                query_string = environ['QUERY_STRING']
+            elif 'asgi.scope' in environ:
+                query_string = environ['asgi.scope'].get('query_string', b'').decode()
+        except Exception as e:
+            logger.error(f"Error detecting client version: {e}")
+        query = parse_qs(query_string)
+
+        name = query.get('codec', [None])[0]
+        if name not in CODECS:
+            if name is not None:
+                logger.warning(f"Unknown codec {name} requested by {sid}, using dict")
+            name = 'args' if query.get('EIO') == ['3'] else 'dict'
+        eio = query.get('EIO', ['4'])[0]
+        logger.info(f"Socket.IO v{eio} client {sid} uses the {name} input codec")
+        self.codecs[sid] = CODECS[name]
+        return name
+
+    def decoder(self, sid):
+        """Il decoder scelto per la sessione, dizionario se non negoziato."""
+        return self.codecs.get(sid, decode_dict)
+
+    def forget(self, sid):
+        self.codecs.pop(sid, None)
+
     def register_handler(self, event, handler):
         """
         Registra un handler per un evento specifico.
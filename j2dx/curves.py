@@ -0,0 +1,224 @@
+"""
+Axis response curves and deadzones.
+
+Configured from a JSON object keyed by input key for per-axis settings,
+and by stick ("left-stick", "right-stick") for radial deadzones:
+
+    {
+        "left-stick-X": {"deadzone": 0.08, "exponent": 1.5},
+        "left-stick-Y": {"deadzone": 0.08, "exponent": 1.5, "invert": true},
+        "right-trigger": {"deadzone": 0.1, "anti_deadzone": 0.2},
+        "left-stick": {"radial_deadzone": 0.1}
+    }
+
+Curves are never evaluated on the send path. When a device is created,
+each curve is combined with the device's own value transform into a
+lookup table over the quantized input range, so shaping an event costs
+one table index. Tables are shared by every device with the same
+transform.
+"""
+import json
+import math
+
+from j2dx.protocol import STICKS, TRIGGERS
+
+# Lookup table resolution: stick inputs are quantized to 2/STEPS, far
+# finer than 8 bit uinput axes and within 16 counts of 16 bit ViGEm ones
+STEPS = 1 << 12
+# Raw trigger values arrive as 0..TRIGGER_MAX integers
+TRIGGER_MAX = 255
+
+STICK_PAIRS = {
+    'left-stick': ('left-stick-X', 'left-stick-Y'),
+    'right-stick': ('right-stick-X', 'right-stick-Y'),
+}
+
+_config = {
+    'axes': {},
+    'radial': {},
+}
+_tables = {}
+
+
+class AxisCurve:
+    """
+    Shapes a -1.0..1.0 (sticks) or 0.0..1.0 (triggers) value.
+    Inputs below deadzone read as rest, the remaining range is rescaled,
+    raised to exponent, and lifted past anti_deadzone so the smallest
+    deflection already overcomes a game's own deadzone. invert flips a
+    stick around its center and a trigger within its 0..1 range.
+    """
+    options = ('deadzone', 'anti_deadzone', 'exponent', 'invert')
+
+    def __init__(self, deadzone=0.0, anti_deadzone=0.0, exponent=1.0, invert=False,
+                 trigger=False):
+        if not 0.0 <= deadzone < 1.0 or not 0.0 <= anti_deadzone < 1.0:
+            raise ValueError('deadzone and anti_deadzone must be in 0..1')
+        if exponent <= 0:
+            raise ValueError('exponent must be positive')
+        self.deadzone = deadzone
+        self.anti_deadzone = anti_deadzone
+        self.exponent = exponent
+        self.invert = bool(invert)
+        self.trigger = trigger
+
+    def __call__(self, value):
+        magnitude = min(abs(value), 1.0)
+        if magnitude <= self.deadzone:
+            shaped = 0.0
+        else:
+            shaped = (magnitude - self.deadzone) / (1.0 - self.deadzone)
+            shaped = shaped ** self.exponent
+            shaped = self.anti_deadzone + (1.0 - self.anti_deadzone) * shaped
+        if self.trigger:
+            return 1.0 - shaped if self.invert else shaped
+        shaped = math.copysign(shaped, value)
+        return -shaped if self.invert else shaped
+
+
+class RadialDeadzone:
+    """
+    Deadzone over the combined deflection of a stick, so diagonals are not
+    snapped to the axes like with two separate deadzones. Keeps the last
+    value of both axes; every update of one re-emits both.
+    """
+
+    def __init__(self, x_key, y_key, deadzone):
+        if not 0.0 <= deadzone < 1.0:
+            raise ValueError('radial_deadzone must be in 0..1')
+        self.x_key = x_key
+        self.y_key = y_key
+        self.x = 0.0
+        self.y = 0.0
+        self._table = _radial_table(deadzone)
+        self._last = len(self._table) - 1
+
+    def expand(self, key, value):
+        if key == self.x_key:
+            self.x = value
+        else:
+            self.y = value
+        x, y = self.x, self.y
+        # Scale factor by squared radius, 0..2 mapped onto the table
+        index = int((x * x + y * y) * (STEPS // 2))
+        scale = self._table[index if index < self._last else self._last]
+        return ((self.x_key, x * scale), (self.y_key, y * scale))
+
+
+def _radial_table(deadzone):
+    cached = _tables.get(('radial', deadzone))
+    if cached is None:
+        cached = []
+        for index in range(STEPS + 1):
+            radius = math.sqrt(index / (STEPS // 2))
+            if radius <= deadzone:
+                cached.append(0.0)
+            else:
+                cached.append((min(radius, 1.0) - deadzone) / (1.0 - deadzone) / radius)
+        _tables[('radial', deadzone)] = cached
+    return cached
+
+
+def load(path):
+    """Reads and validates an axis configuration file."""
+    with open(path) as fd:
+        data = json.load(fd)
+    if not isinstance(data, dict):
+        raise ValueError('Axis configuration must be a JSON object')
+    config = {'axes': {}, 'radial': {}}
+    for key, options in data.items():
+        if not isinstance(options, dict):
+            raise ValueError(f'Settings for {key} must be a JSON object')
+        if key in STICK_PAIRS:
+            unknown = set(options) - {'radial_deadzone'}
+            if unknown:
+                raise ValueError(f'Unknown settings for {key}: {", ".join(sorted(unknown))}')
+            # Validated here rather than when the first device is created
+            RadialDeadzone(*STICK_PAIRS[key], options.get('radial_deadzone', 0.0))
+            config['radial'][key] = options.get('radial_deadzone', 0.0)
+        elif key in STICKS or key in TRIGGERS:
+            unknown = set(options) - set(AxisCurve.options)
+            if unknown:
+                raise ValueError(f'Unknown settings for {key}: {", ".join(sorted(unknown))}')
+            config['axes'][key] = AxisCurve(**options, trigger=key in TRIGGERS)
+        else:
+            raise ValueError(f'Unknown axis: {key}')
+    return config
+
+
+def configure(config):
+    """Set the curves devices created from now on use."""
+    _config['axes'] = dict(config.get('axes', {}))
+    _config['radial'] = dict(config.get('radial', {}))
+    _tables.clear()
+
+
+def _identity(value):
+    return value
+
+
+def compose(key, output=_identity):
+    """
+    Returns a transform applying the curve configured for key and then
+    output, backed by a lookup table, or None if key has no curve.
+
+    Sticks are shaped when sent as floats and triggers when sent as raw
+    integers; any other value goes to output unshaped, exactly as
+    without a curve.
+    """
+    curve = _config['axes'].get(key)
+    if curve is None:
+        return None
+    cache_key = (key, output)
+    table = _tables.get(cache_key)
+    if key in TRIGGERS:
+        if table is None:
+            table = _tables[cache_key] = [
+                output(round(curve(raw / TRIGGER_MAX) * TRIGGER_MAX))
+                for raw in range(TRIGGER_MAX + 1)]
+
+        def trigger(value):
+            if type(value) is int and 0 <= value <= TRIGGER_MAX:
+                return table[value]
+            return output(value)
+        return trigger
+
+    if table is None:
+        half = STEPS // 2
+        table = _tables[cache_key] = [
+            output(curve(index / half - 1.0)) for index in range(STEPS + 1)]
+    scale = STEPS / 2
+    offset = scale + 0.5
+
+    def stick(value):
+        if type(value) is float:
+            index = int(value * scale + offset)
+            if index < 0:
+                index = 0
+            elif index > STEPS:
+                index = STEPS
+            return table[index]
+        return output(value)
+    return stick
+
+
+def radial():
+    """
+    Returns fresh radial deadzone state for a device, keyed by both
+    axis keys of every configured stick.
+    """
+    pairs = {}
+    for stick, deadzone in _config['radial'].items():
+        shaper = RadialDeadzone(*STICK_PAIRS[stick], deadzone)
+        pairs[shaper.x_key] = pairs[shaper.y_key] = shaper
+    return pairs
+
+
+def expand(pairs, events):
+    """Yields events with stick updates replaced by both radially shaped axes."""
+    for key, value in events:
+        shaper = pairs.get(key)
+        if shaper is not None and type(value) is float:
+            yield from shaper.expand(key, value)
+        else:
+            yield key, value
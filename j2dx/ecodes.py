@@ -0,0 +1,85 @@
+"""
+The Linux input event codes the controllers use, from
+linux/input-event-codes.h, with the same names as evdev.ecodes.
+
+Lets the controller mappings and the in-memory backends describe evdev
+streams on any platform, without the evdev package.
+"""
+
+EV_SYN = 0x00
+EV_KEY = 0x01
+EV_ABS = 0x03
+EV_FF = 0x15
+
+SYN_REPORT = 0
+
+BUS_USB = 0x03
+
+BTN_SOUTH = BTN_A = 0x130
+BTN_EAST = BTN_B = 0x131
+BTN_NORTH = BTN_X = 0x133
+BTN_WEST = BTN_Y = 0x134
+BTN_TL = 0x136
+BTN_TR = 0x137
+BTN_TL2 = 0x138
+BTN_TR2 = 0x139
+BTN_SELECT = 0x13a
+BTN_START = 0x13b
+BTN_MODE = 0x13c
+BTN_THUMBL = 0x13d
+BTN_THUMBR = 0x13e
+BTN_DPAD_UP = 0x220
+BTN_DPAD_DOWN = 0x221
+BTN_DPAD_LEFT = 0x222
+BTN_DPAD_RIGHT = 0x223
+
+ABS_X = 0x00
+ABS_Y = 0x01
+ABS_Z = 0x02
+ABS_RX = 0x03
+ABS_RY = 0x04
+ABS_RZ = 0x05
+ABS_HAT0X = 0x10
+ABS_HAT0Y = 0x11
+
+EV = {
+	EV_SYN: 'EV_SYN',
+	EV_KEY: 'EV_KEY',
+	EV_ABS: 'EV_ABS',
+	EV_FF: 'EV_FF',
+}
+
+# Event code names by event type, the first of evdev's names for codes
+# that have several
+bytype = {
+	EV_SYN: {SYN_REPORT: 'SYN_REPORT'},
+	EV_KEY: {
+		BTN_A: 'BTN_A',
+		BTN_B: 'BTN_B',
+		BTN_NORTH: 'BTN_NORTH',
+		BTN_WEST: 'BTN_WEST',
+		BTN_TL: 'BTN_TL',
+		BTN_TR: 'BTN_TR',
+		BTN_TL2: 'BTN_TL2',
+		BTN_TR2: 'BTN_TR2',
+		BTN_SELECT: 'BTN_SELECT',
+		BTN_START: 'BTN_START',
+		BTN_MODE: 'BTN_MODE',
+		BTN_THUMBL: 'BTN_THUMBL',
+		BTN_THUMBR: 'BTN_THUMBR',
+		BTN_DPAD_UP: 'BTN_DPAD_UP',
+		BTN_DPAD_DOWN: 'BTN_DPAD_DOWN',
+		BTN_DPAD_LEFT: 'BTN_DPAD_LEFT',
+		BTN_DPAD_RIGHT: 'BTN_DPAD_RIGHT',
+	},
+	EV_ABS: {
+		ABS_X: 'ABS_X',
+		ABS_Y: 'ABS_Y',
+		ABS_Z: 'ABS_Z',
+		ABS_RX: 'ABS_RX',
+		ABS_RY: 'ABS_RY',
+		ABS_RZ: 'ABS_RZ',
+		ABS_HAT0X: 'ABS_HAT0X',
+		ABS_HAT0Y: 'ABS_HAT0Y',
+	},
+}
@@ -0,0 +1,295 @@
+"""
+Controller mappings and the send path, independent of any platform.
+
+Each device class maps protocol keys onto Linux input events through a
+dispatch table and keeps a shadow of the values last written, so
+unchanged values are never written again. Events go to whatever the
+backend sets as uinput: a real uinput device (j2dx.nix.device) or one
+that discards or records them (j2dx.null).
+"""
+import logging
+import threading
+from abc import ABC, abstractmethod
+
+from j2dx import curves
+from j2dx import ecodes as e
+from j2dx.state import ControllerState
+
+logger = logging.getLogger('J2DX.device')
+
+
+# Value transforms used by the dispatch tables
+def _button(value):
+	return 1 if value else 0
+
+
+def _x360_axis(value):
+	return round(127 * (value + 1)) if isinstance(value, float) else value
+
+
+def _x360_axis_inverted(value):
+	return 255 - round(127 * (value + 1))
+
+
+def _ds4_axis(value):
+	return round(127 * value) + 127
+
+
+def _ds4_dpad_low(value):
+	return 0 if value else 127
+
+
+def _ds4_dpad_high(value):
+	return 255 if value else 127
+
+
+def _ignore(value):
+	pass
+
+
+class Device(ABC):
+
+	# Factory for the device events are written to, called with the
+	# device name and identity: anything with write(), syn() and close()
+	uinput = None
+	# USB identity of the emulated controller
+	identity = {}
+
+	def __init_subclass__(cls, **kwargs):
+		super().__init_subclass__(**kwargs)
+		# Every (event type, code) pair gets a slot in the shadow state
+		slots = {}
+		cls.dispatch = {
+			key: (etype, code, transform, slots.setdefault((etype, code), len(slots)))
+			for key, (etype, code, transform) in cls.compile_dispatch().items()
+		}
+		cls.shadow_size = len(slots)
+
+	@classmethod
+	@abstractmethod
+	def compile_dispatch(cls):
+		"""
+		Build the key -> (event type, event code, value transform) table
+		used by the send path. Called once when the class is created.
+		"""
+		pass
+
+	def __init__(self, device, addr):
+		self.device = device
+		self.address = addr
+		self.lock = threading.Lock()
+		# Last value written per event code, the kernel starts them all at 0
+		self._shadow = [0] * self.shadow_size
+		self.state = ControllerState()
+		self.emitted = 0
+		self.suppressed = 0
+		self._shape()
+		self._ui = self.open()
+
+	def open(self):
+		"""Create the device events are written to."""
+		return self.uinput(name=self.type, **self.identity)
+
+	def _shape(self):
+		"""
+		Build this device's own dispatch table: entries gain the update of
+		the shared controller state, and analog ones the configured axis
+		curves, see j2dx.curves.
+		"""
+		dispatch = {}
+		for key, (etype, code, transform, slot) in self.dispatch.items():
+			if key in self.analog:
+				transform = curves.compose(key, transform) or transform
+			update = self.state.updater(key) or _ignore
+			dispatch[key] = (etype, code, transform, slot, update)
+		self.dispatch = dispatch
+		self._radial = curves.radial()
+
+	def stats(self):
+		return {
+			'type': self.type,
+			'address': self.address,
+			'emitted': self.emitted,
+			'suppressed': self.suppressed,
+		}
+
+	def assign(self, device, addr):
+		"""Hand a pooled device over to a new session."""
+		self.device = device
+		self.address = addr
+		self.emitted = 0
+		self.suppressed = 0
+
+	def reset(self):
+		"""Release every button and center every axis."""
+		self.send_many(self.neutral)
+
+	def close(self):
+		with self.lock:
+			self._ui.close()
+			logger.debug(
+				f'Destroyed virtual {self.type} device for {self.device} \
+				at {self.address}')
+
+	def send(self, key, value):
+		if key in self._radial:
+			# Stick updates move both axes
+			self.send_many(((key, value),))
+			return
+		entry = self.dispatch.get(key)
+		if entry is None:
+			logger.warning(f'Unknown key for {self.type}: {key}')
+			return
+		etype, code, transform, slot, update = entry
+		with self.lock:
+			try:
+				coord = transform(value)
+				if self._shadow[slot] == coord:
+					self.suppressed += 1
+					return
+				update(value)
+				if logger.isEnabledFor(logging.DEBUG):
+					logger.debug(f'Sending event::{e.bytype[etype][code]}: {coord}')
+				self._ui.write(etype, code, coord)
+				self._ui.syn()
+				self._shadow[slot] = coord
+				self.emitted += 1
+			except Exception as ex:
+				logger.error(f"Error sending input to device: {str(ex)}")
+
+	def send_many(self, events):
+		"""
+		Apply a batch of (key, value) updates and flush them as a single
+		evdev report, so the game sees all of them change at once.
+		"""
+		with self.lock:
+			written = False
+			if self._radial:
+				events = curves.expand(self._radial, events)
+			for key, value in events:
+				try:
+					written = self._write(key, value) or written
+				except Exception as ex:
+					logger.error(f"Error sending input to device: {str(ex)}")
+			if written:
+				self._ui.syn()
+
+	def _write(self, key, value):
+		"""
+		Write the event for a single key without syncing.
+		Returns True if an event was written, False if the key is unknown
+		or the device already reports that value.
+		"""
+		entry = self.dispatch.get(key)
+		if entry is None:
+			logger.warning(f'Unknown key for {self.type}: {key}')
+			return False
+		etype, code, transform, slot, update = entry
+		coord = transform(value)
+		if self._shadow[slot] == coord:
+			self.suppressed += 1
+			return False
+		update(value)
+		if logger.isEnabledFor(logging.DEBUG):
+			logger.debug(f'Sending event::{e.bytype[etype][code]}: {coord}')
+		self._ui.write(etype, code, coord)
+		self._shadow[slot] = coord
+		self.emitted += 1
+		return True
+
+
+class X360Device(Device):
+
+	# Device name, also reported in stats
+	type = "Xbox 360 Controller"
+	identity = {'vendor': 0x045e, 'product': 0x028e, 'version': 0x0110, 'bustype': e.BUS_USB}
+	buttons = {
+		'main-button': e.BTN_MODE,
+		'start-button': e.BTN_START,
+		'select-button': e.BTN_SELECT,
+		'left-stick-press': e.BTN_THUMBL,
+		'right-stick-press': e.BTN_THUMBR,
+		'left-bumper': e.BTN_TL,
+		 'right-bumper': e.BTN_TR,
+		'zl-button': e.BTN_TL2,
+		'zr-button': e.BTN_TR2,
+		'dpad-up': e.BTN_DPAD_UP,
+		'dpad-down': e.BTN_DPAD_DOWN,
+		'dpad-left': e.BTN_DPAD_LEFT,
+		'dpad-right': e.BTN_DPAD_RIGHT,
+		'y-button': e.BTN_Y,
+		'x-button': e.BTN_X,
+		'a-button': e.BTN_A,
+		'b-button': e.BTN_B,
+	}
+	axes = {
+		'left-stick-X': e.ABS_X,
+		'left-stick-Y': e.ABS_Y,
+		'right-stick-X': e.ABS_RX,
+		'right-stick-Y': e.ABS_RY,
+		'left-trigger': e.ABS_Z,
+		'right-trigger': e.ABS_RZ,
+	}
+	# Keys whose intermediate values may be coalesced by the writer
+	analog = frozenset(axes)
+	# Resting value of every key, triggers are raw axis values
+	neutral = [(key, False) for key in buttons] + [
+		(key, 0 if key.endswith('-trigger') else 0.0) for key in axes]
+
+	@classmethod
+	def compile_dispatch(cls):
+		dispatch = {}
+		for key, code in cls.buttons.items():
+			dispatch[key] = (e.EV_KEY, code, _button)
+		for key, code in cls.axes.items():
+			transform = _x360_axis_inverted if key.endswith('-Y') else _x360_axis
+			dispatch[key] = (e.EV_ABS, code, transform)
+		return dispatch
+
+
+class DS4Device(Device):
+
+	type = "Sony Computer Entertainment Wireless Controller"
+	identity = {'vendor': 1356, 'product': 1476, 'version': 273, 'bustype': e.BUS_USB}
+	buttons = {
+		'main-button': e.BTN_MODE,
+		'back-button': e.BTN_SELECT,
+		'start-button': e.BTN_START,
+		'left-stick-press': e.BTN_THUMBL,
+		'right-stick-press': e.BTN_THUMBR,
+		'left-bumper': e.BTN_TL,
+		'left-trigger': e.BTN_TL2,
+		'right-bumper': e.BTN_TR,
+		'right-trigger': e.BTN_TR2,
+		'y-button': e.BTN_NORTH,
+		'x-button': e.BTN_EAST,
+		'a-button': e.BTN_SOUTH,
+		'b-button': e.BTN_WEST,
+	}
+	dpad = {
+		'up-button': e.ABS_HAT0Y,
+		'right-button': e.ABS_HAT0X,
+		'down-button': e.ABS_HAT0Y,
+		'left-button': e.ABS_HAT0X,
+	}
+	axes = {
+		'left-stick-X': e.ABS_X,
+		'left-stick-Y': e.ABS_Y,
+		'right-stick-X': e.ABS_RX,
+		'right-stick-Y': e.ABS_RY,
+	}
+	analog = frozenset(axes)
+	neutral = [(key, False) for key in {**buttons, **dpad}] + [
+		(key, 0.0) for key in axes]
+
+	@classmethod
+	def compile_dispatch(cls):
+		dispatch = {}
+		for key, code in cls.buttons.items():
+			dispatch[key] = (e.EV_KEY, code, _button)
+		for key, code in cls.dpad.items():
+			transform = _ds4_dpad_low if key in {'up-button', 'left-button'} else _ds4_dpad_high
+			dispatch[key] = (e.EV_ABS, code, transform)
+		for key, code in cls.axes.items():
+			dispatch[key] = (e.EV_ABS, code, _ds4_axis)
+		return dispatch
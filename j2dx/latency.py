@@ -0,0 +1,173 @@
+"""
+Per-client input latency tracing.
+"""
+import time
+
+NS_PER_US = 1000
+
+
+class Histogram:
+    """
+    HDR-style log-linear histogram of integer values (microseconds here).
+
+    Values below 2**precision are counted exactly, larger values land in
+    buckets whose width grows with their magnitude, keeping the relative
+    error under 2**(1 - precision) with a fixed, small array of counters.
+    """
+
+    def __init__(self, precision=7, max_value=60_000_000):
+        self.precision = precision
+        self.max_value = max_value
+        self._half = 1 << (precision - 1)
+        self._counts = [0] * (self._index(max_value) + 1)
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = 0
+
+    def _index(self, value):
+        if value < (1 << self.precision):
+            return value
+        shift = value.bit_length() - self.precision
+        return (1 << self.precision) + (shift - 1) * self._half + (value >> shift) - self._half
+
+    def _highest(self, index):
+        """Highest value that falls into the bucket at index."""
+        if index < (1 << self.precision):
+            return index
+        index -= 1 << self.precision
+        shift = index // self._half + 1
+        top = index % self._half + self._half
+        return ((top + 1) << shift) - 1
+
+    def record(self, value):
+        value = min(max(int(value), 0), self.max_value)
+        self._counts[self._index(value)] += 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, percent):
+        if not self.count:
+            return 0
+        target = max(1, round(self.count * percent / 100))
+        seen = 0
+        for index, count in enumerate(self._counts):
+            seen += count
+            if seen >= target:
+                return min(self._highest(index), self.max)
+        return self.max
+
+    def summary(self):
+        """Count and percentiles in milliseconds."""
+        return {
+            'count': self.count,
+            'mean': self.total / self.count / 1000 if self.count else 0,
+            'p50': self.percentile(50) / 1000,
+            'p99': self.percentile(99) / 1000,
+            'p999': self.percentile(99.9) / 1000,
+            'max': self.max / 1000,
+        }
+
+
+class LatencyTracker:
+    """
+    Latency histograms for one client session.
+
+    one_way  client send -> server receive, needs the clock offset from
+             the 'clock' exchange
+    decode   server receive -> input decoded and queued
+    queue    decoded -> device write starts (includes the executor hop)
+    write    device write(s) and syn()
+    reconnect  client disconnect -> first input after resuming the session
+    """
+
+    def __init__(self):
+        self.one_way = Histogram()
+        self.decode = Histogram()
+        self.queue = Histogram()
+        self.write = Histogram()
+        self.reconnect = Histogram()
+        # Milliseconds to add to a client timestamp to get server time
+        self.offset = None
+        self.rtt = None
+        self.seq = None
+        self.gaps = 0
+        self.reordered = 0
+        self._resumed = None
+
+    def sync(self, offset, rtt=None):
+        self.offset = offset
+        self.rtt = rtt
+
+    def resumed(self, disconnected_ns, total=None):
+        """
+        The session was taken over by a reconnected client. The next input
+        records the time since the disconnect, here and in total if given.
+        """
+        # A reconnected client may start counting from scratch
+        self.seq = None
+        self._resumed = (disconnected_ns, total)
+
+    def received(self, data, received_ns):
+        """
+        Record the decode time of one message, plus its one-way latency
+        and sequence number when the client sent them.
+        """
+        self.decode.record((time.perf_counter_ns() - received_ns) // NS_PER_US)
+        if self._resumed is not None:
+            disconnected, total = self._resumed
+            self._resumed = None
+            elapsed = (received_ns - disconnected) // NS_PER_US
+            self.reconnect.record(elapsed)
+            if total is not None:
+                total.record(elapsed)
+        if not isinstance(data, dict):
+            return
+        sent = data.get('t')
+        if sent is not None and self.offset is not None:
+            self.one_way.record((time.time() * 1000 - sent - self.offset) * 1000)
+        seq = data.get('seq')
+        if seq is not None:
+            if self.seq is not None:
+                if seq <= self.seq:
+                    self.reordered += 1
+                    return
+                self.gaps += seq - self.seq - 1
+            self.seq = seq
+
+    def written(self, queued_ns, started_ns, finished_ns):
+        self.queue.record((started_ns - queued_ns) // NS_PER_US)
+        self.write.record((finished_ns - started_ns) // NS_PER_US)
+
+    def summary(self):
+        return {
+            'offset': self.offset,
+            'rtt': self.rtt,
+            'gaps': self.gaps,
+            'reordered': self.reordered,
+            'one_way': self.one_way.summary(),
+            'decode': self.decode.summary(),
+            'queue': self.queue.summary(),
+            'write': self.write.summary(),
+            'reconnect': self.reconnect.summary(),
+        }
+
+
+def clock_reply(data):
+    """
+    Server half of the NTP-style offset exchange. The client sends its
+    send time t0 and gets the server receive/send times back; with its own
+    receive time t3 it computes offset = ((t1 - t0) + (t2 - t3)) / 2 and
+    rtt = (t3 - t0) - (t2 - t1), and may report both back with
+    {'offset': ..., 'rtt': ...}. All times are milliseconds since the epoch.
+    """
+    received = time.time() * 1000
+    return {
+        't0': data.get('t0') if isinstance(data, dict) else None,
+        't1': received,
+        't2': time.time() * 1000,
+    }
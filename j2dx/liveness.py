@@ -0,0 +1,90 @@
+"""
+Application level heartbeat.
+
+Engine.IO pings only tell whether a connection is gone, after its full
+ping timeout, and say nothing about how long the round trip takes. The
+server additionally sends every Socket.IO client a 'heartbeat' event
+once per interval and measures how long the acknowledgement takes.
+
+A client that answered before but leaves a heartbeat unanswered for the
+timeout is considered unresponsive: its controllers are returned to
+neutral right away, so nothing stays held while Engine.IO waits to tear
+the connection down. Clients that never answer heartbeats are never
+marked unresponsive.
+"""
+from j2dx.latency import Histogram, NS_PER_US
+
+
+class Heartbeat:
+    """Heartbeat round trips and responsiveness of one session."""
+
+    def __init__(self):
+        self.rtt = Histogram()
+        self.last_rtt = None
+        # Smoothed variation between consecutive round trips, as in RFC 3550
+        self.jitter = 0.0
+        self.sent = 0
+        self.answered = 0
+        self.late = 0
+        self.neutralized = 0
+        self.responsive = True
+        self._outstanding = {}
+        self._seq = 0
+
+    def ping(self, now_ns):
+        """Returns the sequence number of a heartbeat sent at now_ns."""
+        self._seq += 1
+        self._outstanding[self._seq] = now_ns
+        self.sent += 1
+        return self._seq
+
+    def pong(self, seq, now_ns):
+        """
+        Record the answer to heartbeat seq. Returns True if the session
+        was unresponsive until now.
+        """
+        sent = self._outstanding.pop(seq, None)
+        if sent is None:
+            # Answered after it was given up on
+            self.late += 1
+            return False
+        # Everything older is answered out of order or lost
+        for older in [s for s in self._outstanding if s < seq]:
+            del self._outstanding[older]
+        rtt = (now_ns - sent) // NS_PER_US
+        self.rtt.record(rtt)
+        if self.last_rtt is not None:
+            self.jitter += (abs(rtt - self.last_rtt) - self.jitter) / 16
+        self.last_rtt = rtt
+        self.answered += 1
+        recovered = not self.responsive
+        self.responsive = True
+        return recovered
+
+    def overdue(self, now_ns, timeout_ns):
+        """
+        True when a session that answered before has left a heartbeat
+        unanswered for timeout_ns. Marks it unresponsive.
+        """
+        expired = [seq for seq, sent in self._outstanding.items() if now_ns - sent >= timeout_ns]
+        if not expired:
+            return False
+        for seq in expired:
+            del self._outstanding[seq]
+        if not self.responsive or not self.answered:
+            return False
+        self.responsive = False
+        self.neutralized += 1
+        return True
+
+    def summary(self):
+        return {
+            'responsive': self.responsive,
+            'sent': self.sent,
+            'answered': self.answered,
+            'late': self.late,
+            'neutralized': self.neutralized,
+            'last_rtt': self.last_rtt / 1000 if self.last_rtt is not None else None,
+            'jitter': self.jitter / 1000,
+            'rtt': self.rtt.summary(),
+        }
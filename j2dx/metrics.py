@@ -0,0 +1,197 @@
+"""
+Server-wide counters and gauges, served at /metrics in the Prometheus
+text exposition format.
+
+Counters are plain integers in dicts that are only ever touched from the
+event loop thread, so an increment is one dict update with no lock, cheap
+enough for every input event. Values that already live elsewhere (pool,
+sessions, process) are read when the endpoint is scraped.
+"""
+import asyncio
+import os
+import sys
+import time
+
+from j2dx.latency import Histogram, NS_PER_US
+from j2dx.protocol import BUTTONS, STICKS, TRIGGERS
+from j2dx.state import DPAD_BITS
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+KEY_CLASSES = {key: 'dpad' if key in DPAD_BITS else 'button' for key in BUTTONS}
+KEY_CLASSES.update({key: 'stick' for key in STICKS})
+KEY_CLASSES.update({key: 'trigger' for key in TRIGGERS})
+CLASS_NAMES = ('button', 'dpad', 'stick', 'trigger')
+
+# Why input was dropped before reaching a device, besides unknown keys
+REJECT_REASONS = ('invalid', 'no_controller')
+
+# Label of rejected input not addressed to any controller, and of the key
+# class where the key is not known
+NO_CONTROLLER = 'none'
+UNKNOWN_CLASS = 'unknown'
+
+# Seconds between two event loop lag samples
+LAG_INTERVAL = 0.25
+
+QUANTILES = (0.5, 0.99, 0.999)
+
+
+class EventCounters:
+    """
+    Input events of one controller type. Counted by key, which costs one
+    dict update per event, and summed by key class when scraped.
+    """
+    __slots__ = ('received', 'forwarded', 'unknown')
+
+    def __init__(self):
+        self.received = dict.fromkeys(KEY_CLASSES, 0)
+        # Passed to the device after coalescing and throttling. The device
+        # still skips those that do not change what it reports, see its
+        # 'suppressed' stat.
+        self.forwarded = dict.fromkeys(KEY_CLASSES, 0)
+        # Keys no controller has, ignored by the device
+        self.unknown = 0
+
+    def by_class(self, counts):
+        totals = dict.fromkeys(CLASS_NAMES, 0)
+        for key, count in counts.items():
+            totals[KEY_CLASSES[key]] += count
+        return totals
+
+
+class Metrics:
+    """The counters of one server, see the module docstring."""
+
+    def __init__(self, kinds):
+        self.events = {kind: EventCounters() for kind in kinds}
+        # Counts by (reason, controller type, key class)
+        self.rejected = {}
+        self.exceptions = {}
+        self.loop_lag = Histogram()
+
+    def reject(self, reason, controller=NO_CONTROLLER, key=None):
+        """Count input dropped before reaching a device."""
+        labels = (reason, controller, KEY_CLASSES.get(key, UNKNOWN_CLASS))
+        self.rejected[labels] = self.rejected.get(labels, 0) + 1
+
+    def failed(self, handler):
+        """Count an exception caught in a request or event handler."""
+        self.exceptions[handler] = self.exceptions.get(handler, 0) + 1
+
+    async def sample_loop_lag(self, interval=LAG_INTERVAL):
+        """How much later than asked the event loop wakes a sleeping task."""
+        while True:
+            started = time.perf_counter_ns()
+            await asyncio.sleep(interval)
+            late = time.perf_counter_ns() - started - int(interval * 1e9)
+            self.loop_lag.record(late // NS_PER_US)
+
+    def render(self, sessions, controllers, pool):
+        """
+        The exposition text. sessions and controllers are the current
+        counts by transport and by controller type, pool a DevicePool.
+        """
+        out = Exposition()
+        for name, counts, help in (
+                ('j2dx_events_received_total', 'received', 'Input events received'),
+                ('j2dx_events_forwarded_total', 'forwarded',
+                 'Input events passed to a device after coalescing and throttling, '
+                 'including those it skips for not changing its state')):
+            out.family(name, 'counter', f'{help}, by controller type and key class.')
+            for kind, counters in self.events.items():
+                for key_class, count in counters.by_class(getattr(counters, counts)).items():
+                    out.sample(name, {'controller': kind, 'class': key_class}, count)
+        out.family('j2dx_events_rejected_total', 'counter',
+                   'Input dropped before reaching a device, by reason, controller type and key class.')
+        rejected = dict.fromkeys(
+            ((reason, NO_CONTROLLER, UNKNOWN_CLASS) for reason in REJECT_REASONS), 0)
+        rejected.update(self.rejected)
+        for kind, counters in self.events.items():
+            rejected[('unknown_key', kind, UNKNOWN_CLASS)] = counters.unknown
+        for (reason, kind, key_class), count in sorted(rejected.items()):
+            out.sample('j2dx_events_rejected_total',
+                       {'reason': reason, 'controller': kind, 'class': key_class}, count)
+
+        out.family('j2dx_sessions', 'gauge', 'Active sessions by transport.')
+        for transport, count in sessions.items():
+            out.sample('j2dx_sessions', {'transport': transport}, count)
+        out.family('j2dx_controllers', 'gauge', 'Controllers in use by controller type.')
+        for kind, count in controllers.items():
+            out.sample('j2dx_controllers', {'controller': kind}, count)
+
+        out.family('j2dx_devices_created_total', 'counter', 'Virtual devices created.')
+        out.sample('j2dx_devices_created_total', {}, pool.created)
+        out.family('j2dx_devices_closed_total', 'counter', 'Virtual devices closed.')
+        out.sample('j2dx_devices_closed_total', {}, pool.closed)
+        out.summary('j2dx_device_create_seconds', 'Time to create a virtual device.',
+                    pool.create_time)
+        out.summary('j2dx_device_close_seconds', 'Time to close a virtual device.',
+                    pool.close_time)
+        out.family('j2dx_pool_idle_devices', 'gauge', 'Pre-created devices waiting for a session.')
+        for kind, idle in pool.stats()['idle'].items():
+            out.sample('j2dx_pool_idle_devices', {'controller': kind}, idle)
+
+        out.family('j2dx_handler_exceptions_total', 'counter',
+                   'Exceptions caught in request and event handlers, by handler.')
+        for handler, count in sorted(self.exceptions.items()):
+            out.sample('j2dx_handler_exceptions_total', {'handler': handler}, count)
+        out.summary('j2dx_event_loop_lag_seconds',
+                    f'Delay of the event loop waking a task, sampled every {LAG_INTERVAL} s.',
+                    self.loop_lag)
+
+        out.family('process_cpu_seconds_total', 'counter', 'User and system CPU time of the server.')
+        out.sample('process_cpu_seconds_total', {}, time.process_time())
+        rss = resident_memory()
+        if rss is not None:
+            out.family('process_resident_memory_bytes', 'gauge', 'Resident memory of the server.')
+            out.sample('process_resident_memory_bytes', {}, rss)
+        return out.text()
+
+
+class Exposition:
+    """Builds the text exposition format line by line."""
+
+    def __init__(self):
+        self._lines = []
+
+    def family(self, name, kind, help):
+        self._lines.append(f'# HELP {name} {help}')
+        self._lines.append(f'# TYPE {name} {kind}')
+
+    def sample(self, name, labels, value):
+        if labels:
+            pairs = ','.join(f'{label}="{_escape(text)}"' for label, text in labels.items())
+            name = f'{name}{{{pairs}}}'
+        self._lines.append(f'{name} {value}')
+
+    def summary(self, name, help, histogram):
+        """A microsecond Histogram as a summary in seconds."""
+        self.family(name, 'summary', help)
+        for quantile in QUANTILES:
+            self.sample(name, {'quantile': str(quantile)}, histogram.percentile(quantile * 100) / 1e6)
+        self.sample(f'{name}_sum', {}, histogram.total / 1e6)
+        self.sample(f'{name}_count', {}, histogram.count)
+
+    def text(self):
+        return '\n'.join(self._lines) + '\n'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def resident_memory():
+    """Resident set size of this process in bytes, None where unknown."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    # Peak rather than current size where /proc is missing
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
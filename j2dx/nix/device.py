@@ -1,33 +1,147 @@
+"""
+uinput backend: the controllers of j2dx.gamepad as uinput devices, with
+force feedback uploaded by games reported back as rumble.
+"""
+import errno
+import fcntl
 import logging
-from abc import ABC, abstractmethod
-from evdev import UInput, AbsInfo, ecodes as e
-import threading
+import time
+from ctypes import sizeof
+from evdev import UInput, AbsInfo, ecodes as e, ff
+from j2dx import gamepad
 
 logger = logging.getLogger('J2DX.device')
 
 
-class Device(ABC):
+# uinput force feedback requests from linux/uinput.h, issued directly
+# since evdev's begin_upload() leaves the request id unset
+def _uinput_ioc(direction, number, struct):
+	return (direction << 30) | (sizeof(struct) << 16) | (ord('U') << 8) | number
 
-	@abstractmethod
-	def __init__(self, device, addr):
-		self.device = device
-		self.address = addr
-		self.lock = threading.Lock()
 
-	def close(self):
-		with self.lock:
-			self._ui.close()
-			logger.debug(
-				f'Destroyed virtual {self.type} device for {self.device} \
-				at {self.address}')
+UI_BEGIN_FF_UPLOAD = _uinput_ioc(3, 200, ff.UInputUpload)
+UI_END_FF_UPLOAD = _uinput_ioc(1, 201, ff.UInputUpload)
+UI_BEGIN_FF_ERASE = _uinput_ioc(3, 202, ff.UInputErase)
+UI_END_FF_ERASE = _uinput_ioc(1, 203, ff.UInputErase)
+
+# Effects games can play, rendered as rumble on the client
+FORCE_FEEDBACK = [e.FF_RUMBLE, e.FF_PERIODIC, e.FF_SINE, e.FF_GAIN]
+FF_MAX_MAGNITUDE = 0xffff
+
 
-	@abstractmethod
-	def send(self, key, value):
-		logger.debug(f"PROCESSING: {key}={value} for device from {self.address}")
-		pass
+class UInputDevice:
+	"""
+	Creates the device through uinput with its capabilities and handles
+	force feedback requests. Mixed in before a j2dx.gamepad device class.
+	"""
 
+	uinput = UInput
 
-class X360Device(Device):
+	def __init__(self, device, addr):
+		# Force feedback effects uploaded by the game:
+		# id -> (strong, weak, length ms), and id -> start time of playing ones
+		self._effects = {}
+		self._playing = {}
+		self._gain = FF_MAX_MAGNITUDE
+		self._rumble = (0.0, 0.0, 0)
+		super().__init__(device, addr)
+
+	def open(self):
+		return self.uinput(events=self.capabilities, name=self.type, **self.identity)
+
+	def reset(self):
+		"""Return to neutral and forget the force feedback of the last game."""
+		super().reset()
+		self._effects.clear()
+		self._playing.clear()
+		self._gain = FF_MAX_MAGNITUDE
+		self._rumble = (0.0, 0.0, 0)
+
+	def fileno(self):
+		"""
+		The uinput file descriptor, readable when a game uploads, erases
+		or plays force feedback effects. None if the backend has none.
+		"""
+		return getattr(self._ui, 'fd', None)
+
+	def read_feedback(self):
+		"""
+		Handle every pending force feedback request without blocking.
+		Returns the rumble the game now wants as (strong, weak, duration),
+		magnitudes in 0..1 and the duration in milliseconds (0 until
+		stopped), or None if it did not change.
+		"""
+		while True:
+			event = self._ui.read_one()
+			if event is None:
+				break
+			if event.type == e.EV_UINPUT:
+				if event.code == e.UI_FF_UPLOAD:
+					self._upload(event.value)
+				elif event.code == e.UI_FF_ERASE:
+					self._erase(event.value)
+			elif event.type == e.EV_FF:
+				if event.code == e.FF_GAIN:
+					self._gain = event.value
+				elif event.value:
+					self._playing.pop(event.code, None)
+					self._playing[event.code] = time.monotonic()
+				else:
+					self._playing.pop(event.code, None)
+		rumble = self._mix()
+		if rumble == self._rumble:
+			return None
+		self._rumble = rumble
+		return rumble
+
+	def _mix(self):
+		"""Strongest of the playing effects, the last started one's length."""
+		now = time.monotonic()
+		strong = weak = length = 0
+		for effect_id, started in list(self._playing.items()):
+			effect = self._effects.get(effect_id)
+			if effect is None or effect[2] and now - started > effect[2] / 1000:
+				# May already be gone after a reset from the writer thread
+				self._playing.pop(effect_id, None)
+				continue
+			strong = max(strong, effect[0])
+			weak = max(weak, effect[1])
+			length = effect[2]
+		scale = self._gain / FF_MAX_MAGNITUDE / FF_MAX_MAGNITUDE
+		return (round(strong * scale, 3), round(weak * scale, 3), length)
+
+	def _upload(self, request_id):
+		upload = ff.UInputUpload()
+		upload.request_id = request_id
+		fcntl.ioctl(self._ui.fd, UI_BEGIN_FF_UPLOAD, upload)
+		try:
+			effect = upload.effect
+			length = effect.ff_replay.length
+			if effect.type == e.FF_RUMBLE:
+				rumble = effect.u.ff_rumble_effect
+				self._effects[effect.id] = (
+					rumble.strong_magnitude, rumble.weak_magnitude, length)
+			elif effect.type == e.FF_PERIODIC:
+				magnitude = min(abs(effect.u.ff_periodic_effect.magnitude) * 2, FF_MAX_MAGNITUDE)
+				self._effects[effect.id] = (magnitude, magnitude, length)
+			else:
+				upload.retval = -errno.EINVAL
+		finally:
+			# The game's upload blocks until this answer
+			fcntl.ioctl(self._ui.fd, UI_END_FF_UPLOAD, upload)
+
+	def _erase(self, request_id):
+		erase = ff.UInputErase()
+		erase.request_id = request_id
+		fcntl.ioctl(self._ui.fd, UI_BEGIN_FF_ERASE, erase)
+		try:
+			self._effects.pop(erase.effect_id, None)
+			self._playing.pop(erase.effect_id, None)
+		finally:
+			fcntl.ioctl(self._ui.fd, UI_END_FF_ERASE, erase)
+
+
+class X360Device(UInputDevice, gamepad.X360Device):
 
 	capabilities = {
 		e.EV_KEY: [
@@ -57,73 +171,11 @@ class X360Device(Device):
 			(e.ABS_Z, AbsInfo(value=0, min=0, max=255, fuzz=0, flat=0, resolution=0)),
 			(e.ABS_RZ, AbsInfo(value=0, min=0, max=255, fuzz=0, flat=0, resolution=0)),
 		],
-	}
-	buttons = {
-		'main-button': e.BTN_MODE,
-		'start-button': e.BTN_START,
-		'select-button': e.BTN_SELECT,
-		'left-stick-press': e.BTN_THUMBL,
-		'right-stick-press': e.BTN_THUMBR,
-		'left-bumper': e.BTN_TL,
-		 'right-bumper': e.BTN_TR,
-		'zl-button': e.BTN_TL2,
-		'zr-button': e.BTN_TR2,
-		'dpad-up': e.BTN_DPAD_UP,
-		'dpad-down': e.BTN_DPAD_DOWN,
-		'dpad-left': e.BTN_DPAD_LEFT,
-		'dpad-right': e.BTN_DPAD_RIGHT,
-		'y-button': e.BTN_Y,
-		'x-button': e.BTN_X,
-		'a-button': e.BTN_A,
-		'b-button': e.BTN_B,
-	}
-	axes = {
-		'left-stick-X': e.ABS_X,
-		'left-stick-Y': e.ABS_Y,
-		'right-stick-X': e.ABS_RX,
-		'right-stick-Y': e.ABS_RY,
-		'left-trigger': e.ABS_Z,
-		'right-trigger': e.ABS_RZ,
+		e.EV_FF: FORCE_FEEDBACK,
 	}
 
-	def __init__(self, device, addr):
-		super().__init__(device, addr)
-		self.type = "Xbox 360 Controller"
-		self._ui = UInput(
-			events=self.capabilities,
-			name=self.type,
-			vendor=0x045e,
-			product=0x028e,
-			version=0x0110,
-			bustype=e.BUS_USB,
-		)
-
-	def send(self, key, value):
-		with self.lock:
-			try:
-				logger.debug(f"Processing input: {key}={value} (type={type(value).__name__})")
-				if key in self.buttons:
-					btn_code = self.buttons[key]
-					btn_value = 1 if value else 0
-					logger.debug(f'Sending button event::{e.keys[btn_code]}: {btn_value}')
-					self._ui.write(e.EV_KEY, btn_code, btn_value)
-					self._ui.syn()
-				elif key in self.axes:
-					axis_code = self.axes[key]
-					if key.endswith('-Y'):
-						coord = 255 - round(127 * (value + 1))
-					else:
-						coord = round(127 * (value + 1)) if isinstance(value, float) else value
-					logger.debug(f'Sending axis event::{e.ABS[axis_code]}: {coord}')
-					self._ui.write(e.EV_ABS, axis_code, coord)
-					self._ui.syn()
-				else:
-					logger.warning(f'Unknown key for X360 controller: {key}')
-			except Exception as ex:
-				logger.error(f"Error sending input to device: {str(ex)}")
-
 
-class DS4Device(Device):
+class DS4Device(UInputDevice, gamepad.DS4Device):
 
 	capabilities = {
 		e.EV_KEY: [
@@ -164,78 +216,6 @@ class DS4Device(Device):
 			# dpad_up, dpad_down
 			(e.ABS_HAT0Y, AbsInfo(
 				value=0, min=0, max=255, fuzz=0, flat=0, resolution=0)),
-		]
-	}
-	buttons = {
-		'main-button': e.BTN_MODE,
-		'back-button': e.BTN_SELECT,
-		'start-button': e.BTN_START,
-		'left-stick-press': e.BTN_THUMBL,
-		'right-stick-press': e.BTN_THUMBR,
-		'left-bumper': e.BTN_TL,
-		'left-trigger': e.BTN_TL2,
-		'right-bumper': e.BTN_TR,
-		'right-trigger': e.BTN_TR2,
-		'y-button': e.BTN_NORTH,
-		'x-button': e.BTN_EAST,
-		'a-button': e.BTN_SOUTH,
-		'b-button': e.BTN_WEST,
-	}
-	dpad = {
-		'up-button': e.ABS_HAT0Y,
-		'right-button': e.ABS_HAT0X,
-		'down-button': e.ABS_HAT0Y,
-		'left-button': e.ABS_HAT0X,
-	}
-	axes = {
-		'left-stick-X': e.ABS_X,
-		'left-stick-Y': e.ABS_Y,
-		'right-stick-X': e.ABS_RX,
-		'right-stick-Y': e.ABS_RY,
+		],
+		e.EV_FF: FORCE_FEEDBACK,
 	}
-
-	def __init__(self, device, addr):
-		super().__init__(device, addr)
-		self.type = "Sony Computer Entertainment Wireless Controller"
-		self._ui = UInput(
-			events=self.capabilities,
-			name=self.type,
-			vendor=1356,
-			product=1476,
-			version=273,
-			bustype=e.BUS_USB,
-		)
-
-	def send(self, key, value):
-		with self.lock:
-			try:
-				# Check if the key is in the buttons dictionary
-				if key in self.buttons:
-					btn_code = self.buttons[key]
-					btn_value = 1 if value else 0
-					logger.debug(f'Sending button event::{e.keys[btn_code]}: {btn_value}')
-					self._ui.write(e.EV_KEY, btn_code, btn_value)
-					self._ui.syn()
-				# Check if the key is in the dpad dictionary
-				elif key in self.dpad:
-					dpad_code = self.dpad[key]
-					if key in {'up-button', 'left-button'}:
-						dpad_value = 0 if value else 127
-					else:
-						dpad_value = 255 if value else 127
-					logger.debug(f'Sending axis event::{e.ABS[dpad_code]}: {dpad_value}')
-					self._ui.write(e.EV_ABS, dpad_code, dpad_value)
-					self._ui.syn()
-				# Check if the key is in the axes dictionary
-				elif key in self.axes:
-					axis_code = self.axes[key]
-					# Convert float value to appropriate coordinate
-					coord = round(127 * value) + 127
-					logger.debug(f'Sending axis event::{e.ABS[axis_code]}: {coord}')
-					self._ui.write(e.EV_ABS, axis_code, coord)
-					self._ui.syn()
-				else:
-					# Key not found in any mapping
-					logger.warning(f'Unknown key for DS4 controller: {key}')
-			except Exception as ex:
-				logger.error(f"Error sending input to device: {str(ex)}")
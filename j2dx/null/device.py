@@ -0,0 +1,34 @@
+"""
+Null backend: the j2dx.gamepad controllers with every write discarded.
+
+Key mapping, shadow state and batching all run as usual, which makes it
+useful for measuring server throughput without any device driver or
+permissions, on any platform.
+"""
+import logging
+from j2dx import gamepad
+
+logger = logging.getLogger('J2DX.null')
+
+
+class NullUInput:
+
+	def __init__(self, events=None, name='null', **kwargs):
+		self.name = name
+
+	def write(self, etype, code, value):
+		pass
+
+	def syn(self):
+		pass
+
+	def close(self):
+		pass
+
+
+class X360Device(gamepad.X360Device):
+	uinput = NullUInput
+
+
+class DS4Device(gamepad.DS4Device):
+	uinput = NullUInput
@@ -0,0 +1,109 @@
+"""
+Recording backend: the j2dx.gamepad controllers writing into memory.
+
+Every event, including SYN_REPORT, is stored with a timestamp in a
+preallocated ring so the exact evdev stream a game would have seen can be
+counted, timed and dumped. Runs on any platform, without device access.
+"""
+import logging
+import os
+import time
+from array import array
+from j2dx import ecodes as e
+from j2dx import gamepad
+
+logger = logging.getLogger('J2DX.recording')
+
+# Fields stored per event: timestamp (ns), type, code, value
+FIELDS = 4
+
+_config = {
+	'capacity': 1 << 16,
+	'dump_dir': None,
+}
+
+
+def configure(capacity=None, dump_dir=None):
+	"""
+	Set the per-device ring capacity (in events) and the directory
+	devices dump their stream to when closed.
+	"""
+	if capacity:
+		_config['capacity'] = capacity
+	_config['dump_dir'] = dump_dir
+
+
+class RecordingUInput:
+
+	def __init__(self, events=None, name='recording', **kwargs):
+		self.name = name
+		self.capacity = _config['capacity']
+		self.dump_dir = _config['dump_dir']
+		self._events = array('q', bytes(8 * FIELDS * self.capacity))
+		self.count = 0
+		self.reports = 0
+		self.write_ns = 0
+
+	def _record(self, etype, code, value):
+		start = time.perf_counter_ns()
+		offset = (self.count % self.capacity) * FIELDS
+		events = self._events
+		events[offset] = start
+		events[offset + 1] = etype
+		events[offset + 2] = code
+		events[offset + 3] = value
+		self.count += 1
+		self.write_ns += time.perf_counter_ns() - start
+
+	def write(self, etype, code, value):
+		self._record(etype, code, value)
+
+	def syn(self):
+		self._record(e.EV_SYN, e.SYN_REPORT, 0)
+		self.reports += 1
+
+	def events(self):
+		"""Yields the recorded (timestamp, type, code, value) tuples, oldest first."""
+		first = max(0, self.count - self.capacity)
+		for index in range(first, self.count):
+			offset = (index % self.capacity) * FIELDS
+			yield tuple(self._events[offset:offset + FIELDS])
+
+	def dump(self, fd):
+		"""Writes the stream in an evtest-like text format."""
+		for timestamp, etype, code, value in self.events():
+			name = e.bytype.get(etype, {}).get(code, code)
+			fd.write(f'{timestamp / 1e9:.6f} {e.EV[etype]} {name} {value}\n')
+
+	def stats(self):
+		return {
+			'events': self.count,
+			'reports': self.reports,
+			'overwritten': max(0, self.count - self.capacity),
+			'write_ns': self.write_ns,
+		}
+
+	def close(self):
+		if self.dump_dir:
+			filename = f"{self.name.replace(' ', '_')}-{id(self):x}.events"
+			path = os.path.join(self.dump_dir, filename)
+			with open(path, 'w') as fd:
+				self.dump(fd)
+			logger.info(f'Dumped {self.count} events to {path}')
+
+
+class RecordingDevice:
+	uinput = RecordingUInput
+
+	def stats(self):
+		stats = super().stats()
+		stats.update(self._ui.stats())
+		return stats
+
+
+class X360Device(RecordingDevice, gamepad.X360Device):
+	pass
+
+
+class DS4Device(RecordingDevice, gamepad.DS4Device):
+	pass
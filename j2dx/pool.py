@@ -0,0 +1,128 @@
+"""
+Pool of pre-created virtual devices.
+"""
+import asyncio
+import logging
+import time
+from collections import deque
+
+from j2dx.latency import Histogram, NS_PER_US
+
+logger = logging.getLogger('J2DX.pool')
+
+
+class DevicePool:
+    """
+    Keeps idle virtual devices per controller kind so a session gets one
+    instantly instead of waiting for the device to be created and
+    enumerated. Released devices are reset to neutral and kept while the
+    pool is below its configured size, otherwise they are closed.
+
+    Devices are created, assigned, reset and closed in the executor since
+    all of those block, devices in the writer process on a pipe round trip.
+    """
+
+    def __init__(self, factories, sizes, executor=None):
+        self.factories = factories
+        self.sizes = sizes
+        self.executor = executor
+        self._idle = {kind: deque() for kind in factories}
+        self._kinds = {factory: kind for kind, factory in factories.items()}
+        self._filling = set()
+        self._tasks = set()
+        self.hits = 0
+        self.misses = 0
+        self.created = 0
+        self.create_time = Histogram()
+        self.closed = 0
+        self.close_time = Histogram()
+
+    def _create(self, kind, device, addr):
+        started = time.perf_counter_ns()
+        instance = self.factories[kind](device, addr)
+        self.create_time.record((time.perf_counter_ns() - started) // NS_PER_US)
+        self.created += 1
+        return instance
+
+    def _close(self, instance):
+        started = time.perf_counter_ns()
+        try:
+            instance.close()
+        finally:
+            self.close_time.record((time.perf_counter_ns() - started) // NS_PER_US)
+            self.closed += 1
+
+    @staticmethod
+    def _recycle(instance):
+        instance.reset()
+        instance.assign('pool', 'idle')
+
+    def kind(self, instance):
+        """The controller kind of a device made by this pool."""
+        return self._kinds.get(type(instance))
+
+    async def fill(self, kind=None):
+        """Create devices until the pool (or one kind of it) is full."""
+        loop = asyncio.get_running_loop()
+        for kind in [kind] if kind else list(self.factories):
+            if kind in self._filling:
+                continue
+            self._filling.add(kind)
+            try:
+                while len(self._idle[kind]) < self.sizes.get(kind, 0):
+                    instance = await loop.run_in_executor(
+                        self.executor, self._create, kind, 'pool', 'idle')
+                    self._idle[kind].append(instance)
+            except Exception as e:
+                logger.error(f'Error pre-creating {kind} device: {e}')
+            finally:
+                self._filling.discard(kind)
+
+    async def acquire(self, kind, device, addr):
+        """Returns a device of the given kind assigned to device/addr."""
+        if self._idle[kind]:
+            instance = self._idle[kind].popleft()
+            await asyncio.get_running_loop().run_in_executor(
+                self.executor, instance.assign, device, addr)
+            self.hits += 1
+            task = asyncio.get_running_loop().create_task(self.fill(kind))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+            return instance
+        self.misses += 1
+        return await asyncio.get_running_loop().run_in_executor(
+            self.executor, self._create, kind, device, addr)
+
+    async def release(self, instance):
+        """Reset a device and keep it for the next session, or close it."""
+        loop = asyncio.get_running_loop()
+        kind = self.kind(instance)
+        if kind is not None and len(self._idle[kind]) < self.sizes.get(kind, 0):
+            try:
+                await loop.run_in_executor(self.executor, self._recycle, instance)
+                self._idle[kind].append(instance)
+                return
+            except Exception as e:
+                logger.error(f'Error resetting {kind} device, closing it: {e}')
+        await loop.run_in_executor(self.executor, self._close, instance)
+
+    async def close(self):
+        loop = asyncio.get_running_loop()
+        for kind, idle in self._idle.items():
+            while idle:
+                try:
+                    await loop.run_in_executor(self.executor, self._close, idle.popleft())
+                except Exception as e:
+                    logger.error(f'Error closing idle {kind} device: {e}')
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'created': self.created,
+            'idle': {kind: len(idle) for kind, idle in self._idle.items()},
+            'size': dict(self.sizes),
+            'create_time': self.create_time.summary(),
+            'closed': self.closed,
+            'close_time': self.close_time.summary(),
+        }
@@ -0,0 +1,238 @@
+"""
+Compact binary input frames and minimal text input.
+
+A frame carries the full state of one controller in a fixed-size,
+little-endian struct:
+
+    uint32  sequence number
+    uint32  button bitmask, bit i set means BUTTONS[i] is pressed
+    int16   left-stick-X, left-stick-Y, right-stick-X, right-stick-Y
+    int16   left-trigger, right-trigger
+
+Sticks are scaled to -32767..32767, triggers to 0..32767.
+
+A connection driving several controllers sends their frames together,
+each prefixed with the uint8 slot of its controller (SLOT_FRAME_SIZE
+bytes per controller).
+
+Text input is one "<key> <value>" pair per line, where value is true,
+false, an integer (buttons, raw trigger values) or a float with a decimal
+point (sticks), e.g. "left-stick-X 0.5\na-button true".
+
+Single 'input' events come in one of several codecs, picked once per
+session when it connects (see CompatibilityWrapper):
+
+    dict     {"key": ..., "value": ..., "slot": ...}, Socket.IO v3+ apps
+    args     key, value[, slot] as separate event arguments, legacy apps
+    compact  [key, value] or [key, value, slot]
+    text     "<key> <value>", one line of text input
+
+Every decoder takes the event arguments as a tuple and returns
+(key, value, slot), raising LookupError, TypeError or ValueError for
+input it cannot decode.
+"""
+import struct
+
+FRAME = struct.Struct('<II6h')
+SLOT_FRAME_SIZE = 1 + FRAME.size
+AXIS_MAX = 32767
+TRIGGER_MAX = 255
+SEQ_MOD = 1 << 32
+
+BUTTONS = (
+    'a-button',
+    'b-button',
+    'x-button',
+    'y-button',
+    'left-bumper',
+    'right-bumper',
+    'zl-button',
+    'zr-button',
+    'select-button',
+    'back-button',
+    'start-button',
+    'main-button',
+    'left-stick-press',
+    'right-stick-press',
+    'dpad-up',
+    'dpad-down',
+    'dpad-left',
+    'dpad-right',
+    'up-button',
+    'down-button',
+    'left-button',
+    'right-button',
+)
+STICKS = (
+    'left-stick-X',
+    'left-stick-Y',
+    'right-stick-X',
+    'right-stick-Y',
+)
+TRIGGERS = (
+    'left-trigger',
+    'right-trigger',
+)
+AXES = STICKS + TRIGGERS
+
+BUTTON_BITS = {key: 1 << i for i, key in enumerate(BUTTONS)}
+
+
+def is_newer(seq, last):
+    """Serial number comparison that survives the 32 bit wrap around."""
+    return 0 < (seq - last) % SEQ_MOD < SEQ_MOD // 2
+
+
+def parse_value(text):
+    if text == 'true':
+        return True
+    if text == 'false':
+        return False
+    if '.' in text or 'e' in text:
+        return float(text)
+    return int(text)
+
+
+def parse_text(text):
+    """Returns the (key, value) pairs of a text input message."""
+    events = []
+    for line in text.splitlines():
+        key, _, value = line.strip().partition(' ')
+        if key:
+            events.append((key, parse_value(value.strip())))
+    return events
+
+
+def decode_dict(args):
+    data = args[0]
+    return data['key'], data['value'], data.get('slot', 0)
+
+
+def decode_args(args):
+    if len(args) == 2:
+        return args[0], args[1], 0
+    key, value, slot = args
+    return key, value, slot
+
+
+def decode_compact(args):
+    data = args[0]
+    if len(data) == 2:
+        return data[0], data[1], 0
+    key, value, slot = data
+    return key, value, slot
+
+
+def decode_text(args):
+    key, _, value = args[0].partition(' ')
+    return key, parse_value(value.strip()), 0
+
+
+CODECS = {
+    'dict': decode_dict,
+    'args': decode_args,
+    'compact': decode_compact,
+    'text': decode_text,
+}
+
+
+def parse_batch(data):
+    """
+    Normalize an input batch to a list of (key, value) pairs.
+    Accepts a list of {'key': ..., 'value': ...} objects or [key, value] pairs,
+    optionally wrapped in {'events': [...]}.
+    """
+    if isinstance(data, dict):
+        data = data.get('events')
+    if not isinstance(data, list):
+        raise ValueError(f'Invalid input batch: {data}')
+    events = []
+    for item in data:
+        if isinstance(item, dict) and 'key' in item and 'value' in item:
+            events.append((item['key'], item['value']))
+        elif isinstance(item, (list, tuple)) and len(item) == 2:
+            events.append((item[0], item[1]))
+        else:
+            raise ValueError(f'Invalid input batch entry: {item}')
+    return events
+
+
+def pack_frame(seq, pressed=(), axes=None):
+    """
+    Build a frame from an iterable of pressed button keys
+    and a mapping of axis key to -1.0..1.0 (sticks) or 0.0..1.0 (triggers).
+    """
+    buttons = 0
+    for key in pressed:
+        buttons |= BUTTON_BITS[key]
+    axes = axes or {}
+    return FRAME.pack(
+        seq % SEQ_MOD,
+        buttons,
+        *(round(max(-1.0, min(1.0, axes.get(key, 0.0))) * AXIS_MAX) for key in AXES)
+    )
+
+
+def pack_frames(frames):
+    """Concatenate (slot, frame) pairs into one multi-controller message."""
+    return b''.join(bytes((slot,)) + frame for slot, frame in frames)
+
+
+def split_frames(data):
+    """
+    Returns the (slot, frame) pairs of a multi-controller message, the
+    frames as memoryviews into data.
+    """
+    if len(data) % SLOT_FRAME_SIZE:
+        raise ValueError(f'Message length must be a multiple of {SLOT_FRAME_SIZE} bytes')
+    view = memoryview(data)
+    return [
+        (view[offset], view[offset + 1:offset + SLOT_FRAME_SIZE])
+        for offset in range(0, len(view), SLOT_FRAME_SIZE)
+    ]
+
+
+class FrameDecoder:
+    """
+    Decodes frames for a single session and diffs them against
+    the last accepted state, so only changed keys reach the device.
+    """
+
+    def __init__(self):
+        self.seq = None
+        self.buttons = 0
+        self.axes = (0,) * len(AXES)
+        self.stale = 0
+
+    def decode(self, data):
+        """
+        Returns the list of (key, value) changes carried by the frame.
+        Frames older than the last accepted one are counted and ignored.
+        """
+        seq, buttons, *axes = FRAME.unpack(data)
+        if self.seq is not None and not is_newer(seq, self.seq):
+            self.stale += 1
+            return []
+        self.seq = seq
+
+        events = []
+        changed = buttons ^ self.buttons
+        while changed:
+            bit = changed & -changed
+            index = bit.bit_length() - 1
+            if index < len(BUTTONS):
+                events.append((BUTTONS[index], bool(buttons & bit)))
+            changed ^= bit
+        self.buttons = buttons
+
+        last = self.axes
+        for index, key in enumerate(STICKS):
+            if axes[index] != last[index]:
+                events.append((key, axes[index] / AXIS_MAX))
+        for index, key in enumerate(TRIGGERS, len(STICKS)):
+            if axes[index] != last[index]:
+                # Triggers are sent as 0..255 integers like the JSON clients do
+                value = max(axes[index], 0)
+                events.append((key, round(value * TRIGGER_MAX / AXIS_MAX)))
+        self.axes = tuple(axes)
+        return events
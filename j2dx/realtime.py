@@ -0,0 +1,111 @@
+"""
+Real-time mode: keep the server from being descheduled by a busy game.
+
+Every setting is best effort. Each helper returns a short description of
+the outcome instead of raising, so the server can report at startup what
+actually took effect on this system and with these permissions.
+"""
+import importlib.util
+import os
+
+# SCHED_FIFO priority of the device writer thread, above normal threads
+# but well below the kernel's own real-time threads
+FIFO_PRIORITY = 10
+# Niceness of the event loop thread
+LOOP_NICE = -10
+
+MCL_CURRENT = 1
+MCL_FUTURE = 2
+
+
+def parse_cores(text):
+    """Parses a core list like "2,3" or "4-7" into a set of core indices."""
+    cores = set()
+    for part in text.split(','):
+        first, _, last = part.strip().partition('-')
+        cores.update(range(int(first), int(last or first) + 1))
+    return cores
+
+
+def use_uvloop():
+    """Make new event loops uvloop loops, must run before the loop is created."""
+    import asyncio
+    try:
+        import uvloop
+    except ImportError:
+        return 'asyncio (uvloop not installed)'
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    return 'uvloop'
+
+
+def http_implementation():
+    """The uvicorn HTTP protocol to use: httptools when it is installed."""
+    if importlib.util.find_spec('httptools') is not None:
+        return 'httptools'
+    return 'h11'
+
+
+def pin(cores):
+    """Pin the calling thread to the given cores."""
+    if not cores:
+        return 'not requested'
+    if not hasattr(os, 'sched_setaffinity'):
+        return 'unsupported on this platform'
+    try:
+        # On Linux pid 0 means the calling thread, not the whole process
+        os.sched_setaffinity(0, cores)
+    except (OSError, ValueError) as e:
+        return f'failed: {e}'
+    return 'cores ' + ','.join(str(core) for core in sorted(cores))
+
+
+def fifo(priority=FIFO_PRIORITY):
+    """Move the calling thread to the SCHED_FIFO real-time class."""
+    if not hasattr(os, 'sched_setscheduler'):
+        return 'unsupported on this platform'
+    try:
+        os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(priority))
+    except OSError as e:
+        return f'failed: {e.strerror} (needs CAP_SYS_NICE or an rtprio limit)'
+    return f'priority {priority}'
+
+
+def renice(value=LOOP_NICE):
+    """Raise the priority of the calling thread within the normal class."""
+    if not hasattr(os, 'setpriority'):
+        return 'unsupported on this platform'
+    try:
+        os.setpriority(os.PRIO_PROCESS, 0, value)
+    except OSError as e:
+        return f'failed: {e.strerror} (needs CAP_SYS_NICE or a nice limit)'
+    return f'nice {os.getpriority(os.PRIO_PROCESS, 0)}'
+
+
+def lock_memory():
+    """Lock current and future pages in RAM so input never waits on a page fault."""
+    import ctypes
+    import ctypes.util
+    name = ctypes.util.find_library('c')
+    if os.name != 'posix' or name is None:
+        return 'unsupported on this platform'
+    libc = ctypes.CDLL(name, use_errno=True)
+    if libc.mlockall(MCL_CURRENT | MCL_FUTURE) != 0:
+        return f'failed: {os.strerror(ctypes.get_errno())} (needs CAP_IPC_LOCK or a memlock limit)'
+    return 'enabled'
+
+
+def prepare_loop_thread(cores):
+    """Settings for the thread running the event loop."""
+    return {
+        'loop affinity': pin(cores),
+        'loop priority': renice(),
+        'memory lock': lock_memory(),
+    }
+
+
+def prepare_writer_thread(cores):
+    """Settings for the thread writing to the devices."""
+    return {
+        'writer affinity': pin(cores),
+        'writer priority': fifo(),
+    }
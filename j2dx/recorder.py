@@ -0,0 +1,217 @@
+"""
+Input recorder.
+
+With --record, every input event a device receives is appended to a
+binary log, whatever transport it came in on, so production sequences can
+be replayed later with j2dx.utils.replay. The log is written through a
+memory mapped file: appending stores three machine words into the
+mapping through typed memoryviews, no system call, packing or allocation
+per event.
+
+Layout, in native byte order (little-endian on every supported
+platform):
+
+    header of HEADER.size bytes: magic, version, record size
+    records of RECORD.size bytes:
+        int64   nanoseconds since the recording started
+        uint16  stream
+        uint8   record type
+        uint8   value kind
+        uint16  key index into KEYS
+        2 bytes padding
+        double  value
+
+The file is extended sparsely, CAPACITY records at a time, and trimmed
+when the recording is closed. No record type is 0 and the type is stored
+last, so a log cut short by a crash reads up to its last complete record.
+
+A stream is one device from the moment it is handed to a session until
+it goes back to the pool, so a resumed session continues its stream. The
+OPEN record of a stream carries the controller kind as its value. Ids of
+closed streams are reused once all STREAMS ids have been handed out, so
+an id names one stream between its OPEN and CLOSE records.
+"""
+import logging
+import mmap
+import os
+import struct
+import time
+from collections import deque
+
+from j2dx.protocol import AXES, BUTTONS
+
+logger = logging.getLogger('J2DX.recorder')
+
+MAGIC = b'J2DXREC\0'
+VERSION = 1
+HEADER = struct.Struct('=8sHH4x')
+RECORD = struct.Struct('=qHBBH2xd')
+# Records per file extension, 24 MiB
+CAPACITY = 1 << 20
+# Stream ids fit the uint16 stream field
+STREAMS = 1 << 16
+
+KEYS = BUTTONS + AXES
+KEY_INDEX = {key: index for index, key in enumerate(KEYS)}
+KINDS = ('xbox', 'ds4')
+
+# Record types
+OPEN, INPUT, RESET, CLOSE = range(1, 5)
+# Value kinds, so a replay hands the device the same type it was sent
+BOOL, INT, FLOAT = range(3)
+_DECODE = (bool, int, float)
+_VALUE_KINDS = {bool: BOOL << 24, int: INT << 24, float: FLOAT << 24}
+
+_WORDS = RECORD.size // 8
+
+
+def _meta(stream, record_type, index=0):
+    """The second word of a record, without the value kind."""
+    return stream | record_type << 16 | index << 32
+
+
+class Stream:
+    """Records the input of one device, see InputRecorder.stream()."""
+    __slots__ = ('recorder', 'id', '_keys')
+
+    def __init__(self, recorder, id):
+        self.recorder = recorder
+        self.id = id
+        self._keys = {key: _meta(id, INPUT, index) for key, index in KEY_INDEX.items()}
+
+    def input(self, key, value):
+        meta = self._keys.get(key)
+        kind = _VALUE_KINDS.get(value.__class__)
+        if meta is None or kind is None:
+            # Nothing a device would apply either
+            self.recorder.skipped += 1
+            return
+        self.recorder.write(meta | kind, value)
+
+    def reset(self):
+        self.recorder.write(_meta(self.id, RESET), 0)
+
+
+class InputRecorder:
+    """Append-only input log at path, see the module docstring."""
+
+    def __init__(self, path, capacity=CAPACITY):
+        self.path = path
+        self.capacity = capacity
+        self.records = 0
+        self.skipped = 0
+        self._streams = {}
+        self._next_stream = 0
+        # Ids of closed streams, oldest first
+        self._free_streams = deque()
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+        self._map = None
+        self._words = self._values = None
+        self._size = HEADER.size
+        self._grow()
+        HEADER.pack_into(self._map, 0, MAGIC, VERSION, RECORD.size)
+        self._next = HEADER.size // 8
+        self._start = time.perf_counter_ns()
+
+    def _grow(self):
+        """Extend the file and the mapping by capacity records."""
+        self._size += self.capacity * RECORD.size
+        if self._map is not None:
+            # The mapping cannot be resized while views of it exist
+            self._words.release()
+            self._values.release()
+        os.ftruncate(self._fd, self._size)
+        if self._map is None:
+            self._map = mmap.mmap(self._fd, self._size)
+        else:
+            self._map.resize(self._size)
+        self._words = memoryview(self._map).cast('q')
+        self._values = memoryview(self._map).cast('d')
+        # Last word a record may start at
+        self._end = len(self._words) - _WORDS
+
+    def stream(self, device, kind):
+        """
+        The stream of device, opened on first use. kind is the controller
+        kind the device was requested as.
+        """
+        stream = self._streams.get(device)
+        if stream is None:
+            stream = self._streams[device] = Stream(self, self._stream_id())
+            self.write(_meta(stream.id, OPEN), KINDS.index(kind))
+        return stream
+
+    def _stream_id(self):
+        if self._next_stream < STREAMS:
+            self._next_stream += 1
+            return self._next_stream - 1
+        if not self._free_streams:
+            raise RuntimeError(f'More than {STREAMS} devices recorded at once')
+        return self._free_streams.popleft()
+
+    def close_stream(self, device):
+        """The device left its session, e.g. back into the pool."""
+        stream = self._streams.pop(device, None)
+        if stream is not None:
+            self.write(_meta(stream.id, CLOSE), 0)
+            self._free_streams.append(stream.id)
+
+    def write(self, meta, value):
+        """Append one record, meta being its second word."""
+        at = self._next
+        if at > self._end:
+            if self._map is None:
+                return
+            self._grow()
+        words = self._words
+        words[at] = time.perf_counter_ns() - self._start
+        self._values[at + 2] = value
+        words[at + 1] = meta
+        self._next = at + _WORDS
+        self.records += 1
+
+    def close(self):
+        """Close every open stream and trim the file to its records."""
+        if self._map is None:
+            return
+        for device in list(self._streams):
+            self.close_stream(device)
+        self._words.release()
+        self._values.release()
+        self._map.flush()
+        self._map.close()
+        self._map = None
+        os.ftruncate(self._fd, self._next * 8)
+        os.close(self._fd)
+        logger.info(f'Recorded {self.records} records to {self.path}')
+
+
+def read(path):
+    """
+    Returns the records of a log as (ns, stream, type, key, value) tuples.
+    key is None for records that are not input; value is the controller
+    kind for OPEN records.
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    if len(data) < HEADER.size:
+        raise ValueError(f'{path} is not an input log')
+    magic, version, size = HEADER.unpack_from(data)
+    if magic != MAGIC or size != RECORD.size:
+        raise ValueError(f'{path} is not an input log')
+    if version != VERSION:
+        raise ValueError(f'Unsupported input log version {version}')
+    end = HEADER.size + (len(data) - HEADER.size) // RECORD.size * RECORD.size
+    records = []
+    for ns, stream, record_type, kind, index, value in RECORD.iter_unpack(
+            memoryview(data)[HEADER.size:end]):
+        if record_type == INPUT:
+            records.append((ns, stream, record_type, KEYS[index], _DECODE[kind](value)))
+        elif record_type == OPEN:
+            records.append((ns, stream, record_type, None, KINDS[int(value)]))
+        elif record_type:
+            records.append((ns, stream, record_type, None, None))
+        else:
+            # Never written, the recording ended before this record
+            break
+    return records
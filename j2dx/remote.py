@@ -0,0 +1,360 @@
+"""
+Device writer process.
+
+A separate process owns every virtual device, so network handling and
+device output run on their own cores and under their own GIL. Input
+reaches it through one single-producer/single-consumer ring per device in
+a shared memory segment; device creation, reset, close and stats go over
+a pipe.
+
+Ring layout, all integers little-endian:
+
+    uint64  head, advanced by the server after writing records
+    uint64  tail, advanced by the writer after applying them
+    records of RECORD.size bytes: key index, value kind, flags, value
+
+Head and tail sit on separate cache lines and each is only written by one
+side, so no lock is needed. The writer sleeps on its pipes when every
+ring is empty; the server only rings the doorbell pipe when the writer
+flagged itself as sleeping.
+"""
+import logging
+import multiprocessing
+import signal
+import struct
+import threading
+import time
+from multiprocessing import shared_memory
+from multiprocessing.connection import wait
+
+from j2dx.state import ControllerState
+
+logger = logging.getLogger('J2DX.remote')
+
+RECORD = struct.Struct('<HBB4xd')
+COUNTER = struct.Struct('<Q')
+FLAG = struct.Struct('<I')
+CACHE_LINE = 64
+RING_HEADER = 2 * CACHE_LINE
+
+# Value kinds, so the writer hands the device the same type it was sent
+BOOL, INT, FLOAT = range(3)
+# Set on the last record of a send_many() batch
+END_OF_BATCH = 1
+
+# Upper bound of a sleep, in case a wakeup is missed
+IDLE_TIMEOUT = 0.05
+
+
+class Ring:
+    """One device's record ring inside the shared memory segment."""
+
+    def __init__(self, buf, offset, capacity):
+        self.buf = buf
+        self.capacity = capacity
+        self._head_at = offset
+        self._tail_at = offset + CACHE_LINE
+        self._records_at = offset + RING_HEADER
+        # Each side caches the counter it owns
+        self.head = COUNTER.unpack_from(buf, self._head_at)[0]
+        self.tail = COUNTER.unpack_from(buf, self._tail_at)[0]
+
+    @staticmethod
+    def size(capacity):
+        return RING_HEADER + capacity * RECORD.size
+
+    def empty(self):
+        return COUNTER.unpack_from(self.buf, self._head_at)[0] == self.tail
+
+    def push(self, records, wake):
+        """
+        Producer side: append records and publish them at once.
+        Waits for the writer when the ring is full.
+        """
+        count = len(records)
+        if count > self.capacity:
+            raise ValueError(f'Batch of {count} records exceeds the ring capacity')
+        head = self.head
+        while head + count - COUNTER.unpack_from(self.buf, self._tail_at)[0] > self.capacity:
+            wake()
+            time.sleep(0.0002)
+        for index, kind, flags, value in records:
+            at = self._records_at + (head % self.capacity) * RECORD.size
+            RECORD.pack_into(self.buf, at, index, kind, flags, value)
+            head += 1
+        COUNTER.pack_into(self.buf, self._head_at, head)
+        self.head = head
+
+    def pop(self):
+        """Consumer side: returns every published record and frees them."""
+        head = COUNTER.unpack_from(self.buf, self._head_at)[0]
+        tail = self.tail
+        if head == tail:
+            return ()
+        records = [
+            RECORD.unpack_from(
+                self.buf, self._records_at + (position % self.capacity) * RECORD.size)
+            for position in range(tail, head)
+        ]
+        COUNTER.pack_into(self.buf, self._tail_at, head)
+        self.tail = head
+        return records
+
+    def reset(self):
+        COUNTER.pack_into(self.buf, self._head_at, 0)
+        COUNTER.pack_into(self.buf, self._tail_at, 0)
+        self.head = self.tail = 0
+
+
+def _encode(value):
+    if isinstance(value, bool):
+        return BOOL, float(value)
+    if isinstance(value, int):
+        return INT, float(value)
+    return FLOAT, float(value)
+
+
+_DECODE = (bool, int, float)
+
+
+def _serve(factories, initializers, name, slots, capacity, conn, doorbell):
+    """Main loop of the writer process."""
+    # Ctrl+C reaches the whole process group. The server shuts the writer
+    # down after closing its devices, and the closed pipe ends the loop
+    # if the server dies.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    for initializer in initializers:
+        initializer()
+    shm = shared_memory.SharedMemory(name=name)
+    rings = [
+        Ring(shm.buf, CACHE_LINE + slot * Ring.size(capacity), capacity)
+        for slot in range(slots)
+    ]
+    devices = {}
+
+    def drain(slot):
+        records = rings[slot].pop()
+        if not records:
+            return False
+        device, keys = devices[slot]
+        batch = []
+        for index, kind, flags, value in records:
+            batch.append((keys[index], _DECODE[kind](value)))
+            if flags & END_OF_BATCH:
+                device.send_many(batch)
+                batch = []
+        if batch:
+            device.send_many(batch)
+        return True
+
+    def handle(command, slot, *args):
+        if command == 'create':
+            kind, device, addr = args
+            rings[slot].reset()
+            instance = factories[kind](device, addr)
+            devices[slot] = (instance, tuple(sorted(instance.dispatch)))
+            return None
+        # Everything queued before the command is applied first
+        drain(slot)
+        instance = devices[slot][0]
+        if command == 'assign':
+            return instance.assign(*args)
+        if command == 'reset':
+            return instance.reset()
+        if command == 'stats':
+            return instance.stats()
+        if command == 'close':
+            del devices[slot]
+            return instance.close()
+        raise ValueError(f'Unknown command: {command}')
+
+    running = True
+    try:
+        while running:
+            busy = False
+            for slot in list(devices):
+                busy = drain(slot) or busy
+            while conn.poll():
+                busy = True
+                request = conn.recv()
+                if request is None:
+                    running = False
+                    break
+                try:
+                    conn.send(('ok', handle(*request)))
+                except Exception as e:
+                    conn.send(('error', e))
+            if busy or not running:
+                continue
+            FLAG.pack_into(shm.buf, 0, 1)
+            if conn.poll() or not all(rings[slot].empty() for slot in devices):
+                FLAG.pack_into(shm.buf, 0, 0)
+                continue
+            wait((conn, doorbell), IDLE_TIMEOUT)
+            while doorbell.poll():
+                doorbell.recv_bytes()
+            FLAG.pack_into(shm.buf, 0, 0)
+    except EOFError:
+        pass
+    finally:
+        for instance, _ in devices.values():
+            try:
+                instance.close()
+            except Exception as e:
+                logger.error(f'Error closing {instance.type} device: {e}')
+        shm.close()
+
+
+class RemoteDevice:
+    """
+    Server side proxy of a device living in the writer process.
+    Subclasses are made per controller kind by WriterProcess.device_classes().
+    """
+    process = None
+    kind = None
+    type = None
+    analog = frozenset()
+    keys = {}
+
+    def __init__(self, device, addr):
+        self.device = device
+        self.address = addr
+        # Kept on this side so the server can read it without a round trip
+        self.state = ControllerState()
+        self._slot, self._ring = self.process._open(self.kind, device, addr)
+
+    def send(self, key, value):
+        self.send_many(((key, value),))
+
+    def send_many(self, events):
+        records = []
+        for key, value in events:
+            index = self.keys.get(key)
+            if index is None:
+                logger.warning(f'Unknown key for {self.type}: {key}')
+                continue
+            self.state.set(key, value)
+            kind, value = _encode(value)
+            records.append((index, kind, 0, value))
+        if records:
+            index, kind, _, value = records[-1]
+            records[-1] = (index, kind, END_OF_BATCH, value)
+            self._ring.push(records, self.process.wake)
+            self.process.wake()
+
+    def assign(self, device, addr):
+        self.device = device
+        self.address = addr
+        self.process._call('assign', self._slot, device, addr)
+
+    def reset(self):
+        self.process._call('reset', self._slot)
+        self.state.clear()
+
+    def stats(self):
+        return self.process._call('stats', self._slot)
+
+    def close(self):
+        try:
+            self.process._call('close', self._slot)
+        finally:
+            self.process._free(self._slot)
+
+
+class WriterProcess:
+    """
+    Starts the writer process and hands out RemoteDevice classes for
+    each kind in factories. initializers run in the writer process before
+    any device is created, to carry over module level configuration.
+    """
+
+    def __init__(self, factories, initializers=(), slots=64, capacity=1024):
+        self.factories = factories
+        self.initializers = list(initializers)
+        self.slots = slots
+        self.capacity = capacity
+        self._lock = threading.Lock()
+        self._free_slots = list(range(slots - 1, -1, -1))
+        self._shm = None
+        self._process = None
+
+    def start(self):
+        context = multiprocessing.get_context('spawn')
+        size = CACHE_LINE + self.slots * Ring.size(self.capacity)
+        self._shm = shared_memory.SharedMemory(create=True, size=size)
+        self._shm.buf[:size] = bytes(size)
+        self._conn, child = context.Pipe()
+        doorbell, self._doorbell = context.Pipe(duplex=False)
+        self._process = context.Process(
+            target=_serve, name='j2dx-writer', daemon=True,
+            args=(self.factories, self.initializers, self._shm.name,
+                  self.slots, self.capacity, child, doorbell))
+        self._process.start()
+        child.close()
+        doorbell.close()
+        logger.info(f'Started device writer process {self._process.pid}')
+
+    def stop(self):
+        if self._process is None:
+            return
+        try:
+            with self._lock:
+                self._conn.send(None)
+        except OSError:
+            pass
+        self._process.join(5)
+        if self._process.is_alive():
+            self._process.terminate()
+        self._conn.close()
+        self._doorbell.close()
+        self._shm.close()
+        self._shm.unlink()
+        self._process = None
+
+    def device_classes(self):
+        """RemoteDevice subclasses with the interface of each factory."""
+        classes = {}
+        for kind, factory in self.factories.items():
+            classes[kind] = type(f'Remote{factory.__name__}', (RemoteDevice,), {
+                'process': self,
+                'kind': kind,
+                'type': factory.type,
+                'analog': factory.analog,
+                'keys': {key: index for index, key in enumerate(sorted(factory.dispatch))},
+            })
+        return classes
+
+    def wake(self):
+        if FLAG.unpack_from(self._shm.buf, 0)[0]:
+            try:
+                self._doorbell.send_bytes(b'')
+            except OSError:
+                pass
+
+    def _call(self, *request):
+        with self._lock:
+            try:
+                self._conn.send(request)
+                status, result = self._conn.recv()
+            except (OSError, EOFError):
+                raise RuntimeError('Device writer process is not running') from None
+        if status == 'error':
+            raise result
+        return result
+
+    def _open(self, kind, device, addr):
+        with self._lock:
+            if not self._free_slots:
+                raise RuntimeError(f'All {self.slots} writer slots are in use')
+            slot = self._free_slots.pop()
+        try:
+            self._call('create', slot, kind, device, addr)
+        except Exception:
+            self._free(slot)
+            raise
+        ring = Ring(self._shm.buf, CACHE_LINE + slot * Ring.size(self.capacity), self.capacity)
+        return slot, ring
+
+    def _free(self, slot):
+        with self._lock:
+            self._free_slots.append(slot)
@@ -0,0 +1,95 @@
+"""
+Force feedback return channel: rumble a game plays on a virtual device is
+forwarded to the client owning it.
+"""
+import asyncio
+import logging
+
+logger = logging.getLogger('J2DX.rumble')
+
+# Minimum seconds between two rumble messages to one client
+INTERVAL = 0.05
+
+
+def _discard(message):
+    pass
+
+
+class RumbleChannel:
+    """
+    Watches one device's file descriptor from the event loop and passes
+    its rumble to send as {'strong', 'weak', 'duration'} messages.
+
+    Reading never blocks: the descriptor is non-blocking and only read
+    once the loop reports it readable, so the input path is never held
+    up. Updates closer together than interval are coalesced; the first
+    goes out at once, later ones wait for the interval and only the
+    newest is sent, so the client always ends on the current state.
+    """
+
+    def __init__(self, device, send, interval=INTERVAL):
+        self.device = device
+        self.send = send
+        self.interval = interval
+        self.updates = 0
+        self.sent = 0
+        self._loop = None
+        self._fd = None
+        self._pending = None
+        self._timer = None
+        self._last = float('-inf')
+
+    def start(self):
+        """Start watching the device. Returns False if it has no force feedback."""
+        fileno = getattr(self.device, 'fileno', None)
+        fd = fileno() if fileno is not None else None
+        if fd is None:
+            return False
+        self._loop = asyncio.get_running_loop()
+        self._loop.add_reader(fd, self._readable)
+        self._fd = fd
+        return True
+
+    def stop(self):
+        if self._fd is not None:
+            self._loop.remove_reader(self._fd)
+            self._fd = None
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+    def detach(self):
+        """Keep answering the game but stop sending, e.g. while the client is away."""
+        self.send = _discard
+
+    def stats(self):
+        return {
+            'rumble_updates': self.updates,
+            'rumble_sent': self.sent,
+        }
+
+    def _readable(self):
+        try:
+            rumble = self.device.read_feedback()
+        except OSError as e:
+            logger.error(f'Error reading force feedback of {self.device.device}: {e}')
+            self.stop()
+            return
+        if rumble is None:
+            return
+        self.updates += 1
+        self._pending = rumble
+        if self._timer is None:
+            wait = self._last + self.interval - self._loop.time()
+            if wait > 0:
+                self._timer = self._loop.call_later(wait, self._flush)
+            else:
+                self._flush()
+
+    def _flush(self):
+        self._timer = None
+        strong, weak, duration = self._pending
+        self._pending = None
+        self._last = self._loop.time()
+        self.sent += 1
+        self.send({'strong': strong, 'weak': weak, 'duration': duration})
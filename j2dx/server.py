@@ -0,0 +1,892 @@
+"""
+The J2DX server: Socket.IO, HTTP, WebSocket and UDP input feeding the
+virtual devices. Only imported once the command line is parsed, so --help
+and --setup never load the web stack.
+"""
+import asyncio
+import logging
+import platform
+import secrets
+import sys
+import time
+from functools import partial
+
+import socketio
+import uvicorn
+from fastapi import FastAPI, Request, Response, WebSocket, WebSocketDisconnect
+from fastapi.middleware.cors import CORSMiddleware
+
+from j2dx import default_host, load_backend, realtime
+from j2dx.compatibility_wrapper import CompatibilityWrapper
+from j2dx.latency import LatencyTracker, clock_reply
+from j2dx.liveness import Heartbeat
+from j2dx.metrics import CONTENT_TYPE, NO_CONTROLLER, Metrics
+from j2dx.pool import DevicePool
+from j2dx.protocol import FRAME, FrameDecoder, parse_batch, parse_text, split_frames
+from j2dx.rumble import RumbleChannel
+from j2dx.sessions import ParkedSessions, SessionTokens, TimerWheel
+from j2dx.state import decode as decode_state
+from j2dx.throttle import Throttle
+from j2dx.udp import InputDatagramProtocol, udp_tokens
+from j2dx.writer import DeviceWriter, WriteScheduler
+
+logger = logging.getLogger('J2DX.server')
+
+# Seconds between two logs of the sessions over their input budget
+THROTTLE_REPORT_INTERVAL = 5.0
+
+
+def print_qr(url):
+    """Print the server address as a QR code for the app to scan."""
+    import qrcode
+    qr = qrcode.QRCode()
+    qr.add_data(url)
+    if platform.system() == 'Windows':
+        import colorama
+        colorama.init()
+    # Colored blocks only render on a terminal, elsewhere (systemd,
+    # redirected output) the QR code is drawn with text characters
+    qr.print_ascii(tty=sys.stdout.isatty())
+
+
+def serve(args):
+    """Run the server until interrupted."""
+    try:
+        X360Device, DS4Device = load_backend(args.backend)
+    except RuntimeError as e:
+        sys.exit(str(e))
+    # Module level device settings, repeated in the writer process
+    initializers = []
+    if args.backend == 'recording':
+        from j2dx.null.recording import configure
+        initializers.append(partial(configure, dump_dir=args.dump_dir))
+    if args.axis_config:
+        from j2dx import curves
+        try:
+            initializers.append(partial(curves.configure, curves.load(args.axis_config)))
+        except (OSError, ValueError) as e:
+            sys.exit(f'Invalid axis configuration {args.axis_config}: {e}')
+        logger.info(f'Using axis configuration {args.axis_config}')
+    for initializer in initializers:
+        initializer()
+    logger.info(f'Using {args.backend} device backend')
+    EXECUTOR = None
+    REALTIME = {}
+    if args.realtime:
+        from concurrent.futures import ThreadPoolExecutor
+        REALTIME['event loop'] = realtime.use_uvloop()
+        REALTIME['http parser'] = realtime.http_implementation()
+        # Every device write goes through this one prioritized thread
+        EXECUTOR = ThreadPoolExecutor(1, thread_name_prefix='j2dx-writer')
+        REALTIME.update(EXECUTOR.submit(
+            realtime.prepare_writer_thread, args.writer_cores).result())
+    WRITER = None
+    if args.writer_process:
+        from j2dx.remote import WriterProcess
+        WRITER = WriterProcess({'xbox': X360Device, 'ds4': DS4Device}, initializers)
+        if EXECUTOR is not None:
+            # Started from the writer thread, the process inherits its
+            # affinity and scheduling class
+            EXECUTOR.submit(WRITER.start).result()
+        else:
+            WRITER.start()
+        remote = WRITER.device_classes()
+        X360Device, DS4Device = remote['xbox'], remote['ds4']
+    CLIENTS = {}
+    DEVICES = {}
+    SCHEDULER = WriteScheduler(EXECUTOR)
+    # Input budget per session, see j2dx.throttle
+    THROTTLES = {}
+    FRAMES = {}
+    LATENCY = {}
+    HEARTBEATS = {}
+    RUMBLE = {}
+    # Controller slots above 0 in use per Socket.IO connection
+    SLOTS = {}
+    # Devices are created and closed in the default executor: that takes
+    # far longer than a write, and on the writer thread it would hold up
+    # the input of every other controller
+    POOL = DevicePool(
+        {'xbox': X360Device, 'ds4': DS4Device},
+        {'xbox': args.pool_xbox, 'ds4': args.pool_ds4},
+    )
+    METRICS = Metrics(('xbox', 'ds4'))
+    UDP_TOKENS = udp_tokens()
+    HTTP_TOKENS = SessionTokens()
+    HTTP_IDLE = TimerWheel(args.http_timeout)
+    RESUME = ParkedSessions(args.resume_grace) if args.resume_grace > 0 else None
+    RECORDER = None
+    if args.record:
+        from j2dx.recorder import InputRecorder
+        RECORDER = InputRecorder(args.record)
+        logger.info(f'Recording input to {args.record}')
+    
+    # Create FastAPI app
+    app = FastAPI(title="Joy2DroidX Server")
+    
+    # Add CORS middleware with broader settings
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=["*"],  # Allow all origins
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )
+    
+    # Setup Socket.IO with more permissive CORS settings
+    sio = socketio.AsyncServer(
+        async_mode='asgi',
+        cors_allowed_origins="*",  # Allow all origins with string instead of list
+        logger=args.debug,
+        engineio_logger=args.debug,
+        ping_interval=args.ping_interval,
+        ping_timeout=args.ping_timeout,
+    )
+    
+    # Create Socket.IO application with FastAPI integration
+    socket_app = socketio.ASGIApp(sio, app)
+    
+    # Create compatibility wrapper
+    compat = CompatibilityWrapper(sio)
+    
+    def device_key(sid, slot):
+        """
+        Key in DEVICES of a connection's controller slot. Slot 0 is the
+        session id itself, so single controller clients see no difference.
+        """
+        return f'{sid}#{slot}' if slot else sid
+
+    def controller_kind(target):
+        """Controller type at a DEVICES key, for metric labels."""
+        writer = DEVICES.get(target)
+        return POOL.kind(writer.device) if writer is not None else NO_CONTROLLER
+
+    def slot_of(data):
+        """The slot a request addresses, 0 unless it says otherwise."""
+        slot = data.get('slot', 0) if isinstance(data, dict) else 0
+        if not isinstance(slot, int) or not 0 <= slot < args.slots:
+            raise ValueError(f'Slot must be an integer from 0 to {args.slots - 1}')
+        return slot
+
+    def throttle(sid):
+        """The input budget shared by all controllers of a session."""
+        if args.input_rate <= 0:
+            return None
+        if sid not in THROTTLES:
+            THROTTLES[sid] = Throttle(args.input_rate, args.input_burst, args.throttle)
+        return THROTTLES[sid]
+
+    async def create_device(sid, kind, addr, slot=0):
+        """Attach a pooled device of the given kind to a session's slot."""
+        key = device_key(sid, slot)
+        device = await POOL.acquire(kind, key, addr)
+        if key in DEVICES or sid not in CLIENTS:
+            # Another request won the race or the client left meanwhile
+            await POOL.release(device)
+            return
+        DEVICES[key] = DeviceWriter(
+            device, SCHEDULER, session=sid, tracker=LATENCY.get(sid), throttle=throttle(sid),
+            recorder=RECORDER.stream(device, kind) if RECORDER is not None else None,
+            counters=METRICS.events[kind])
+        if slot:
+            SLOTS.setdefault(sid, set()).add(slot)
+
+    def emit_rumble(sid, slot, message):
+        message['slot'] = slot
+        asyncio.get_running_loop().create_task(sio.emit('rumble', message, to=sid))
+
+    def watch_rumble(sid, slot=0):
+        """Forward force feedback of a slot's device as 'rumble' events."""
+        key = device_key(sid, slot)
+        if key in DEVICES and key not in RUMBLE:
+            channel = RumbleChannel(DEVICES[key].device, partial(emit_rumble, sid, slot))
+            if channel.start():
+                RUMBLE[key] = channel
+
+    async def release_slot(sid, slot):
+        """Remove the controller in one slot of a connection."""
+        key = device_key(sid, slot)
+        await destroy_device(key)
+        FRAMES.pop(key, None)
+        if slot:
+            SLOTS.get(sid, set()).discard(slot)
+
+    async def destroy_device(sid):
+        """Flush a session's device and hand it back to the pool."""
+        if sid in RUMBLE:
+            RUMBLE.pop(sid).stop()
+        if sid in DEVICES:
+            writer = DEVICES.pop(sid)
+            await writer.stop()
+            if RECORDER is not None:
+                RECORDER.close_stream(writer.device)
+            await POOL.release(writer.device)
+
+    async def end_session(sid):
+        """Release everything a session owns, whatever its transport."""
+        for slot in SLOTS.pop(sid, ()):
+            await release_slot(sid, slot)
+        await destroy_device(sid)
+        UDP_TOKENS.revoke(sid)
+        HTTP_TOKENS.revoke(sid)
+        HTTP_IDLE.remove(sid)
+        FRAMES.pop(sid, None)
+        LATENCY.pop(sid, None)
+        HEARTBEATS.pop(sid, None)
+        if sid in THROTTLES:
+            log_throttling(sid, THROTTLES.pop(sid))
+        compat.forget(sid)
+        CLIENTS.pop(sid, None)
+
+    async def neutralize(writer):
+        """Flush a parked session's device and return it to neutral."""
+        if writer.recorder is not None:
+            writer.recorder.reset()
+        await writer.stop()
+        try:
+            await asyncio.get_running_loop().run_in_executor(EXECUTOR, writer.device.reset)
+        except Exception as e:
+            logger.error(f'Error resetting parked device {writer.device.device}: {e}')
+
+    def park_session(sid):
+        """
+        Keep a disconnected client's device for the resume grace period,
+        in neutral state so nothing stays pressed in the meantime.
+        """
+        writer = DEVICES.pop(sid)
+        ready = asyncio.get_running_loop().create_task(neutralize(writer))
+        # The game may keep rumbling meanwhile and waits for its answers
+        rumble = RUMBLE.pop(sid, None)
+        if rumble is not None:
+            rumble.detach()
+        RESUME.park(sid, (writer.device, LATENCY.get(sid), rumble, ready, time.perf_counter_ns()))
+
+    async def release_parked(parked):
+        device, _, rumble, ready, _ = parked
+        if rumble is not None:
+            rumble.stop()
+        await ready
+        if RECORDER is not None:
+            RECORDER.close_stream(device)
+        await POOL.release(device)
+
+    def neutralize_session(sid):
+        """Release everything held on every controller of a connection."""
+        for key in [sid, *(device_key(sid, slot) for slot in SLOTS.get(sid, ()))]:
+            if key in DEVICES:
+                DEVICES[key].neutralize()
+            # The next full-state frame is applied whole, not diffed
+            # against the state from before the release
+            FRAMES.pop(key, None)
+
+    def heartbeat_answered(sid, seq, *_):
+        heartbeat = HEARTBEATS.get(sid)
+        if heartbeat is not None and heartbeat.pong(seq, time.perf_counter_ns()):
+            logger.info(f'Client {CLIENTS.get(sid, sid)} is responding again')
+
+    async def send_heartbeats():
+        """Application level heartbeat, see j2dx.liveness."""
+        timeout = int(args.heartbeat_timeout * 1e9)
+        while True:
+            await asyncio.sleep(args.heartbeat)
+            now = time.perf_counter_ns()
+            for sid, heartbeat in list(HEARTBEATS.items()):
+                if heartbeat.overdue(now, timeout):
+                    logger.warning(
+                        f'Client {CLIENTS.get(sid, sid)} stopped responding, '
+                        f'releasing its inputs')
+                    neutralize_session(sid)
+                seq = heartbeat.ping(now)
+                try:
+                    await sio.emit(
+                        'heartbeat', {'seq': seq, 't': time.time() * 1000}, to=sid,
+                        callback=partial(heartbeat_answered, sid, seq))
+                except Exception as e:
+                    logger.debug(f'Error sending heartbeat to {sid}: {e}')
+
+    def log_throttling(sid, throttle):
+        limited = throttle.report()
+        if limited:
+            action = 'coalesced' if throttle.coalesce else 'dropped'
+            logger.warning(
+                f'Client {CLIENTS.get(sid, sid)} went over its input budget: '
+                f'{limited} analog events {action} (totals: {throttle.stats()})')
+
+    async def report_throttling():
+        """Log the sessions that went over their input budget lately."""
+        while True:
+            await asyncio.sleep(THROTTLE_REPORT_INTERVAL)
+            for sid, throttle in list(THROTTLES.items()):
+                log_throttling(sid, throttle)
+
+    async def expire_parked_sessions():
+        while True:
+            await asyncio.sleep(RESUME.timers.tick)
+            for sid, parked in RESUME.expire():
+                logger.info(f'Session {sid} was not resumed, removing its device')
+                await release_parked(parked)
+
+    # Define event handlers directly with the Socket.IO server
+    @sio.event
+    async def connect(sid, environ):
+        try:
+            client_addr = environ.get('REMOTE_ADDR', 'unknown')
+            headers = environ.get('asgi.scope', {}).get('headers', [])
+            
+            # Try to get forwarded IP if behind proxy
+            for name, value in headers:
+                if name == b'x-forwarded-for':
+                    client_addr = value.decode('utf-8').split(',')[0].strip()
+                    break
+                    
+            CLIENTS[sid] = client_addr
+        except Exception as e:
+            logger.error(f"Error handling connection: {e}")
+            METRICS.failed('connect')
+            CLIENTS[sid] = 'unknown'
+        LATENCY[sid] = LatencyTracker()
+        if args.heartbeat > 0:
+            HEARTBEATS[sid] = Heartbeat()
+        compat.negotiate(sid, environ)
+
+        logger.info(f'Client connected from {CLIENTS[sid]}')
+        logger.debug(f'Client {CLIENTS[sid]} sessionId: {sid}')
+
+    @sio.event
+    async def disconnect(sid):
+        if RESUME is not None and sid in DEVICES and RESUME.issued(sid):
+            park_session(sid)
+            logger.info(f'Client disconnected: {sid}, keeping its device for '
+                        f'{RESUME.grace:g}s')
+        else:
+            if RESUME is not None:
+                RESUME.revoke(sid)
+            logger.info(f'Client disconnected: {sid}')
+        await end_session(sid)
+
+    def resumable(sid, kind):
+        """
+        Acknowledgement of a slot 0 controller request, carrying the
+        resume token when resuming is enabled.
+        """
+        ack = {"status": "ok", "controller": kind}
+        if RESUME is not None and sid in DEVICES:
+            ack["resume"] = RESUME.issue(sid)
+        return ack
+
+    async def request_controller(sid, kind, data):
+        """
+        Create a controller in the requested slot of a connection, slot 0
+        by default. Only slot 0 survives a reconnect, see 'resume'.
+        """
+        try:
+            slot = slot_of(data)
+        except ValueError as e:
+            return {"status": "error", "message": str(e)}
+        key = device_key(sid, slot)
+        if key not in DEVICES:
+            await create_device(sid, kind, CLIENTS.get(sid, 'unknown'), slot)
+        watch_rumble(sid, slot)
+        name = 'Xbox 360' if kind == 'xbox' else 'DualShock 4'
+        where = f' in slot {slot}' if slot else ''
+        logger.info(f'{name} controller created for {CLIENTS.get(sid, "unknown")}{where}')
+        if slot:
+            return {"status": "ok", "controller": kind, "slot": slot}
+        return resumable(sid, kind)
+
+    # Remove the controller in one slot, {"slot": n}
+    @sio.event
+    async def release(sid, data=None):
+        try:
+            slot = slot_of(data)
+        except ValueError as e:
+            return {"status": "error", "message": str(e)}
+        if slot == 0 and RESUME is not None:
+            RESUME.revoke(sid)
+        await release_slot(sid, slot)
+        return {"status": "ok", "slot": slot}
+
+    # Take over the device of a session that disconnected less than
+    # --resume-grace seconds ago, instead of requesting a new controller
+    @sio.event
+    async def resume(sid, data):
+        if RESUME is None:
+            return {"status": "error", "message": "Resuming sessions is disabled"}
+        if sid in DEVICES:
+            return {"status": "error", "message": "Session already has a controller"}
+        token = data.get("token") if isinstance(data, dict) else data
+        resumed = RESUME.resume(token, sid)
+        if resumed is None:
+            return {"status": "error", "message": "Unknown or expired resume token"}
+        parked, token = resumed
+        device, tracker, rumble, ready, disconnected = parked
+        await ready
+        if sid in CLIENTS and sid not in DEVICES:
+            await asyncio.get_running_loop().run_in_executor(
+                POOL.executor, device.assign, sid, CLIENTS[sid])
+        if sid not in CLIENTS or sid in DEVICES:
+            # The client left again, or a concurrent request gave it a
+            # controller, while the device was being handed over
+            await release_parked(parked)
+            if sid not in CLIENTS:
+                RESUME.revoke(sid)
+                return None
+            return {"status": "error", "message": "Session already has a controller"}
+        if tracker is not None:
+            tracker.resumed(disconnected, RESUME.reconnect)
+            LATENCY[sid] = tracker
+        kind = POOL.kind(device)
+        DEVICES[sid] = DeviceWriter(
+            device, SCHEDULER, session=sid, tracker=LATENCY.get(sid), throttle=throttle(sid),
+            recorder=RECORDER.stream(device, kind) if RECORDER is not None else None,
+            counters=METRICS.events.get(kind))
+        if rumble is not None:
+            rumble.send = partial(emit_rumble, sid, 0)
+            RUMBLE[sid] = rumble
+        else:
+            watch_rumble(sid)
+        logger.info(f'Client {CLIENTS[sid]} resumed its {device.type}')
+        return {"status": "ok", "resume": token}
+
+    # Handler for Xbox controller request
+    @sio.event
+    async def xbox(sid, *args):
+        return await request_controller(sid, 'xbox', args[0] if args else None)
+
+    # Handler for PS4/DS4 controller request
+    @sio.event
+    async def ds4(sid, *args):
+        return await request_controller(sid, 'ds4', args[0] if args else None)
+
+    # Handler for input events
+    @sio.event
+    async def input(sid, *data):
+        received = time.perf_counter_ns()
+        # The session's codec was picked once at connect, no format sniffing here
+        try:
+            key, value, slot = compat.decoder(sid)(data)
+        except (LookupError, TypeError, ValueError):
+            logger.warning(f"Received invalid input format: {data}")
+            METRICS.reject('invalid', controller_kind(sid))
+            return
+        target = device_key(sid, slot)
+        if target not in DEVICES:
+            METRICS.reject('no_controller', key=key)
+        else:
+            try:
+                # Enhanced debug logging
+                if logger.isEnabledFor(logging.DEBUG):
+                    input_type = "Button" if isinstance(value, bool) else "Analog"
+                    logger.debug(f"[INCOMING] {input_type} Input from {CLIENTS.get(sid, 'unknown')}: {key}={value}")
+
+                DEVICES[target].send(key, value)
+                LATENCY[sid].received(data[0], received)
+            except Exception as e:
+                logger.error(f"Error processing input: {e}")
+                METRICS.failed('input')
+
+    # Handler for batched input events, applied as a single device report
+    @sio.event
+    async def input_batch(sid, data):
+        received = time.perf_counter_ns()
+        target = device_key(sid, data.get('slot', 0)) if isinstance(data, dict) else sid
+        if target not in DEVICES:
+            try:
+                for key, _ in parse_batch(data):
+                    METRICS.reject('no_controller', key=key)
+            except ValueError:
+                METRICS.reject('invalid')
+        else:
+            try:
+                events = parse_batch(data)
+                logger.debug(f"[INCOMING] Batch of {len(events)} inputs from {CLIENTS.get(sid, 'unknown')}")
+                DEVICES[target].send_many(events)
+                LATENCY[sid].received(data, received)
+            except Exception as e:
+                logger.error(f"Error processing input batch: {e}")
+                METRICS.failed('input_batch')
+
+    # Handler for binary full-state frames, see j2dx.protocol
+    @sio.event
+    async def frame(sid, data):
+        received = time.perf_counter_ns()
+        if sid not in DEVICES:
+            METRICS.reject('no_controller')
+        else:
+            try:
+                events = FRAMES.setdefault(sid, FrameDecoder()).decode(data)
+                if events:
+                    DEVICES[sid].send_many(events)
+                LATENCY[sid].received(None, received)
+            except Exception as e:
+                logger.error(f"Error processing input frame: {e}")
+                METRICS.failed('frame')
+
+    # Frames for several slots of a connection in one message, see j2dx.protocol
+    @sio.event
+    async def frames(sid, data):
+        received = time.perf_counter_ns()
+        try:
+            for slot, frame in split_frames(data):
+                key = device_key(sid, slot)
+                if key in DEVICES:
+                    events = FRAMES.setdefault(key, FrameDecoder()).decode(frame)
+                    if events:
+                        DEVICES[key].send_many(events)
+                else:
+                    METRICS.reject('no_controller')
+            if sid in LATENCY:
+                LATENCY[sid].received(None, received)
+        except Exception as e:
+            logger.error(f"Error processing input frames: {e}")
+            METRICS.failed('frames')
+
+    def udp_frame(sid, data):
+        received = time.perf_counter_ns()
+        if sid in DEVICES:
+            events = FRAMES.setdefault(sid, FrameDecoder()).decode(data)
+            if events:
+                DEVICES[sid].send_many(events)
+            LATENCY[sid].received(None, received)
+        else:
+            METRICS.reject('no_controller')
+
+    # Issue the token a client prefixes its UDP datagrams with, see j2dx.udp
+    @sio.event
+    async def udp(sid, *_):
+        if not args.udp_port:
+            return {"status": "error", "message": "UDP input is disabled"}
+        return {
+            "status": "ok",
+            "token": UDP_TOKENS.issue(sid).hex(),
+            "port": args.udp_port,
+        }
+
+    # NTP-style clock offset exchange used for one-way latency, see j2dx.latency
+    @sio.event
+    async def clock(sid, data):
+        reply = clock_reply(data)
+        if isinstance(data, dict) and 'offset' in data and sid in LATENCY:
+            LATENCY[sid].sync(data['offset'], data.get('rtt'))
+        return reply
+
+    # Runs before uvicorn returns, whichever signal stopped it
+    @app.on_event("shutdown")
+    async def shutdown():
+        if RESUME is not None:
+            for sid, parked in RESUME.clear():
+                try:
+                    await release_parked(parked)
+                except Exception as e:
+                    logger.error(f'Error closing parked device of {sid}: {e}')
+        # Flush and hand back the devices of connected clients, so the
+        # pool closes them with its idle ones
+        for sid in list(CLIENTS):
+            try:
+                await end_session(sid)
+            except Exception as e:
+                logger.error(f'Error closing device of {sid}: {e}')
+        for key in list(DEVICES):
+            try:
+                await destroy_device(key)
+            except Exception as e:
+                logger.error(f'Error closing device of {key}: {e}')
+        await POOL.close()
+        if WRITER is not None:
+            WRITER.stop()
+        if RECORDER is not None:
+            RECORDER.close()
+
+    # HTTP routes for fallback mechanism
+    @app.get("/status")
+    async def status():
+        return {"status": "ok", "clients": len(CLIENTS), "cpu_time": time.process_time()}
+
+    @app.get("/stats")
+    async def stats():
+        writers = list(DEVICES.items())
+        # Devices in the writer process answer over a blocking pipe
+        device_stats = await asyncio.get_running_loop().run_in_executor(
+            None, lambda: [writer.stats() for _, writer in writers])
+        return {
+            sid: {
+                **counts,
+                **(RUMBLE[sid].stats() if sid in RUMBLE else {}),
+                **(device.throttle.stats() if device.throttle is not None else {}),
+                "stale_frames": FRAMES[sid].stale if sid in FRAMES else 0,
+            }
+            for (sid, device), counts in zip(writers, device_stats)
+        }
+
+    # Prometheus text format, see j2dx.metrics
+    @app.get("/metrics")
+    async def metrics():
+        sessions = {'socketio': 0, 'http': 0, 'websocket': 0}
+        for sid in CLIENTS:
+            if sid.startswith('http-'):
+                sessions['http'] += 1
+            elif sid.startswith('ws-'):
+                sessions['websocket'] += 1
+            else:
+                sessions['socketio'] += 1
+        sessions['udp'] = len(UDP_TOKENS)
+        sessions['parked'] = RESUME.stats()['parked'] if RESUME is not None else 0
+        controllers = dict.fromkeys(METRICS.events, 0)
+        for writer in DEVICES.values():
+            kind = POOL.kind(writer.device)
+            if kind is not None:
+                controllers[kind] += 1
+        return Response(
+            content=METRICS.render(sessions, controllers, POOL), media_type=CONTENT_TYPE)
+
+    # Current controller state, see j2dx.state. ?raw=true returns the
+    # packed buffer instead of JSON.
+    @app.get("/state")
+    async def states():
+        return {
+            sid: decode_state(writer.device.state.snapshot())
+            for sid, writer in DEVICES.items()
+        }
+
+    @app.get("/state/{sid}")
+    async def session_state(sid: str, raw: bool = False):
+        if sid not in DEVICES:
+            return {"status": "error", "message": "Unknown session"}
+        snapshot = DEVICES[sid].device.state.snapshot()
+        if raw:
+            return Response(content=bytes(snapshot), media_type="application/octet-stream")
+        return decode_state(snapshot)
+
+    @app.get("/pool")
+    async def pool():
+        return POOL.stats()
+
+    @app.get("/liveness")
+    async def liveness():
+        return {sid: heartbeat.summary() for sid, heartbeat in HEARTBEATS.items()}
+
+    @app.get("/liveness/{sid}")
+    async def session_liveness(sid: str):
+        if sid not in HEARTBEATS:
+            return {"status": "error", "message": "Unknown session"}
+        return HEARTBEATS[sid].summary()
+
+    @app.get("/resume")
+    async def resume_stats():
+        if RESUME is None:
+            return {"status": "error", "message": "Resuming sessions is disabled"}
+        return RESUME.stats()
+
+    @app.get("/latency")
+    async def latency():
+        return {sid: tracker.summary() for sid, tracker in LATENCY.items()}
+
+    @app.get("/latency/{sid}")
+    async def session_latency(sid: str):
+        if sid not in LATENCY:
+            return {"status": "error", "message": "Unknown session"}
+        return LATENCY[sid].summary()
+    
+    def http_session(token):
+        """
+        The session id for an HTTP token. Requests without a token are
+        accepted while there is a single HTTP session, like older clients
+        expect.
+        """
+        sid = HTTP_TOKENS.lookup(token) if token else HTTP_TOKENS.only()
+        if sid is not None:
+            HTTP_IDLE.touch(sid)
+        return sid
+
+    async def evict_idle_http_sessions():
+        while True:
+            await asyncio.sleep(HTTP_IDLE.tick)
+            for sid in HTTP_IDLE.expire():
+                logger.info(f'HTTP session {sid} idle, removing it')
+                await end_session(sid)
+
+    @app.post("/message")
+    async def message(data: dict, request: Request):
+        received = time.perf_counter_ns()
+        try:
+            event = data.get("event")
+            payload = data.get("data", {})
+            
+            if event in ("xbox", "ds4"):
+                sid = f"http-{secrets.token_hex(8)}"
+                CLIENTS[sid] = request.client.host if request.client else "http-client"
+                LATENCY[sid] = LatencyTracker()
+                token = HTTP_TOKENS.issue(sid)
+                HTTP_IDLE.touch(sid)
+                await create_device(sid, event, CLIENTS[sid])
+                return {"status": "ok", "controller": event, "token": token}
+
+            elif event == "ping":
+                return {"status": "ok", "pong": True}
+
+            sid = http_session(data.get("token"))
+            if sid is None or sid not in DEVICES:
+                return {"status": "error", "message": "Unknown HTTP session"}
+
+            if event == "input" and isinstance(payload, dict):
+                DEVICES[sid].send(payload.get("key"), payload.get("value"))
+                LATENCY[sid].received(payload, received)
+                return {"status": "ok"}
+
+            elif event == "input_batch":
+                DEVICES[sid].send_many(parse_batch(payload))
+                LATENCY[sid].received(payload, received)
+                return {"status": "ok"}
+
+            elif event == "close":
+                await end_session(sid)
+                return {"status": "ok"}
+                
+            return {"status": "error", "message": "Unknown event"}
+        except Exception as e:
+            logger.error(f"Error handling HTTP message: {e}")
+            METRICS.failed('message')
+            return {"status": "error", "message": str(e)}
+
+    # Batched input for HTTP sessions: {"token": ..., "events": [...]}
+    @app.post("/input")
+    async def http_input(data: dict):
+        received = time.perf_counter_ns()
+        try:
+            sid = http_session(data.get("token"))
+            if sid is None or sid not in DEVICES:
+                return {"status": "error", "message": "Unknown HTTP session"}
+            events = parse_batch(data)
+            DEVICES[sid].send_many(events)
+            LATENCY[sid].received(data, received)
+            return {"status": "ok", "events": len(events)}
+        except Exception as e:
+            logger.error(f"Error handling HTTP input: {e}")
+            METRICS.failed('http_input')
+            return {"status": "error", "message": str(e)}
+
+    @app.post("/frame")
+    async def http_frame(request: Request, token: str = None):
+        received = time.perf_counter_ns()
+        try:
+            data = await request.body()
+            if len(data) != FRAME.size:
+                return {"status": "error", "message": f"Frame must be {FRAME.size} bytes"}
+            sid = http_session(token)
+            if sid is None or sid not in DEVICES:
+                return {"status": "error", "message": "Unknown HTTP session"}
+            events = FRAMES.setdefault(sid, FrameDecoder()).decode(data)
+            if events:
+                DEVICES[sid].send_many(events)
+            LATENCY[sid].received(None, received)
+            return {"status": "ok"}
+        except Exception as e:
+            logger.error(f"Error handling HTTP frame: {e}")
+            METRICS.failed('http_frame')
+            return {"status": "error", "message": str(e)}
+
+    # Raw WebSocket transport without Engine.IO/Socket.IO framing.
+    # Text frames select the controller ("xbox"/"ds4") or carry text input,
+    # binary frames carry full-state frames, see j2dx.protocol.
+    @app.websocket("/ws")
+    async def websocket_input(websocket: WebSocket):
+        await websocket.accept()
+        sid = f"ws-{secrets.token_hex(8)}"
+        forwarded = websocket.headers.get('x-forwarded-for')
+        if forwarded:
+            CLIENTS[sid] = forwarded.split(',')[0].strip()
+        else:
+            CLIENTS[sid] = websocket.client.host if websocket.client else 'unknown'
+        LATENCY[sid] = LatencyTracker()
+        FRAMES[sid] = FrameDecoder()
+        logger.info(f'WebSocket client connected from {CLIENTS[sid]}')
+        try:
+            while True:
+                message = await websocket.receive()
+                if message['type'] == 'websocket.disconnect':
+                    break
+                received = time.perf_counter_ns()
+                try:
+                    if message.get('bytes') is not None:
+                        data = message['bytes']
+                        if len(data) != FRAME.size:
+                            raise ValueError(f'Frame must be {FRAME.size} bytes, got {len(data)}')
+                        events = FRAMES.setdefault(sid, FrameDecoder()).decode(data)
+                    else:
+                        text = message.get('text') or ''
+                        if text in ('xbox', 'ds4'):
+                            if sid not in DEVICES:
+                                await create_device(sid, text, CLIENTS[sid])
+                            continue
+                        if text == 'ping':
+                            await websocket.send_text('pong')
+                            continue
+                        events = parse_text(text)
+                    if sid in DEVICES and events:
+                        DEVICES[sid].send_many(events)
+                        LATENCY[sid].received(None, received)
+                except (ValueError, TypeError) as e:
+                    logger.warning(f"Invalid WebSocket message from {CLIENTS[sid]}: {e}")
+                    METRICS.reject('invalid', controller_kind(sid))
+        except WebSocketDisconnect:
+            pass
+        except Exception as e:
+            logger.error(f"Error handling WebSocket client: {e}")
+            METRICS.failed('websocket')
+        finally:
+            await end_session(sid)
+            logger.info(f'WebSocket client disconnected: {sid}')
+
+    try:
+        host = args.host or default_host()
+        logger.info(f'Listening on http://{host}:{args.port}/')
+
+        # Run the Uvicorn server with the FastAPI app
+        config = uvicorn.Config(
+            app=socket_app, 
+            host=host, 
+            port=args.port,
+            log_level="debug" if args.debug else "info",
+            http=REALTIME.get('http parser', 'auto'),
+        )
+        server = uvicorn.Server(config)
+
+        async def announce():
+            # Show the QR code once the app can actually connect
+            while not server.started:
+                await asyncio.sleep(0.05)
+            print_qr(f'j2dx://{host}:{args.port}/')
+
+        if args.realtime:
+            REALTIME.update(realtime.prepare_loop_thread(args.loop_cores))
+            for setting, outcome in REALTIME.items():
+                logger.info(f'Realtime {setting}: {outcome}')
+        loop = asyncio.get_event_loop()
+        if args.udp_port:
+            loop.run_until_complete(loop.create_datagram_endpoint(
+                lambda: InputDatagramProtocol(UDP_TOKENS, udp_frame),
+                local_addr=(host, args.udp_port),
+            ))
+            logger.info(f'Listening for UDP input on {host}:{args.udp_port}')
+        loop.create_task(announce())
+        loop.create_task(POOL.fill())
+        loop.create_task(evict_idle_http_sessions())
+        if RESUME is not None:
+            loop.create_task(expire_parked_sessions())
+        if args.heartbeat > 0:
+            loop.create_task(send_heartbeats())
+        loop.create_task(METRICS.sample_loop_lag())
+        if args.input_rate > 0:
+            loop.create_task(report_throttling())
+        loop.run_until_complete(server.serve())
+        
+    except KeyboardInterrupt:
+        pass
+    except PermissionError:
+        sys.exit(
+            f'Port {args.port} is not available. '
+            f'Please specify a different port with -p option.'
+        )
+    except Exception as e:
+        logger.error(f"Error starting server: {e}")
+        sys.exit(1)
@@ -0,0 +1,187 @@
+"""
+Session bookkeeping: tokens identifying a session for the transports that
+have no connection of their own, idle timeouts, and sessions kept for a
+client that may reconnect.
+"""
+import math
+import secrets
+import time
+
+from j2dx.latency import Histogram
+
+
+class SessionTokens:
+    """Two-way mapping between session tokens and session ids."""
+
+    def __init__(self, generate=secrets.token_urlsafe):
+        self.generate = generate
+        self._sids = {}
+        self._tokens = {}
+
+    def __len__(self):
+        return len(self._tokens)
+
+    def __contains__(self, sid):
+        return sid in self._tokens
+
+    def issue(self, sid):
+        if sid not in self._tokens:
+            token = self.generate()
+            self._tokens[sid] = token
+            self._sids[token] = sid
+        return self._tokens[sid]
+
+    def lookup(self, token):
+        return self._sids.get(token)
+
+    def only(self):
+        """The session id if exactly one session exists, otherwise None."""
+        if len(self._sids) == 1:
+            return next(iter(self._sids.values()))
+        return None
+
+    def revoke(self, sid):
+        token = self._tokens.pop(sid, None)
+        if token is not None:
+            del self._sids[token]
+
+
+class TimerWheel:
+    """
+    Hashed timing wheel for idle timeouts.
+
+    Touching a key only records its new deadline, so it costs the same
+    whether it happens once a minute or on every input. A key stays in the
+    slot it was first placed in; when that slot comes round its deadline is
+    checked and the key either expires or moves to the slot of its current
+    deadline.
+    """
+
+    def __init__(self, timeout, tick=1.0, clock=time.monotonic):
+        self.timeout = timeout
+        self.tick = tick
+        self.clock = clock
+        self._slots = [set() for _ in range(math.ceil(timeout / tick) + 1)]
+        self._deadlines = {}
+        self._position = 0
+        self._time = clock()
+
+    def __len__(self):
+        return len(self._deadlines)
+
+    def _place(self, key, deadline):
+        ticks = math.ceil((deadline - self._time) / self.tick)
+        ticks = max(1, min(ticks, len(self._slots) - 1))
+        self._slots[(self._position + ticks) % len(self._slots)].add(key)
+
+    def touch(self, key):
+        """Start or restart the timeout of key."""
+        deadline = self.clock() + self.timeout
+        if key not in self._deadlines:
+            self._place(key, deadline)
+        self._deadlines[key] = deadline
+
+    def remove(self, key):
+        # The key is dropped from its slot lazily, when the slot comes round
+        self._deadlines.pop(key, None)
+
+    def expire(self):
+        """Advances the wheel and returns the keys whose timeout ran out."""
+        now = self.clock()
+        expired = []
+        while self._time + self.tick <= now:
+            self._time += self.tick
+            self._position = (self._position + 1) % len(self._slots)
+            slot = self._slots[self._position]
+            self._slots[self._position] = set()
+            for key in slot:
+                deadline = self._deadlines.get(key)
+                if deadline is None:
+                    continue
+                if deadline <= now:
+                    del self._deadlines[key]
+                    expired.append(key)
+                else:
+                    self._place(key, deadline)
+        return expired
+
+
+class ParkedSessions:
+    """
+    Sessions whose client disconnected, kept for a grace period so the
+    client can take them over again after reconnecting.
+
+    A client gets a resume token once its session has something worth
+    keeping. When it disconnects the session is parked under its old id
+    until it is resumed with the token or the grace period runs out.
+    Resuming hands out a new token, so each token works once.
+    """
+
+    def __init__(self, grace, tick=1.0):
+        self.grace = grace
+        self.tokens = SessionTokens()
+        self.timers = TimerWheel(grace, min(tick, grace))
+        self._parked = {}
+        self.resumed = 0
+        self.expired = 0
+        # Client disconnect -> first input after resuming, in microseconds
+        self.reconnect = Histogram()
+
+    def __len__(self):
+        return len(self._parked)
+
+    def issue(self, sid):
+        return self.tokens.issue(sid)
+
+    def issued(self, sid):
+        return sid in self.tokens
+
+    def revoke(self, sid):
+        self.tokens.revoke(sid)
+
+    def park(self, sid, state):
+        """Keep state for sid until it is resumed or expires."""
+        self._parked[sid] = state
+        self.timers.touch(sid)
+
+    def resume(self, token, sid):
+        """
+        Moves the session parked under token to sid. Returns its state and
+        the new token for sid, or None if token is unknown or expired.
+        """
+        parked = self.tokens.lookup(token)
+        if parked is None or parked not in self._parked:
+            return None
+        state = self._parked.pop(parked)
+        self.timers.remove(parked)
+        self.tokens.revoke(parked)
+        self.resumed += 1
+        return state, self.tokens.issue(sid)
+
+    def expire(self):
+        """Returns (sid, state) of every session whose grace period ran out."""
+        expired = []
+        for sid in self.timers.expire():
+            self.tokens.revoke(sid)
+            if sid in self._parked:
+                self.expired += 1
+                expired.append((sid, self._parked.pop(sid)))
+        return expired
+
+    def clear(self):
+        """Returns (sid, state) of every parked session and forgets them."""
+        parked = list(self._parked.items())
+        for sid, _ in parked:
+            self.timers.remove(sid)
+            self.tokens.revoke(sid)
+        self._parked.clear()
+        return parked
+
+    def stats(self):
+        return {
+            'grace': self.grace,
+            'parked': len(self._parked),
+            'resumed': self.resumed,
+            'expired': self.expired,
+            'reconnect_to_input': self.reconnect.summary(),
+        }
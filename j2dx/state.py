@@ -0,0 +1,138 @@
+"""
+Backend independent controller state.
+
+Every device keeps the state it was last sent in a fixed 20 byte buffer,
+in native byte order (little-endian on every supported platform):
+
+    uint32  button bitmask, bit i set means protocol.BUTTONS[i] is pressed
+    int16   left-stick-X, left-stick-Y, right-stick-X, right-stick-Y
+    int16   left-trigger, right-trigger
+    uint8   dpad, bit 0 up, 1 down, 2 left, 3 right
+    3 bytes padding
+
+Sticks are scaled to -32767..32767 and triggers to 0..32767, like input
+frames. Updates write the buffer in place through typed memoryviews, and
+readers get a read-only view of it, so neither side creates per-field
+objects or copies. Backends fold updater(key) into their dispatch tables
+so the send path skips the key lookup of set().
+"""
+import struct
+
+from j2dx.protocol import AXIS_MAX, BUTTON_BITS, STICKS, TRIGGER_MAX, TRIGGERS
+
+STATE = struct.Struct('=I6hB3x')
+
+DPAD_BITS = {
+    'dpad-up': 1, 'up-button': 1,
+    'dpad-down': 2, 'down-button': 2,
+    'dpad-left': 4, 'left-button': 4,
+    'dpad-right': 8, 'right-button': 8,
+}
+DPAD_DIRECTIONS = ('up', 'down', 'left', 'right')
+
+# Field kinds
+BUTTON, STICK, TRIGGER = range(3)
+
+# key -> (kind, index into the bitmask or the axes, dpad bit)
+FIELDS = {key: (BUTTON, bit, DPAD_BITS.get(key, 0)) for key, bit in BUTTON_BITS.items()}
+FIELDS.update({key: (STICK, index, 0) for index, key in enumerate(STICKS)})
+FIELDS.update({key: (TRIGGER, index, 0) for index, key in enumerate(TRIGGERS, len(STICKS))})
+
+_DPAD_AT = 16
+
+
+def _stick(value):
+    if isinstance(value, float):
+        return round(max(-1.0, min(1.0, value)) * AXIS_MAX)
+    # Raw 0..255 axis value
+    return round(max(-1.0, min(1.0, value / 127.5 - 1.0)) * AXIS_MAX)
+
+
+def _trigger(value):
+    if isinstance(value, bool):
+        return AXIS_MAX if value else 0
+    if isinstance(value, float):
+        return round(max(0.0, min(1.0, value)) * AXIS_MAX)
+    # Raw 0..255 trigger value
+    return max(0, min(value, TRIGGER_MAX)) * AXIS_MAX // TRIGGER_MAX
+
+
+class ControllerState:
+    """The state buffer of one controller, see the module docstring."""
+    __slots__ = ('_buffer', '_buttons', '_axes')
+
+    def __init__(self):
+        self._buffer = bytearray(STATE.size)
+        view = memoryview(self._buffer)
+        self._buttons = view[:4].cast('I')
+        self._axes = view[4:_DPAD_AT].cast('h')
+
+    def updater(self, key):
+        """
+        Returns a function applying a value of key to this state, or None
+        if the layout has no field for key.
+        """
+        field = FIELDS.get(key)
+        if field is None:
+            return None
+        kind, index, dpad = field
+        buffer = self._buffer
+        buttons = self._buttons
+        axes = self._axes
+
+        if kind == STICK:
+            def update(value):
+                if type(value) is float and -1.0 <= value <= 1.0:
+                    axes[index] = round(value * AXIS_MAX)
+                else:
+                    axes[index] = _stick(value)
+        elif kind == TRIGGER:
+            def update(value):
+                axes[index] = _trigger(value)
+        elif dpad:
+            def update(value):
+                if value:
+                    buttons[0] |= index
+                    buffer[_DPAD_AT] |= dpad
+                else:
+                    buttons[0] &= ~index
+                    buffer[_DPAD_AT] &= ~dpad
+        else:
+            def update(value):
+                if value:
+                    buttons[0] |= index
+                else:
+                    buttons[0] &= ~index
+        return update
+
+    def set(self, key, value):
+        """Apply one (key, value) input; unknown keys are ignored."""
+        update = self.updater(key)
+        if update is not None:
+            update(value)
+
+    def clear(self):
+        """Back to rest."""
+        self._buffer[:] = bytes(STATE.size)
+
+    def snapshot(self):
+        """
+        Read-only view of the live buffer. Take bytes() of it for a copy
+        that no later update changes.
+        """
+        return memoryview(self._buffer).toreadonly()
+
+    def decode(self):
+        return decode(self._buffer)
+
+
+def decode(buffer):
+    """Readable form of a state buffer or snapshot, for endpoints and tools."""
+    buttons, *axes, dpad = STATE.unpack(buffer)
+    return {
+        'buttons': [key for key, bit in BUTTON_BITS.items() if buttons & bit],
+        'sticks': {key: axes[index] / AXIS_MAX for index, key in enumerate(STICKS)},
+        'triggers': {
+            key: axes[index] / AXIS_MAX for index, key in enumerate(TRIGGERS, len(STICKS))},
+        'dpad': [name for bit, name in enumerate(DPAD_DIRECTIONS) if dpad & (1 << bit)],
+    }
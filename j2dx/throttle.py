@@ -0,0 +1,73 @@
+"""
+Per-session input budget.
+
+Every session gets a token bucket refilled at --input-rate events per
+second and holding up to --input-burst tokens, shared by all of its
+controllers. Each input event takes a token. Once the bucket is empty,
+analog events are either held back and coalesced to the newest value per
+axis until tokens are available again ('coalesce', so the stick still
+ends where the client left it) or dropped ('drop'). Buttons always go
+through, so no edge is ever lost, but they use up the budget as well.
+"""
+import time
+
+POLICIES = ('coalesce', 'drop')
+
+
+class TokenBucket:
+
+    def __init__(self, rate, burst, clock=time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self.clock = clock
+        self._tokens = float(burst)
+        self._time = clock()
+
+    def take(self):
+        """Take a token if there is one."""
+        now = self.clock()
+        tokens = min(self.burst, self._tokens + (now - self._time) * self.rate)
+        self._time = now
+        if tokens < 1:
+            self._tokens = tokens
+            return False
+        self._tokens = tokens - 1
+        return True
+
+    def delay(self):
+        """Seconds until the next token."""
+        missing = 1 - self._tokens - (self.clock() - self._time) * self.rate
+        return max(missing / self.rate, 0.0)
+
+
+class Throttle:
+    """The input budget of one session and what it cost the session."""
+
+    def __init__(self, rate, burst, policy='coalesce'):
+        self.bucket = TokenBucket(rate, burst)
+        self.coalesce = policy == 'coalesce'
+        # Analog events over budget, and of those the ones dropped and
+        # the ones replaced by a newer value while held back
+        self.limited = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self._reported = 0
+
+    def take(self):
+        return self.bucket.take()
+
+    def delay(self):
+        return self.bucket.delay()
+
+    def report(self):
+        """Events over budget since the last call."""
+        limited = self.limited - self._reported
+        self._reported = self.limited
+        return limited
+
+    def stats(self):
+        return {
+            'throttled': self.limited,
+            'throttle_dropped': self.dropped,
+            'throttle_coalesced': self.coalesced,
+        }
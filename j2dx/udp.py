@@ -0,0 +1,65 @@
+"""
+UDP input transport.
+
+Each datagram is a session token followed by one full-state frame
+(see j2dx.protocol). Tokens are handed out over Socket.IO, which stays the
+control channel; the frame sequence number lets the receiver drop old and
+reordered datagrams instead of applying them, so a lost packet never holds
+back the ones behind it.
+"""
+import asyncio
+import logging
+import secrets
+from functools import partial
+
+from j2dx.protocol import FRAME
+from j2dx.sessions import SessionTokens
+
+logger = logging.getLogger('J2DX.udp')
+
+TOKEN_SIZE = 16
+DATAGRAM_SIZE = TOKEN_SIZE + FRAME.size
+
+
+def udp_tokens():
+    """Session tokens as raw bytes, the way they appear in datagrams."""
+    return SessionTokens(partial(secrets.token_bytes, TOKEN_SIZE))
+
+
+class InputDatagramProtocol(asyncio.DatagramProtocol):
+    """
+    Hands the frame of every datagram with a known token to
+    handler(sid, frame). Datagrams of the wrong size or with unknown
+    tokens are counted and dropped.
+    """
+
+    def __init__(self, tokens, handler):
+        self.tokens = tokens
+        self.handler = handler
+        self.received = 0
+        self.malformed = 0
+        self.unknown = 0
+
+    def datagram_received(self, data, addr):
+        self.received += 1
+        if len(data) != DATAGRAM_SIZE:
+            self.malformed += 1
+            return
+        sid = self.tokens.lookup(data[:TOKEN_SIZE])
+        if sid is None:
+            self.unknown += 1
+            return
+        try:
+            self.handler(sid, memoryview(data)[TOKEN_SIZE:])
+        except Exception as e:
+            logger.error(f'Error handling datagram from {addr[0]}: {e}')
+
+    def error_received(self, exc):
+        logger.warning(f'UDP socket error: {exc}')
+
+    def stats(self):
+        return {
+            'received': self.received,
+            'malformed': self.malformed,
+            'unknown': self.unknown,
+        }
@@ -0,0 +1,247 @@
+"""
+Microbenchmarks for the server hot paths.
+"""
+import argparse
+import itertools
+import logging
+import subprocess
+import sys
+import time
+from functools import partial
+
+from j2dx import ecodes as e
+
+# Logger of the device classes, which the legacy sends logged to
+device_logger = logging.getLogger('J2DX.device')
+
+
+def device_trace(device_cls):
+    """A mixed stick/button trace using every key the device understands."""
+    trace = []
+    for i in range(64):
+        for key in getattr(device_cls, 'axes', {}):
+            trace.append((key, ((i % 16) - 8) / 8.0))
+        for key in itertools.chain(
+                getattr(device_cls, 'buttons', {}), getattr(device_cls, 'dpad', {})):
+            trace.append((key, bool(i & 1)))
+    return trace
+
+
+def legacy_x360_send(device, key, value):
+    """The if/elif X360 send the dispatch tables replaced, one report per event."""
+    with device.lock:
+        try:
+            device_logger.debug(f"Processing input: {key}={value} (type={type(value).__name__})")
+            if key in device.buttons:
+                btn_code = device.buttons[key]
+                btn_value = 1 if value else 0
+                device_logger.debug(f'Sending button event::{e.bytype[e.EV_KEY][btn_code]}: {btn_value}')
+                device._ui.write(e.EV_KEY, btn_code, btn_value)
+                device._ui.syn()
+            elif key in device.axes:
+                axis_code = device.axes[key]
+                if key.endswith('-Y'):
+                    coord = 255 - round(127 * (value + 1))
+                else:
+                    coord = round(127 * (value + 1)) if isinstance(value, float) else value
+                device_logger.debug(f'Sending axis event::{e.bytype[e.EV_ABS][axis_code]}: {coord}')
+                device._ui.write(e.EV_ABS, axis_code, coord)
+                device._ui.syn()
+            else:
+                device_logger.warning(f'Unknown key for X360 controller: {key}')
+        except Exception as ex:
+            device_logger.error(f"Error sending input to device: {str(ex)}")
+
+
+def legacy_ds4_send(device, key, value):
+    """The if/elif DS4 send the dispatch tables replaced, one report per event."""
+    with device.lock:
+        try:
+            if key in device.buttons:
+                btn_code = device.buttons[key]
+                btn_value = 1 if value else 0
+                device_logger.debug(f'Sending button event::{e.bytype[e.EV_KEY][btn_code]}: {btn_value}')
+                device._ui.write(e.EV_KEY, btn_code, btn_value)
+                device._ui.syn()
+            elif key in device.dpad:
+                dpad_code = device.dpad[key]
+                if key in {'up-button', 'left-button'}:
+                    dpad_value = 0 if value else 127
+                else:
+                    dpad_value = 255 if value else 127
+                device_logger.debug(f'Sending axis event::{e.bytype[e.EV_ABS][dpad_code]}: {dpad_value}')
+                device._ui.write(e.EV_ABS, dpad_code, dpad_value)
+                device._ui.syn()
+            elif key in device.axes:
+                axis_code = device.axes[key]
+                coord = round(127 * value) + 127
+                device_logger.debug(f'Sending axis event::{e.bytype[e.EV_ABS][axis_code]}: {coord}')
+                device._ui.write(e.EV_ABS, axis_code, coord)
+                device._ui.syn()
+            else:
+                device_logger.warning(f'Unknown key for DS4 controller: {key}')
+        except Exception as ex:
+            device_logger.error(f"Error sending input to device: {str(ex)}")
+
+
+def bench_dispatch(events, repeat):
+    """
+    Events per second through each device's dispatch table send, and
+    through the if/elif send it replaced, as (dispatch, legacy) per device.
+    """
+    from j2dx.null.device import X360Device, DS4Device
+
+    legacy = {X360Device: legacy_x360_send, DS4Device: legacy_ds4_send}
+    results = {}
+    for device_cls in (X360Device, DS4Device):
+        trace = device_trace(device_cls)
+        trace = (trace * (events // len(trace) + 1))[:events]
+        rates = []
+        for send in (None, legacy[device_cls]):
+            device = device_cls('bench', 'localhost')
+            if send is None:
+                send = device.send
+            else:
+                send = partial(send, device)
+            best = None
+            for _ in range(repeat):
+                start = time.perf_counter()
+                for key, value in trace:
+                    send(key, value)
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+            device.close()
+            rates.append(events / best)
+        results[device_cls.__name__] = tuple(rates)
+    return results
+
+
+def sniff_input(data):
+    """The per-message format detection input events used before codecs."""
+    if len(data) == 1 and isinstance(data[0], dict):
+        data = data[0]
+        slot = data.get('slot', 0)
+        if 'key' in data and 'value' in data:
+            return data['key'], data['value'], slot
+    elif len(data) >= 2:
+        return data[0], data[1], 0
+    raise ValueError(f'Invalid input format: {data}')
+
+
+def bench_codec(events, repeat):
+    """
+    Nanoseconds per 'input' event to recover (key, value, slot), for the
+    old format sniffing and for each codec a session can negotiate.
+    """
+    from j2dx.protocol import CODECS
+
+    def messages(codec):
+        for i in range(events):
+            key, value = ('a-button', bool(i & 1)) if i % 3 else ('left-stick-X', (i % 16) / 16)
+            if codec == 'dict':
+                yield ({'key': key, 'value': value},)
+            elif codec == 'args':
+                yield (key, value)
+            elif codec == 'compact':
+                yield ([key, value],)
+            else:
+                yield (f'{key} {str(value).lower()}',)
+
+    cases = [('sniffing', sniff_input, 'dict')]
+    cases += [(name, decode, name) for name, decode in CODECS.items()]
+    results = {}
+    for name, decode, codec in cases:
+        trace = list(messages(codec))
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter_ns()
+            for data in trace:
+                decode(data)
+            elapsed = time.perf_counter_ns() - start
+            best = elapsed if best is None else min(best, elapsed)
+        results[name] = best / events
+    return results
+
+
+def import_times(module):
+    """
+    Import module in a fresh interpreter with -X importtime and return its
+    cumulative import time and the self time of every module, in
+    microseconds.
+    """
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        capture_output=True, text=True, check=True)
+    modules = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        own, cumulative, name = line[len('import time:'):].split('|')
+        modules[name.strip()] = (int(own), int(cumulative))
+    return modules[module][1], {name: own for name, (own, _) in modules.items()}
+
+
+def bench_startup(repeat, top=10):
+    """
+    Import time of the CLI entry point and of the server, the time to
+    print --help, and the modules the server spends most time importing.
+    """
+    results = {}
+    for module in ('j2dx', 'j2dx.server'):
+        best, slowest = None, None
+        for _ in range(repeat):
+            total, modules = import_times(module)
+            if best is None or total < best:
+                best, slowest = total, modules
+        results[f'import {module}'] = best / 1000
+    heaviest = sorted(slowest.items(), key=lambda item: -item[1])[:top]
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(
+            [sys.executable, '-m', 'j2dx', '--help'],
+            stdout=subprocess.DEVNULL, check=True)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    results['j2dx --help'] = best * 1000
+    return results, heaviest
+
+
+def main():
+    parser = argparse.ArgumentParser(description='J2DX microbenchmarks')
+    parser.add_argument(
+        'benchmark', choices=['dispatch', 'startup', 'codec'],
+        help='Benchmark to run.')
+    parser.add_argument(
+        '-n', '--events', type=int, default=200000,
+        help='Events per run. Defaults to 200000.')
+    parser.add_argument(
+        '-r', '--repeat', type=int, default=5,
+        help='Runs per benchmark, the best one is reported. Defaults to 5.')
+    parser.add_argument(
+        '-a', '--axis-config', default=None,
+        help='Axis curve configuration the dispatch benchmark devices use.')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    if args.benchmark == 'dispatch':
+        if args.axis_config:
+            from j2dx import curves
+            curves.configure(curves.load(args.axis_config))
+        for name, (rate, legacy) in bench_dispatch(args.events, args.repeat).items():
+            print(f'{name}: {rate:,.0f} events/s, {legacy:,.0f} with the if/elif send '
+                  f'({rate / legacy:.1f}x)')
+    elif args.benchmark == 'codec':
+        for name, elapsed in bench_codec(args.events, args.repeat).items():
+            print(f'{name}: {elapsed:.0f} ns/message')
+    elif args.benchmark == 'startup':
+        results, heaviest = bench_startup(args.repeat)
+        for name, elapsed in results.items():
+            print(f'{name}: {elapsed:.1f} ms')
+        print('Slowest modules imported by the server:')
+        for name, own in heaviest:
+            print(f'  {name}: {own / 1000:.1f} ms')
+
+
+if __name__ == '__main__':
+    main()
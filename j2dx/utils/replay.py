@@ -0,0 +1,112 @@
+"""
+Replays an input log written with --record into virtual devices, at the
+original timing or as fast as possible.
+"""
+import argparse
+import logging
+import time
+
+from j2dx import BACKENDS, load_backend
+from j2dx.latency import Histogram, NS_PER_US
+from j2dx.recorder import CLOSE, INPUT, OPEN, RESET, read
+
+logger = logging.getLogger('J2DX.replay')
+
+
+def replay(records, factories, speed=1.0):
+    """
+    Feed records into devices made by factories, a dict of controller
+    kind to device class. speed scales the original timing, None replays
+    as fast as possible. Returns the number of input events, the elapsed
+    seconds and a histogram of how late events were applied, in
+    microseconds.
+    """
+    devices = {}
+    late = Histogram()
+    events = 0
+    # Time from starting the server to the first controller is not replayed
+    first = records[0][0] if records else 0
+    start = time.perf_counter_ns()
+    try:
+        for ns, stream, record_type, key, value in records:
+            if speed is not None:
+                due = start + int((ns - first) / speed)
+                wait = due - time.perf_counter_ns()
+                if wait > 0:
+                    time.sleep(wait / 1e9)
+                late.record((time.perf_counter_ns() - due) // NS_PER_US)
+            if record_type == INPUT:
+                device = devices.get(stream)
+                if device is not None:
+                    device.send(key, value)
+                    events += 1
+            elif record_type == OPEN:
+                devices[stream] = factories[value](f'replay-{stream}', 'replay')
+            elif record_type == RESET:
+                if stream in devices:
+                    devices[stream].reset()
+            elif record_type == CLOSE:
+                if stream in devices:
+                    devices.pop(stream).close()
+    finally:
+        for device in devices.values():
+            device.close()
+    return events, (time.perf_counter_ns() - start) / 1e9, late
+
+
+def speed(text):
+    """Replay speed from the command line, a positive factor."""
+    value = float(text)
+    if not value > 0:
+        raise argparse.ArgumentTypeError(f'speed must be above 0, got {text}')
+    return value
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay a J2DX input log')
+    parser.add_argument('log', help='Input log written with --record.')
+    parser.add_argument(
+        '-b', '--backend', choices=BACKENDS, default='null',
+        help='Virtual device backend to replay into. Defaults to null.')
+    parser.add_argument(
+        '-a', '--axis-config', default=None,
+        help='Axis curve configuration the devices use.')
+    parser.add_argument(
+        '--dump-dir', default=None,
+        help='Only used with --backend recording. Directory each device '
+             'dumps its event stream to when closed.')
+    timing = parser.add_mutually_exclusive_group()
+    timing.add_argument(
+        '-s', '--speed', type=speed, default=1.0,
+        help='Replay speed relative to the recording. Defaults to 1.')
+    timing.add_argument(
+        '-f', '--fast', action='store_true',
+        help='Ignore the recorded timing and replay as fast as possible.')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    try:
+        X360Device, DS4Device = load_backend(args.backend)
+    except RuntimeError as e:
+        parser.exit(1, f'{e}\n')
+    if args.backend == 'recording':
+        from j2dx.null.recording import configure
+        configure(dump_dir=args.dump_dir)
+    if args.axis_config:
+        from j2dx import curves
+        curves.configure(curves.load(args.axis_config))
+    records = read(args.log)
+    streams = sum(1 for record in records if record[2] == OPEN)
+    print(f'{len(records)} records, {streams} devices')
+    events, elapsed, late = replay(
+        records, {'xbox': X360Device, 'ds4': DS4Device},
+        None if args.fast else args.speed)
+    print(f'Replayed {events} input events in {elapsed:.3f} s: {events / elapsed:,.0f} events/s')
+    if not args.fast:
+        summary = late.summary()
+        print(f'Late by {summary["mean"]:.3f} ms on average, '
+              f'{summary["p99"]:.3f} ms p99, {summary["max"]:.3f} ms at most')
+
+
+if __name__ == '__main__':
+    main()
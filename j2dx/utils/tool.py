@@ -1,11 +1,23 @@
 """
-Strumenti di diagnostica per testare la connessione client-server.
+Strumenti di diagnostica per testare la connessione client-server
+e generatore di carico sintetico con più client.
 """
 import asyncio
 import argparse
+import json
+import math
+import platform
+import random
 import sys
+import time
+from functools import partial
 import socketio
 
+BUTTONS = [
+    'a-button', 'b-button', 'x-button', 'y-button',
+    'left-bumper', 'right-bumper', 'start-button',
+]
+
 async def test_connection(host='localhost', port=8013, eio_version=4):
     """
     Testa la connessione al server J2DX.
@@ -63,15 +75,310 @@ async def test_connection(host='localhost', port=8013, eio_version=4):
         if sio.connected:
             await sio.disconnect()
 
+class Trace:
+    """
+    Traccia realistica di stick e pulsanti campionata a una frequenza fissa:
+    lo stick sinistro descrive cerchi di raggio variabile, lo stick destro
+    fa piccole correzioni e i pulsanti vengono premuti e rilasciati
+    circa quattro volte al secondo.
+    """
+
+    def __init__(self, rate, seed):
+        self.rate = rate
+        self.rng = random.Random(seed)
+        self.phase = self.rng.random() * 2 * math.pi
+        self.tick = 0
+        self.held = None
+
+    def next(self):
+        """Ritorna la lista di eventi (key, value) del prossimo campione."""
+        t = self.tick / self.rate
+        self.tick += 1
+        angle = self.phase + t * math.pi
+        radius = 0.6 + 0.4 * math.sin(t * 1.3)
+        events = [
+            ('left-stick-X', round(radius * math.cos(angle), 3)),
+            ('left-stick-Y', round(radius * math.sin(angle), 3)),
+        ]
+        if self.rng.random() < 0.3:
+            events.append(('right-stick-X', round(self.rng.uniform(-0.3, 0.3), 3)))
+        if self.rng.random() < 4 / self.rate:
+            if self.held:
+                events.append((self.held, False))
+                self.held = None
+            else:
+                self.held = self.rng.choice(BUTTONS)
+                events.append((self.held, True))
+        return events
+
+
+class LoadStats:
+    """Contatori condivisi dai client di un test di carico."""
+
+    def __init__(self):
+        self.messages = 0
+        self.events = 0
+        self.acked = 0
+        self.errors = 0
+        self.latencies = []
+        self.last_send = None
+
+    def ack(self, sent_at, *args):
+        self.acked += 1
+        self.latencies.append(time.perf_counter() - sent_at)
+
+
+def percentile(values, percent):
+    if not values:
+        return 0
+    return values[min(len(values) - 1, int(len(values) * percent / 100))]
+
+
+async def paced(rate, duration, send):
+    """Chiama send() rate volte al secondo per duration secondi."""
+    interval = 1 / rate
+    start = time.perf_counter()
+    deadline = start + duration
+    tick = start
+    while tick < deadline:
+        await send()
+        tick += interval
+        delay = tick - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        elif delay < -1:
+            # In ritardo di oltre un secondo: si riparte invece di recuperare
+            tick = time.perf_counter()
+
+
+async def sio_load_client(index, url, controller, rate, duration, batch, stats):
+    sio = socketio.AsyncClient(reconnection=False)
+    await sio.connect(url, transports=['websocket'])
+    # Si aspetta la conferma: i primi campioni non devono precedere il controller
+    await sio.call(controller)
+    trace = Trace(rate, index)
+    seq = 0
+
+    async def send():
+        nonlocal seq
+        events = trace.next()
+        if batch:
+            messages = [('input_batch', [[key, value] for key, value in events])]
+        else:
+            messages = [
+                ('input', {'key': key, 'value': value})
+                for key, value in events
+            ]
+        for event, data in messages:
+            seq += 1
+            if event == 'input':
+                data['t'] = time.time() * 1000
+                data['seq'] = seq
+            stats.messages += 1
+            await sio.emit(event, data, callback=partial(stats.ack, time.perf_counter()))
+        stats.events += len(events)
+        stats.last_send = time.perf_counter()
+
+    try:
+        await paced(rate, duration, send)
+        # Lascia il tempo agli ultimi ack di arrivare
+        await asyncio.sleep(1)
+    finally:
+        await sio.disconnect()
+
+
+class HTTPConnection:
+    """Connessione HTTP/1.1 keep-alive minimale su asyncio stream."""
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.reader = None
+        self.writer = None
+
+    async def _send(self, method, path, data):
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        self.writer.write(
+            f'{method} {path} HTTP/1.1\r\n'
+            f'Host: {self.host}:{self.port}\r\n'
+            f'Content-Type: application/json\r\n'
+            f'Content-Length: {len(data)}\r\n\r\n'.encode() + data)
+        await self.writer.drain()
+        return await self.reader.readline()
+
+    async def request(self, method, path, body=None):
+        data = json.dumps(body).encode() if body is not None else b''
+        status = await self._send(method, path, data)
+        if not status:
+            # Il server ha chiuso la connessione inattiva: si riapre una volta
+            self.close()
+            status = await self._send(method, path, data)
+        length = 0
+        while True:
+            line = await self.reader.readline()
+            if line in (b'\r\n', b''):
+                break
+            name, _, value = line.decode().partition(':')
+            if name.lower() == 'content-length':
+                length = int(value)
+        payload = await self.reader.readexactly(length)
+        if b' 200 ' not in status:
+            raise ConnectionError(status.decode().strip())
+        return json.loads(payload) if payload else None
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.reader = self.writer = None
+
+
+async def http_load_client(index, host, port, controller, rate, duration, stats):
+    conn = HTTPConnection(host, port)
+    session = await conn.request('POST', '/message', {'event': controller})
+    token = session.get('token')
+    trace = Trace(rate, index)
+
+    async def send():
+        events = trace.next()
+        stats.messages += 1
+        sent_at = time.perf_counter()
+        try:
+            reply = await conn.request('POST', '/input', {
+                'token': token,
+                'events': [[key, value] for key, value in events],
+            })
+            if reply.get('status') == 'ok':
+                stats.ack(sent_at)
+            else:
+                stats.errors += 1
+        except (ConnectionError, asyncio.IncompleteReadError):
+            stats.errors += 1
+        stats.events += len(events)
+        stats.last_send = time.perf_counter()
+
+    try:
+        await paced(rate, duration, send)
+        await conn.request('POST', '/message', {'event': 'close', 'token': token})
+    finally:
+        conn.close()
+
+
+async def run_load(args):
+    """
+    Avvia i client di carico e raccoglie throughput, latenza degli ack,
+    eventi persi e uso della CPU del server.
+    """
+    url = f'http://{args.host}:{args.port}'
+    controllers = ['xbox', 'ds4'] if args.controller == 'mix' else [args.controller]
+    stats = LoadStats()
+    status = HTTPConnection(args.host, args.port)
+    before = await status.request('GET', '/status')
+
+    print(
+        f"Avvio di {args.clients} client Socket.IO e {args.http_clients} client HTTP "
+        f"a {args.rate} Hz per {args.duration} s")
+    start = time.perf_counter()
+    tasks = [
+        sio_load_client(
+            i, url, controllers[i % len(controllers)],
+            args.rate, args.duration, args.batch, stats)
+        for i in range(args.clients)
+    ] + [
+        http_load_client(
+            i, args.host, args.port, controllers[i % len(controllers)],
+            args.rate, args.duration, stats)
+        for i in range(args.http_clients)
+    ]
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+    elapsed = time.perf_counter() - start
+    failed = [r for r in results if isinstance(r, Exception)]
+    for error in failed:
+        print(f"✗ Client fallito: {error}")
+
+    after = await status.request('GET', '/status')
+    status.close()
+
+    latencies = sorted(stats.latencies)
+    # Il throughput si misura sulla finestra di invio, senza l'attesa degli ack
+    window = (stats.last_send or time.perf_counter()) - start
+    return {
+        'timestamp': time.time(),
+        'host': platform.node(),
+        'config': {
+            'clients': args.clients,
+            'http_clients': args.http_clients,
+            'controller': args.controller,
+            'rate': args.rate,
+            'duration': args.duration,
+            'batch': args.batch,
+        },
+        'elapsed': elapsed,
+        'failed_clients': len(failed),
+        'messages': stats.messages,
+        'events': stats.events,
+        'acked': stats.acked,
+        'errors': stats.errors,
+        'dropped': stats.messages - stats.acked,
+        'throughput': {
+            'messages_per_second': stats.messages / window,
+            'events_per_second': stats.events / window,
+            'target_samples_per_second': (args.clients + args.http_clients) * args.rate,
+        },
+        'ack_latency_ms': {
+            'p50': percentile(latencies, 50) * 1000,
+            'p90': percentile(latencies, 90) * 1000,
+            'p99': percentile(latencies, 99) * 1000,
+            'p999': percentile(latencies, 99.9) * 1000,
+            'max': latencies[-1] * 1000 if latencies else 0,
+        },
+        'server_cpu_percent': (
+            (after['cpu_time'] - before['cpu_time']) / elapsed * 100
+            if 'cpu_time' in before else None
+        ),
+    }
+
+
+def rate(text):
+    """Frequenza di campionamento da riga di comando, tra 60 e 1000 Hz."""
+    value = int(text)
+    if not 60 <= value <= 1000:
+        raise argparse.ArgumentTypeError(f'la frequenza deve essere tra 60 e 1000 Hz, non {text}')
+    return value
+
+
 def main():
-    parser = argparse.ArgumentParser(description='Test di connessione a J2DX')
+    parser = argparse.ArgumentParser(description='Test di connessione e di carico per J2DX')
     parser.add_argument('--host', default='localhost', help='Host del server J2DX')
     parser.add_argument('--port', type=int, default=8013, help='Porta del server J2DX')
     parser.add_argument('--eio', type=int, choices=[3, 4], default=4, 
                       help='Versione Engine.IO da usare (3 o 4)')
+    load = parser.add_argument_group('test di carico')
+    load.add_argument('-c', '--clients', type=int, default=0,
+                      help='Numero di client Socket.IO concorrenti')
+    load.add_argument('--http-clients', type=int, default=0,
+                      help='Numero di client HTTP concorrenti')
+    load.add_argument('--controller', choices=['xbox', 'ds4', 'mix'], default='xbox',
+                      help='Controller richiesto dai client (mix li alterna)')
+    load.add_argument('-r', '--rate', type=rate, default=120,
+                      help='Campioni al secondo per client (60-1000 Hz)')
+    load.add_argument('-t', '--duration', type=float, default=10,
+                      help='Durata del test in secondi')
+    load.add_argument('--batch', action='store_true',
+                      help='Invia ogni campione come un singolo input_batch')
+    load.add_argument('-o', '--output', help='File JSON in cui salvare i risultati')
     
     args = parser.parse_args()
-    asyncio.run(test_connection(args.host, args.port, args.eio))
+    if not args.clients and not args.http_clients:
+        asyncio.run(test_connection(args.host, args.port, args.eio))
+        return
+
+    results = asyncio.run(run_load(args))
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, 'w') as fd:
+            json.dump(results, fd, indent=2)
+        print(f"Risultati salvati in {args.output}")
 
 if __name__ == "__main__":
     main()
@@ -1,19 +1,77 @@
 import logging
 from abc import ABC, abstractmethod
-from functools import reduce
 from . import ViGEm as vigem  # Modificato per utilizzare il modulo corretto
+from j2dx import curves
+from j2dx.state import ControllerState
 
 
 logger = logging.getLogger('J2DX.Windows')
 
 
+def _shaped(handler, shape):
+	"""Wrap a dispatch handler so it receives the shaped value."""
+	def apply(self, arg, value):
+		handler(self, arg, shape(value))
+	return apply
+
+
+def _ignore(value):
+	pass
+
+
 class Device(ABC):
 
+	def __init_subclass__(cls, **kwargs):
+		super().__init_subclass__(**kwargs)
+		cls.dispatch = cls.compile_dispatch()
+
+	@classmethod
+	@abstractmethod
+	def compile_dispatch(cls):
+		"""
+		Build the key -> (handler, argument) table used by the send path.
+		Handlers are called as handler(self, argument, value).
+		Called once when the class is created.
+		"""
+		pass
+
 	@abstractmethod
 	def __init__(self, device, addr):
 		self.device = device
 		self.address = addr
 		self._client = vigem.alloc()
+		# Last report submitted to the driver, unchanged reports are skipped
+		self._last_report = None
+		# Pressed buttons as a mask, merged into the report on update
+		self._buttons = 0
+		self.state = ControllerState()
+		self.emitted = 0
+		self.suppressed = 0
+		self._shape()
+
+	def _shape(self):
+		"""
+		Build this device's own dispatch table: entries gain the update of
+		the shared controller state, and sticks the configured axis curves,
+		see j2dx.curves. Triggers are digital on ViGEm and are not shaped.
+		"""
+		dispatch = {}
+		for key, (handler, arg) in self.dispatch.items():
+			if key in self.analog:
+				shaped = curves.compose(key)
+				if shaped is not None:
+					handler = _shaped(handler, shaped)
+			dispatch[key] = (handler, arg, self.state.updater(key) or _ignore)
+		self.dispatch = dispatch
+		self._radial = curves.radial()
+
+	def stats(self):
+		return {
+			'type': self.type,
+			'address': self.address,
+			'emitted': self.emitted,
+			'suppressed': self.suppressed,
+		}
 
 	def _create_device(self):
 		error = vigem.VIGEM_ERRORS(vigem.connect(self._client))
@@ -29,6 +87,24 @@ class Device(ABC):
 					Adding target failed::{error.name}')
 			raise Exception(error.name)
 
+	def assign(self, device, addr):
+		"""Hand a pooled device over to a new session."""
+		self.device = device
+		self.address = addr
+		self.emitted = 0
+		self.suppressed = 0
+
+	def reset(self):
+		"""Release every button and center every axis."""
+		self._buttons = 0
+		self.state.clear()
+		self._reset_report()
+		self._update()
+
+	@abstractmethod
+	def _reset_report(self):
+		pass
+
 	def close(self):
 		error = vigem.VIGEM_ERRORS(vigem.target_remove(self._client, self._target))
 		if error != vigem.VIGEM_ERRORS.VIGEM_ERROR_NONE:
@@ -43,13 +119,63 @@ class Device(ABC):
 			f'Destroyed virtual {self.type} device for {self.device} \
 				at {self.address}')
 
-	@abstractmethod
 	def send(self, key, value):
+		self.send_many(((key, value),))
+
+	def send_many(self, events):
+		"""
+		Apply a batch of (key, value) updates to the report and submit it
+		to the driver once.
+		"""
+		self._begin_update()
+		if self._radial:
+			events = curves.expand(self._radial, events)
+		for key, value in events:
+			try:
+				self._apply(key, value)
+			except Exception as ex:
+				logger.error(f"Error applying input to report: {str(ex)}")
+		self._update()
+
+	def _begin_update(self):
+		pass
+
+	def _apply(self, key, value):
+		entry = self.dispatch.get(key)
+		if entry is not None:
+			handler, arg, update = entry
+			handler(self, arg, value)
+			update(value)
+
+	def _report_changed(self):
+		report = bytes(self._report)
+		if report == self._last_report:
+			self.suppressed += 1
+			return False
+		self._last_report = report
+		self.emitted += 1
+		return True
+
+	def _set_button(self, button, value):
+		if value:
+			self._buttons |= button
+		else:
+			self._buttons &= ~button
+
+	def _set_field(self, field, value):
+		setattr(self._report, field, value)
+		if logger.isEnabledFor(logging.DEBUG):
+			logger.debug(f'{field}::{value}')
+
+	@abstractmethod
+	def _update(self):
 		pass
 
 
 class X360Device(Device):
 
+	# Device name, also reported in stats
+	type = "Xbox 360 Controller"
 	buttons = {
 		'main-button': vigem.XUSB_BUTTON.XUSB_GAMEPAD_GUIDE,
 		'back-button': vigem.XUSB_BUTTON.XUSB_GAMEPAD_BACK,
@@ -79,12 +205,12 @@ class X360Device(Device):
 		'left-stick-X': 'sThumbLX',
 		'right-stick-X': 'sThumbRX',
 	}
+	# Keys whose intermediate values may be coalesced by the writer
+	analog = frozenset({**axes_vertical, **axes_horizontal})
 
 	def __init__(self, device, addr):
 		super().__init__(device, addr)
-		self.type = "Xbox 360 Controller"
 		self._target = vigem.target_x360_alloc()
-		self._wButtons = set()
 		self._report = vigem.XUSB_REPORT(
 			wButtons=0,
 			bLeftTrigger=0,
@@ -96,31 +222,40 @@ class X360Device(Device):
 		)
 		self._create_device()
 
-	def send(self, key, value):
-		if key in self.buttons:
-			if value:
-				self._wButtons.add(self.buttons[key])
-			else:
-				self._wButtons.remove(self.buttons[key])
-		elif key in self.triggers:
-			if value:
-				setattr(self._report, self.triggers[key], vigem.XUSB_TRIGGER_MAX)
-				logger.debug(f'{self.triggers[key]}::{vigem.XUSB_TRIGGER_MAX}')
-			else:
-				setattr(self._report, self.triggers[key], 0)
-				logger.debug(f'{self.triggers[key]}::0')
-		elif key in self.axes_vertical:
-			axis = -round(value * vigem.XUSB_THUMB_MAX)
-			setattr(self._report, self.axes_vertical[key], axis)
-			logger.debug(f'{self.axes_vertical[key]}::{axis}')
-		elif key in self.axes_horizontal:
-			axis = round(value * vigem.XUSB_THUMB_MAX)
-			setattr(self._report, self.axes_horizontal[key], axis)
-			logger.debug(f'{self.axes_horizontal[key]}::{axis}')
-		wButtons = reduce(lambda a, b: a | b, self._wButtons, 0)
-		self._report.wButtons = wButtons
-		logger.debug(
-			f'wButtons::Mask {wButtons}::{[b.name for b in self._wButtons]}')
+	@classmethod
+	def compile_dispatch(cls):
+		dispatch = {}
+		for key, button in cls.buttons.items():
+			dispatch[key] = (cls._set_button, button)
+		for key, field in cls.triggers.items():
+			dispatch[key] = (cls._set_trigger, field)
+		for key, field in cls.axes_vertical.items():
+			dispatch[key] = (cls._set_axis, (field, -vigem.XUSB_THUMB_MAX))
+		for key, field in cls.axes_horizontal.items():
+			dispatch[key] = (cls._set_axis, (field, vigem.XUSB_THUMB_MAX))
+		return dispatch
+
+	def _reset_report(self):
+		self._report.bLeftTrigger = 0
+		self._report.bRightTrigger = 0
+		self._report.sThumbLX = 0
+		self._report.sThumbLY = 0
+		self._report.sThumbRX = 0
+		self._report.sThumbRY = 0
+
+	def _set_trigger(self, field, value):
+		self._set_field(field, vigem.XUSB_TRIGGER_MAX if value else 0)
+
+	def _set_axis(self, axis, value):
+		field, scale = axis
+		self._set_field(field, round(value * scale))
+
+	def _update(self):
+		self._report.wButtons = self._buttons
+		if logger.isEnabledFor(logging.DEBUG):
+			logger.debug(f'wButtons::Mask {self._buttons}')
+		if not self._report_changed():
+			return
 		error = vigem.VIGEM_ERRORS(
 			vigem.target_x360_update(self._client, self._target, self._report)
 		)
@@ -133,6 +268,7 @@ class X360Device(Device):
 
 class DS4Device(Device):
 
+	type = "Sony Computer Entertainment Wireless Controller"
 	buttons = {
 		'back-button': vigem.DS4_BUTTONS.DS4_BUTTON_SHARE,
 		'start-button': vigem.DS4_BUTTONS.DS4_BUTTON_OPTIONS,
@@ -166,12 +302,11 @@ class DS4Device(Device):
 		'left-stick-X': 'bThumbLX',
 		'right-stick-X': 'bThumbRX',
 	}
+	analog = frozenset({**axes_vertical, **axes_horizontal})
 
 	def __init__(self, device, addr):
 		super().__init__(device, addr)
-		self.type = "Sony Computer Entertainment Wireless Controller"
 		self._target = vigem.target_ds4_alloc()
-		self._wButtons = set()
 		self._report = vigem.DS4_REPORT(
 			bThumbLX=0,
 			bThumbLY=0,
@@ -185,49 +320,56 @@ class DS4Device(Device):
 		vigem.DS4_REPORT_INIT(self._report)
 		self._create_device()
 
-	def send(self, key, value):
+	def _begin_update(self):
 		self._report.wButtons = 0
-		if key in self.buttons:
-			if value:
-				self._wButtons.add(self.buttons[key])
-			else:
-				self._wButtons.remove(self.buttons[key])
-		elif key in self.specials:
-			if value:
-				self._report.bSpecial |= self.specials[key]
-				logger.debug(f'{self.specials[key].name}::{self.specials[key]}')
-			else:
-				self._report.bSpecial = 0
-				logger.debug(f'{self.specials[key].name}::0')
-		elif key in self.dpad:
-			if value:
-				vigem.DS4_SET_DPAD(self._report, self.dpad[key])
-				logger.debug(f'{self.dpad[key].name}')
-			else:
-				vigem.DS4_SET_DPAD(
-					self._report, vigem.DS4_DPAD_DIRECTIONS.DS4_BUTTON_DPAD_NONE)
-				logger.debug(f'{vigem.DS4_DPAD_DIRECTIONS.DS4_BUTTON_DPAD_NONE.name}')
-		elif key in self.triggers:
-			if value:
-				setattr(self._report, self.triggers[key][0], vigem.XUSB_TRIGGER_MAX)
-				logger.debug(f'{self.triggers[key][0]}::{vigem.XUSB_TRIGGER_MAX}')
-				self._wButtons.add(self.triggers[key][1])
-			else:
-				setattr(self._report, self.triggers[key][0], 0)
-				logger.debug(f'{self.triggers[key][0]}::0')
-				self._wButtons.remove(self.triggers[key][1])
-		elif key in self.axes_vertical:
-			axis = round(value * 127) + 127
-			setattr(self._report, self.axes_vertical[key], axis)
-			logger.debug(f'{self.axes_vertical[key]}::{axis}')
-		elif key in self.axes_horizontal:
-			axis = round(value * 127) + 127
-			setattr(self._report, self.axes_horizontal[key], axis)
-			logger.debug(f'{self.axes_horizontal[key]}::{axis}')
-		self._report.wButtons |= reduce(lambda a, b: a | b, self._wButtons, 0)
-		logger.debug(
-			f'wButtons::Mask {self._report.wButtons}::\
-				{[b.name for b in self._wButtons]}')
+
+	@classmethod
+	def compile_dispatch(cls):
+		dispatch = {}
+		for key, button in cls.buttons.items():
+			dispatch[key] = (cls._set_button, button)
+		for key, special in cls.specials.items():
+			dispatch[key] = (cls._set_special, special)
+		for key, direction in cls.dpad.items():
+			dispatch[key] = (cls._set_dpad, direction)
+		for key, trigger in cls.triggers.items():
+			dispatch[key] = (cls._set_trigger, trigger)
+		for key, field in {**cls.axes_vertical, **cls.axes_horizontal}.items():
+			dispatch[key] = (cls._set_axis, field)
+		return dispatch
+
+	def _reset_report(self):
+		vigem.DS4_REPORT_INIT(self._report)
+
+	def _set_special(self, special, value):
+		if value:
+			self._report.bSpecial |= special
+		else:
+			self._report.bSpecial = 0
+		if logger.isEnabledFor(logging.DEBUG):
+			logger.debug(f'{special.name}::{special if value else 0}')
+
+	def _set_dpad(self, direction, value):
+		if not value:
+			direction = vigem.DS4_DPAD_DIRECTIONS.DS4_BUTTON_DPAD_NONE
+		vigem.DS4_SET_DPAD(self._report, direction)
+		if logger.isEnabledFor(logging.DEBUG):
+			logger.debug(f'{direction.name}')
+
+	def _set_trigger(self, trigger, value):
+		field, button = trigger
+		self._set_field(field, vigem.XUSB_TRIGGER_MAX if value else 0)
+		self._set_button(button, value)
+
+	def _set_axis(self, field, value):
+		self._set_field(field, round(value * 127) + 127)
+
+	def _update(self):
+		self._report.wButtons |= self._buttons
+		if logger.isEnabledFor(logging.DEBUG):
+			logger.debug(f'wButtons::Mask {self._report.wButtons}')
+		if not self._report_changed():
+			return
 		error = vigem.VIGEM_ERRORS(
 			vigem.target_ds4_update(self._client, self._target, self._report)
 		)
@@ -0,0 +1,292 @@
+"""
+Per-device write queues, applied round-robin across sessions.
+"""
+import asyncio
+import logging
+import time
+from collections import OrderedDict, deque
+
+logger = logging.getLogger('J2DX.writer')
+
+# Job marker asking for a device reset instead of a write
+RESET = None
+
+
+class WriteScheduler:
+    """
+    Applies the input queued on every DeviceWriter from a single task, so
+    socket handlers return immediately and the blocking device writes run
+    in an executor thread instead of on the event loop.
+
+    Work is shared out in rounds: every round writes one device report of
+    each session that has input pending, taking turns between the
+    controllers of a session, and runs as one executor job. A session
+    flooding its controller gets one report per round like everyone
+    else instead of holding up the sessions queued behind it.
+    """
+
+    def __init__(self, executor=None):
+        self.executor = executor
+        self.rounds = 0
+        # session -> writers with input pending, in turn order
+        self._sessions = OrderedDict()
+        self._ready = None
+        self._task = None
+
+    def schedule(self, writer):
+        """Give writer a turn, unless it already has one coming."""
+        if writer._scheduled:
+            return
+        writer._scheduled = True
+        writer._idle.clear()
+        self._sessions.setdefault(writer.session, deque()).append(writer)
+        if self._task is None:
+            self._ready = asyncio.Event()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+        self._ready.set()
+
+    def _next_round(self):
+        """One job of every session with pending input."""
+        jobs = []
+        for session in list(self._sessions):
+            writers = self._sessions[session]
+            writer = writers.popleft()
+            if not writers:
+                del self._sessions[session]
+            job = writer._next_job()
+            if job is None:
+                writer._done()
+            else:
+                jobs.append((writer, job))
+        return jobs
+
+    @staticmethod
+    def _apply(jobs):
+        """Runs in the executor, returns when each write started and ended or its error."""
+        results = []
+        for writer, (_, batch) in jobs:
+            started = time.perf_counter_ns()
+            try:
+                if batch is RESET:
+                    writer.device.reset()
+                else:
+                    writer.device.send_many(batch)
+            except Exception as e:
+                results.append(e)
+            else:
+                results.append((started, time.perf_counter_ns()))
+        return results
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await self._ready.wait()
+            self._ready.clear()
+            while self._sessions:
+                jobs = self._next_round()
+                if not jobs:
+                    continue
+                self.rounds += 1
+                try:
+                    results = await loop.run_in_executor(self.executor, self._apply, jobs)
+                except Exception as e:
+                    results = [e] * len(jobs)
+                for (writer, job), result in zip(jobs, results):
+                    writer._written(job, result)
+                    if writer._pending():
+                        self._sessions.setdefault(writer.session, deque()).append(writer)
+                    else:
+                        writer._done()
+
+
+class DeviceWriter:
+    """
+    Queues input for one device until the WriteScheduler gives it a turn.
+
+    Analog keys are coalesced: each turn only writes the newest value per
+    axis. Every other key is kept in order, so button edges are never
+    dropped, and a key that changes twice before a turn is split over two
+    device reports so the game sees both edges.
+
+    With a Throttle, analog input over the session's budget is held back
+    or dropped, see j2dx.throttle.
+    """
+
+    def __init__(self, device, scheduler, session=None, tracker=None, recorder=None,
+                 counters=None, throttle=None):
+        self.device = device
+        self.scheduler = scheduler
+        # Writers of one session share its turns
+        self.session = session
+        self.tracker = tracker
+        # Stream of the input recorder, see j2dx.recorder
+        self.recorder = recorder
+        # EventCounters of the controller type, see j2dx.metrics
+        self.counters = counters
+        self._received = counters.received if counters is not None else None
+        self.throttle = throttle
+        self.coalesced = 0
+        self._queued_ns = None
+        self._analog = device.analog
+        self._axes = {}
+        self._edges = deque()
+        self._batches = deque()
+        # Analog input over budget, waiting for tokens
+        self._held = {}
+        self._release_timer = None
+        self._neutralize = False
+        self._scheduled = False
+        self._idle = asyncio.Event()
+        self._idle.set()
+
+    def send(self, key, value):
+        if self.recorder is not None:
+            self.recorder.input(key, value)
+        if self._received is not None:
+            try:
+                self._received[key] += 1
+            except KeyError:
+                self.counters.unknown += 1
+        if key in self._analog:
+            if self.throttle is not None and not self.throttle.take():
+                self._over_budget(key, value)
+                return
+            if self._held and key in self._held:
+                # Superseded before its release
+                del self._held[key]
+                self.throttle.coalesced += 1
+            if key in self._axes:
+                self.coalesced += 1
+            self._axes[key] = value
+        else:
+            if self.throttle is not None:
+                # Buttons always pass, but count against the budget
+                self.throttle.take()
+            self._edges.append((key, value))
+        if self._queued_ns is None:
+            self._queued_ns = time.perf_counter_ns()
+        self.scheduler.schedule(self)
+
+    def send_many(self, events):
+        for key, value in events:
+            self.send(key, value)
+
+    def neutralize(self):
+        """
+        Drop queued input and return the device to neutral, ordered after
+        any write already in progress.
+        """
+        if self.recorder is not None:
+            self.recorder.reset()
+        self._axes.clear()
+        self._edges.clear()
+        self._batches.clear()
+        self._held.clear()
+        self._queued_ns = None
+        self._neutralize = True
+        self.scheduler.schedule(self)
+
+    def stats(self):
+        stats = self.device.stats()
+        stats['coalesced'] = self.coalesced
+        return stats
+
+    def _over_budget(self, key, value):
+        throttle = self.throttle
+        throttle.limited += 1
+        if not throttle.coalesce:
+            throttle.dropped += 1
+            return
+        if key in self._held:
+            throttle.coalesced += 1
+        self._held[key] = value
+        if self._release_timer is None:
+            self._release_timer = asyncio.get_running_loop().call_later(
+                throttle.delay(), self._release)
+
+    def _release(self):
+        """Pass held back analog input on as the budget allows."""
+        self._release_timer = None
+        for key in list(self._held):
+            if not self.throttle.take():
+                self._release_timer = asyncio.get_running_loop().call_later(
+                    self.throttle.delay(), self._release)
+                break
+            self._axes[key] = self._held.pop(key)
+        if self._axes:
+            if self._queued_ns is None:
+                self._queued_ns = time.perf_counter_ns()
+            self.scheduler.schedule(self)
+
+    def _drain(self):
+        """Split everything queued so far into device reports."""
+        batches = []
+        batch = list(self._axes.items())
+        keys = set(self._axes)
+        self._axes.clear()
+        while self._edges:
+            key, value = self._edges.popleft()
+            if key in keys:
+                batches.append(batch)
+                batch = []
+                keys = set()
+            batch.append((key, value))
+            keys.add(key)
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def _pending(self):
+        return bool(self._neutralize or self._batches or self._axes or self._edges)
+
+    def _next_job(self):
+        """The next (queued time, batch) to apply, None if there is none."""
+        if self._neutralize:
+            self._neutralize = False
+            return None, RESET
+        if not self._batches:
+            queued, self._queued_ns = self._queued_ns, None
+            self._batches.extend((queued, batch) for batch in self._drain())
+        if self._batches:
+            return self._batches.popleft()
+        return None
+
+    def _written(self, job, result):
+        queued, batch = job
+        if isinstance(result, Exception):
+            if batch is RESET:
+                logger.error(f'Error resetting device {self.device.device}: {result}')
+            else:
+                logger.error(f'Error writing to device {self.device.device}: {result}')
+            return
+        if batch is RESET:
+            return
+        if self.tracker is not None and queued is not None:
+            self.tracker.written(queued, *result)
+        if self.counters is not None:
+            forwarded = self.counters.forwarded
+            for key, _ in batch:
+                if key in forwarded:
+                    forwarded[key] += 1
+
+    def _done(self):
+        self._scheduled = False
+        self._idle.set()
+
+    async def stop(self):
+        """Flush pending input, including any held back, and wait until it is written."""
+        if self._release_timer is not None:
+            self._release_timer.cancel()
+            self._release_timer = None
+        if self._held:
+            self._axes.update(self._held)
+            self._held.clear()
+        if self._pending():
+            self.scheduler.schedule(self)
+        await self._idle.wait()
+
+    async def close(self):
+        """Stop the writer and close the device."""
+        await self.stop()
+        # Not a write, so not on the writer thread either
+        await asyncio.get_running_loop().run_in_executor(None, self.device.close)
@@ -0,0 +1,24 @@
+from j2dx.latency import Histogram
+
+
+def test_histogram_percentiles():
+    histogram = Histogram()
+    assert histogram.percentile(99) == 0
+    for value in range(1, 101):
+        histogram.record(value)
+    assert histogram.percentile(50) == 50
+    assert histogram.percentile(99) == 99
+    assert histogram.percentile(100) == 100
+    assert histogram.min == 1
+    assert histogram.max == 100
+
+
+def test_histogram_error_stays_within_its_precision():
+    histogram = Histogram(precision=7)
+    for value in range(1000, 1_000_001, 1000):
+        histogram.record(value)
+    for percent in (50, 90, 99, 99.9):
+        exact = round(1000 * percent / 100) * 1000
+        assert abs(histogram.percentile(percent) - exact) <= exact * 2 ** -6
+    histogram.record(10 ** 12)
+    assert histogram.max == histogram.max_value
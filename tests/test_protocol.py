@@ -0,0 +1,37 @@
+from j2dx.protocol import SEQ_MOD, FrameDecoder, is_newer, pack_frame
+
+
+def test_is_newer_across_the_wrap_around():
+    assert is_newer(1, 0)
+    assert not is_newer(0, 0)
+    assert not is_newer(0, 1)
+    assert is_newer(0, SEQ_MOD - 1)
+    assert is_newer(5, SEQ_MOD - 10)
+    assert not is_newer(SEQ_MOD - 1, 0)
+
+
+def test_decoder_only_reports_changes():
+    decoder = FrameDecoder()
+    assert decoder.decode(pack_frame(1, {'a-button'}, {'left-stick-X': 1.0})) == [
+        ('a-button', True), ('left-stick-X', 1.0)]
+    assert decoder.decode(pack_frame(2, {'a-button'}, {'left-stick-X': 1.0})) == []
+    assert decoder.decode(pack_frame(3)) == [('a-button', False), ('left-stick-X', 0.0)]
+
+
+def test_decoder_drops_stale_frames():
+    decoder = FrameDecoder()
+    decoder.decode(pack_frame(10, {'b-button'}))
+    assert decoder.decode(pack_frame(9)) == []
+    assert decoder.decode(pack_frame(10)) == []
+    assert decoder.stale == 2
+    assert decoder.decode(pack_frame(11)) == [('b-button', False)]
+
+
+def test_decoder_follows_the_sequence_through_the_wrap_around():
+    decoder = FrameDecoder()
+    decoder.decode(pack_frame(SEQ_MOD - 1))
+    assert decoder.decode(pack_frame(SEQ_MOD, {'x-button'})) == [('x-button', True)]
+    assert decoder.seq == 0
+    assert decoder.decode(pack_frame(SEQ_MOD - 2)) == []
+    assert decoder.stale == 1
+    assert decoder.decode(pack_frame(1)) == [('x-button', False)]
@@ -0,0 +1,61 @@
+import pytest
+
+from j2dx.remote import BOOL, END_OF_BATCH, FLOAT, INT, Ring
+
+
+def make_ring(capacity):
+    return Ring(bytearray(Ring.size(capacity)), 0, capacity)
+
+
+def records(start, count):
+    return [(index, FLOAT, 0, index / 10) for index in range(start, start + count)]
+
+
+def test_pop_returns_records_in_order():
+    ring = make_ring(8)
+    assert ring.empty()
+    batch = [(0, BOOL, 0, 1.0), (3, INT, 0, 200.0), (5, FLOAT, END_OF_BATCH, -0.5)]
+    ring.push(batch, wake=lambda: None)
+    assert not ring.empty()
+    assert ring.pop() == batch
+    assert ring.empty()
+    assert ring.pop() == ()
+
+
+def test_records_wrap_around_the_end():
+    ring = make_ring(4)
+    for start in range(0, 30, 3):
+        ring.push(records(start, 3), wake=lambda: None)
+        assert ring.pop() == records(start, 3)
+    assert ring.head == ring.tail == 30
+
+
+def test_full_ring_waits_for_the_consumer():
+    ring = make_ring(4)
+    ring.push(records(0, 3), wake=lambda: None)
+    popped = []
+
+    def wake():
+        popped.extend(ring.pop())
+
+    ring.push(records(3, 2), wake)
+    assert popped == records(0, 3)
+    assert ring.pop() == records(3, 2)
+
+
+def test_batch_larger_than_the_ring_is_refused():
+    ring = make_ring(4)
+    with pytest.raises(ValueError):
+        ring.push(records(0, 5), wake=lambda: None)
+    assert ring.empty()
+
+
+def test_both_sides_share_the_counters():
+    buf = bytearray(2 * Ring.size(4))
+    producer = Ring(buf, Ring.size(4), 4)
+    producer.push(records(0, 2), wake=lambda: None)
+    consumer = Ring(buf, Ring.size(4), 4)
+    assert consumer.pop() == records(0, 2)
+    assert Ring(buf, 0, 4).empty()
+    consumer.reset()
+    assert Ring(buf, Ring.size(4), 4).head == 0
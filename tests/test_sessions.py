@@ -0,0 +1,83 @@
+from j2dx.sessions import ParkedSessions, TimerWheel
+
+
+class Clock:
+
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_wheel_expires_keys_after_their_timeout():
+    clock = Clock()
+    wheel = TimerWheel(timeout=5, tick=1, clock=clock)
+    wheel.touch('a')
+    clock.now += 2
+    wheel.touch('b')
+    clock.now += 2.5
+    assert wheel.expire() == []
+    clock.now += 1
+    assert wheel.expire() == ['a']
+    clock.now += 2
+    assert wheel.expire() == ['b']
+    assert len(wheel) == 0
+
+
+def test_touch_postpones_expiry():
+    clock = Clock()
+    wheel = TimerWheel(timeout=3, tick=1, clock=clock)
+    wheel.touch('a')
+    for _ in range(10):
+        clock.now += 2
+        wheel.touch('a')
+        assert wheel.expire() == []
+    clock.now += 4
+    assert wheel.expire() == ['a']
+
+
+def test_removed_keys_never_expire():
+    clock = Clock()
+    wheel = TimerWheel(timeout=2, tick=1, clock=clock)
+    wheel.touch('a')
+    wheel.remove('a')
+    clock.now += 10
+    assert wheel.expire() == []
+    wheel.touch('a')
+    clock.now += 3
+    assert wheel.expire() == ['a']
+
+
+def test_resume_token_works_once():
+    parked = ParkedSessions(grace=10)
+    token = parked.issue('old')
+    parked.park('old', 'state')
+    state, fresh = parked.resume(token, 'new')
+    assert state == 'state'
+    assert fresh != token
+    assert parked.resume(token, 'other') is None
+    assert not parked.issued('old')
+    assert parked.issued('new')
+    assert parked.resumed == 1
+    assert len(parked) == 0
+
+
+def test_expired_sessions_cannot_be_resumed():
+    parked = ParkedSessions(grace=10)
+    clock = Clock()
+    parked.timers = TimerWheel(10, 1, clock)
+    token = parked.issue('old')
+    parked.park('old', 'state')
+    clock.now += 11
+    assert parked.expire() == [('old', 'state')]
+    assert parked.resume(token, 'new') is None
+    assert parked.expired == 1
+
+
+def test_unparked_token_is_refused():
+    parked = ParkedSessions(grace=10)
+    token = parked.issue('live')
+    assert parked.resume(token, 'new') is None
+    assert parked.resume('bogus', 'new') is None
+
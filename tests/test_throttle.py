@@ -0,0 +1,126 @@
+import asyncio
+
+import pytest
+
+from j2dx.null.device import X360Device
+from j2dx.throttle import Throttle, TokenBucket
+from j2dx.writer import DeviceWriter
+
+
+class Clock:
+    """Steps in multiples of 1/8 s, exact in floating point, like the rates."""
+
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+class Scheduler:
+    """Records the writers asking for a turn instead of writing."""
+
+    def __init__(self):
+        self.scheduled = []
+
+    def schedule(self, writer):
+        self.scheduled.append(writer)
+
+
+def test_bucket_allows_a_burst_then_the_rate():
+    clock = Clock()
+    bucket = TokenBucket(rate=8, burst=3, clock=clock)
+    assert [bucket.take() for _ in range(4)] == [True, True, True, False]
+    assert bucket.delay() == pytest.approx(0.125)
+    clock.now += 0.0625
+    assert not bucket.take()
+    clock.now += 0.0625
+    assert bucket.take()
+    assert not bucket.take()
+
+
+def test_bucket_refills_up_to_the_burst():
+    clock = Clock()
+    bucket = TokenBucket(rate=8, burst=3, clock=clock)
+    for _ in range(3):
+        bucket.take()
+    clock.now += 60
+    assert [bucket.take() for _ in range(4)] == [True, True, True, False]
+    assert bucket.delay() == pytest.approx(0.125)
+
+
+def throttled_writer(policy, burst):
+    clock = Clock()
+    throttle = Throttle(rate=8, burst=burst, policy=policy)
+    throttle.bucket = TokenBucket(rate=8, burst=burst, clock=clock)
+    writer = DeviceWriter(X360Device('test', 'test'), Scheduler(), throttle=throttle)
+    return writer, throttle, clock
+
+
+def test_coalesce_holds_back_the_newest_value_per_axis():
+    async def run():
+        writer, throttle, clock = throttled_writer('coalesce', burst=1)
+        writer.send('left-stick-X', 0.1)
+        writer.send('left-stick-X', 0.2)
+        writer.send('left-stick-X', 0.3)
+        writer.send('left-stick-Y', -0.5)
+        assert writer._axes == {'left-stick-X': 0.1}
+        assert writer._held == {'left-stick-X': 0.3, 'left-stick-Y': -0.5}
+        assert throttle.limited == 3
+        assert throttle.coalesced == 1
+        assert throttle.dropped == 0
+        assert writer._release_timer is not None
+
+        # Buttons pass while over budget
+        writer.send('a-button', True)
+        assert list(writer._edges) == [('a-button', True)]
+
+        # Held input goes on one token at a time
+        clock.now += 0.25
+        writer._release_timer.cancel()
+        writer._release()
+        assert writer._axes == {'left-stick-X': 0.3}
+        assert writer._held == {'left-stick-Y': -0.5}
+        assert writer._release_timer is not None
+
+        clock.now += 0.125
+        writer._release_timer.cancel()
+        writer._release()
+        assert writer._axes == {'left-stick-X': 0.3, 'left-stick-Y': -0.5}
+        assert not writer._held
+        assert writer._release_timer is None
+
+    asyncio.run(run())
+
+
+def test_newer_input_within_budget_supersedes_held_input():
+    async def run():
+        writer, throttle, clock = throttled_writer('coalesce', burst=1)
+        writer.send('left-stick-X', 0.1)
+        writer.send('left-stick-X', 0.2)
+        clock.now += 0.125
+        writer.send('left-stick-X', 0.4)
+        assert writer._axes == {'left-stick-X': 0.4}
+        assert not writer._held
+        assert throttle.coalesced == 1
+        writer._release_timer.cancel()
+
+    asyncio.run(run())
+
+
+def test_drop_discards_analog_input_over_budget():
+    async def run():
+        writer, throttle, clock = throttled_writer('drop', burst=2)
+        for value in (0.1, 0.2, 0.3, 0.4):
+            writer.send('right-trigger', value)
+        writer.send('b-button', True)
+        assert writer._axes == {'right-trigger': 0.2}
+        assert list(writer._edges) == [('b-button', True)]
+        assert not writer._held
+        assert writer._release_timer is None
+        assert throttle.stats() == {
+            'throttled': 2, 'throttle_dropped': 2, 'throttle_coalesced': 0}
+        assert throttle.report() == 2
+        assert throttle.report() == 0
+
+    asyncio.run(run())